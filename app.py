@@ -1,441 +1,1256 @@
 """
-Ứng dụng web đơn giản sử dụng Flask và đa luồng với Gemini API.
+Ứng dụng web đơn giản sử dụng Flask, asyncio và đa tiến trình với Gemini API.
 """
 import os
-import time
+import io
+import atexit
+import hashlib
 import threading
-import queue
-import json
-import psutil
-from flask import Flask, request, jsonify, render_template
+import time
+import asyncio
+import concurrent.futures
+import importlib
+from flask import (Blueprint, Flask, Response, current_app, request, jsonify, render_template, send_file,
+                   stream_with_context)
 from flask_cors import CORS
-import google.generativeai as genai
+from werkzeug.local import LocalProxy
 
 # Import cấu hình từ config.py
-from config import GEMINI_API_KEY, GEMINI_MODEL, MAX_THREADS, MAX_PROCESSES, REQUEST_TIMEOUT
+from config import (GEMINI_API_KEY, GEMINI_MODEL, REQUEST_TIMEOUT, STATUS_MAX_WAIT, STATUS_BULK_MAX_IDS,
+                    STREAM_HEARTBEAT_INTERVAL, IMAGE_UPLOAD_MAX_BYTES, BATCH_MAX_ITEMS, GEMINI_API_ENDPOINT,
+                    SESSION_SUMMARY_WORDS, TOKEN_CALIBRATION_ENABLED, RESPONSES_PAGE_SIZE, RESPONSES_PAGE_MAX_SIZE)
 from process_manager import ProcessManager
+from async_engine import AsyncEngine, new_request_id
+from result_store import ResultCollector
+from image_pipeline import ImagePipeline, decode_image_data
+from image_store import ImageStore
+from response_cache import ResponseCache, make_cache_key
+from rate_limiter import RateLimiter, RateLimitError, parse_retry_after
+from batch_jobs import BatchManager
+from backends import create_backends
+from metrics import REGISTRY, QUEUE_DEPTH, ACTIVE_WORKERS, ADMISSIONS, ESTIMATED_TOKENS, ResourceSampler
+from tracing import TRACER
+from traffic_recorder import TrafficRecorder
+from session_store import SessionStore
+from token_estimator import ESTIMATOR, TokenLimitError, image_tokens
+from markdown_renderer import RENDERER
+from http_codec import ResponseCodec
+
+# Các thư viện nặng chỉ được import khi cần (tạo GeminiClient, xử lý ảnh, render Markdown,
+# lấy mẫu tài nguyên), không phải khi import app.py
+_LAZY_MODULES = ("google.generativeai", "google.api_core.exceptions", "PIL.Image", "PIL.ImageOps", "markdown", "psutil")
+
+def preload_imports():
+    """
+    Import trước các thư viện nặng mà app.py chỉ import khi cần.
 
-import base64
-import os
-from PIL import Image
-import io
+    Dùng trong tiến trình master của gunicorn (gunicorn.conf.py): các worker được fork sau đó
+    dùng chung các module đã nạp thay vì mỗi worker tự import lại.
+    """
+    for name in _LAZY_MODULES:
+        importlib.import_module(name)
 
 class GeminiClient:
     """
     Lớp để tương tác với Gemini API.
     """
-    def __init__(self):
+    def __init__(self, image_pipeline=None, image_store=None, session_store=None):
         """
         Khởi tạo client với API key từ cấu hình.
+
+        Args:
+            image_pipeline (ImagePipeline, optional): Pool tiền xử lý ảnh gửi kèm dạng base64
+            image_store (ImageStore, optional): Kho ảnh đã tải lên, dùng cho các yêu cầu có image_id
+            session_store (SessionStore, optional): Lịch sử hội thoại theo phiên, dùng cho các yêu cầu có session_id
         """
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY không được cấu hình. Vui lòng kiểm tra file .env")
 
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        # API thay thế (ví dụ server giả lập trong tools/fake_gemini.py) chỉ hỗ trợ REST;
+        # transport REST không có lời gọi bất đồng bộ nên được chạy trong luồng riêng
+        self.use_threads = bool(GEMINI_API_ENDPOINT)
+        # GenerativeModel được tạo ở lần dùng đầu tiên (xem thuộc tính model)
+        self._model = None
+        self._model_lock = threading.Lock()
+        # Lỗi vượt hạn mức (HTTP 429) của Gemini API, được chuyển thành RateLimitError
+        self.rate_limit_errors = ()
 
         # Context prompt mặc định
         self.context_prompt = "bạn là Nemo AI. Một Chat bot AI thân thiện với người dùng hãy sử dụng câu nói thân mật để giao tiếp với người dùng"
 
-        # Tạo thư mục để lưu trữ ảnh tạm thời
-        self.temp_image_dir = "static/temp_images"
-        os.makedirs(self.temp_image_dir, exist_ok=True)
+        # Pool tiền xử lý ảnh trong bộ nhớ (giải mã, thu nhỏ, mã hóa lại)
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.image_store = image_store
+        self.session_store = session_store
+        self._summary_tasks = set()  # Giữ tham chiếu đến các tác vụ tóm tắt đang chạy nền
 
-    def generate_response(self, prompt, image_data=None):
+    @property
+    def model(self):
         """
-        Gửi prompt đến Gemini API và nhận phản hồi.
+        GenerativeModel, được tạo ở lần dùng đầu tiên.
+
+        Thư viện Gemini mất gần một giây để import nên chỉ được nạp ở đây (thường là trong bước
+        khởi động trước của ChatServices), không phải khi import app.py hay khi tạo client;
+        preload_imports() nạp trước trong tiến trình master của gunicorn.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    from google.api_core import exceptions as google_exceptions
+
+                    if GEMINI_API_ENDPOINT:
+                        genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                                        client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+                    else:
+                        genai.configure(api_key=GEMINI_API_KEY)
+                    self.rate_limit_errors = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+                    self._model = genai.GenerativeModel(GEMINI_MODEL)
+        return self._model
+
+    def _build_contents(self, prompt, image_part=None):
+        """
+        Tạo nội dung gửi đến Gemini API từ prompt và ảnh đã xử lý (nếu có).
 
         Args:
             prompt (str): Câu hỏi hoặc yêu cầu của người dùng
+            image_part (dict, optional): {"mime_type": ..., "data": bytes}
+
+        Returns:
+            str hoặc list: Nội dung văn bản hoặc nội dung đa phương thức
+        """
+        # Kết hợp context prompt với câu hỏi của người dùng
+        full_prompt = f"{self.context_prompt}\n\nNgười dùng: {prompt}"
+
+        if image_part is None:
+            return full_prompt
+        return [full_prompt, image_part]
+
+    def cache_key(self, prompt, image_data=None, image_id=None):
+        """
+        Tạo khóa cache cho một yêu cầu từ mô hình, context prompt, câu hỏi và ảnh.
+
+        Args:
+            prompt (str): Câu hỏi của người dùng
             image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            image_id (str, optional): ID của ảnh đã tải lên (đã là hash nội dung)
 
         Returns:
-            str: Phản hồi từ Gemini API
+            str: Khóa cache
         """
-        try:
-            # Kết hợp context prompt với câu hỏi của người dùng
-            full_prompt = f"{self.context_prompt}\n\nNgười dùng: {prompt}"
-
-            # Nếu có ảnh, xử lý ảnh và gọi API Gemini với ảnh
-            if image_data:
-                # Xử lý ảnh
-                if image_data.startswith('data:image'):
-                    # Nếu là base64, chuyển đổi thành ảnh
-                    image_data = image_data.split(',')[1]
-                    image_bytes = base64.b64decode(image_data)
-                    image = Image.open(io.BytesIO(image_bytes))
-                elif os.path.isfile(image_data):
-                    # Nếu là đường dẫn file, mở file
-                    image = Image.open(image_data)
-                else:
-                    return "Lỗi: Định dạng ảnh không hợp lệ"
-
-                # Tạo đường dẫn tạm thời để lưu ảnh
-                timestamp = int(time.time() * 1000)
-                temp_image_path = f"{self.temp_image_dir}/temp_{timestamp}.jpg"
-                image.save(temp_image_path)
-
-                # Tạo nội dung đa phương thức
-                contents = [
-                    full_prompt,
-                    {"mime_type": "image/jpeg", "data": open(temp_image_path, "rb").read()}
-                ]
-
-                # Gọi API Gemini với nội dung đa phương thức
-                response = self.model.generate_content(contents)
-
-                # Xóa file ảnh tạm thời sau khi sử dụng
-                try:
-                    os.remove(temp_image_path)
-                except:
-                    pass
+        image_hash = None
+        if image_id:
+            image_hash = image_id
+        elif image_data:
+            image_hash = hashlib.sha256(image_data.encode("utf-8")).hexdigest()
+        return make_cache_key(GEMINI_MODEL, self.context_prompt, prompt, image_hash)
+
+    def _submit_image(self, image_data=None, image_id=None):
+        """
+        Đưa ảnh vào pool tiền xử lý.
 
-                return response.text
-            else:
-                # Gọi API Gemini chỉ với văn bản
-                response = self.model.generate_content(full_prompt)
-                return response.text
-        except Exception as e:
-            return f"Lỗi khi gọi Gemini API: {str(e)}"
+        Ảnh đã tải lên (image_id) được lấy từ bộ nhớ đệm của ImageStore nếu đã
+        xử lý trước đó.
 
-class ThreadManager:
-    """
-    Quản lý các luồng để xử lý yêu cầu đến Gemini API.
-    """
-    def __init__(self):
+        Returns:
+            concurrent.futures.Future: Kết quả (bytes, mime type), hoặc None nếu không có ảnh
+
+        Raises:
+            ValueError: Nếu có image_id nhưng không có ImageStore
         """
-        Khởi tạo ThreadManager với hàng đợi và danh sách luồng.
+        if image_id:
+            if self.image_store is None:
+                raise ValueError("Không hỗ trợ ảnh đã tải lên")
+            return self.image_store.submit_processed(image_id)
+        if image_data:
+            return self.image_pipeline.submit(image_data)
+        return None
+
+    async def _prepare_image_async(self, image_data=None, image_id=None):
         """
-        self.request_queue = queue.Queue()
-        self.response_queue = queue.Queue()
-        self.threads = []
-        self.client = GeminiClient()
-        self.stop_event = threading.Event()
-        self.responses_dict = {}  # Lưu trữ các phản hồi theo request_id
+        Tiền xử lý ảnh trên pool của ImagePipeline mà không chặn event loop.
 
-    def add_request(self, prompt, request_id=None, image_data=None):
+        Args:
+            image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            image_id (str, optional): ID của ảnh đã tải lên
+
+        Returns:
+            dict: {"mime_type": ..., "data": bytes} hoặc None nếu không có ảnh
+
+        Raises:
+            ValueError: Nếu định dạng ảnh không hợp lệ
+        """
+        future = self._submit_image(image_data, image_id)
+        if future is None:
+            return None
+        with TRACER.span("image_preprocess", image_id=image_id or ""):
+            data, mime_type = await asyncio.wrap_future(future)
+        return {"mime_type": mime_type, "data": data}
+
+    def generate_response(self, prompt, image_data=None, image_id=None):
         """
-        Thêm một yêu cầu vào hàng đợi.
+        Gửi prompt đến Gemini API và nhận phản hồi.
 
         Args:
             prompt (str): Câu hỏi hoặc yêu cầu của người dùng
-            request_id: ID của yêu cầu (nếu có)
             image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            image_id (str, optional): ID của ảnh đã tải lên
+
+        Returns:
+            str: Phản hồi từ Gemini API
         """
-        if request_id is None:
-            request_id = f"req_{int(time.time() * 1000)}"
+        image_part = None
+        try:
+            future = self._submit_image(image_data, image_id)
+            if future is not None:
+                data, mime_type = future.result()
+                image_part = {"mime_type": mime_type, "data": data}
+        except ValueError as e:
+            return f"Lỗi: {str(e)}"
 
-        self.request_queue.put((request_id, prompt, image_data))
-        return request_id
+        try:
+            response = self.model.generate_content(self._build_contents(prompt, image_part))
+            return response.text
+        except Exception as e:
+            return f"Lỗi khi gọi Gemini API: {str(e)}"
 
-    def worker(self):
-        """
-        Hàm xử lý cho mỗi luồng.
+    async def _send(self, contents, chat=None, stream=False):
         """
-        while not self.stop_event.is_set():
-            try:
-                # Lấy yêu cầu từ hàng đợi với timeout để có thể kiểm tra stop_event
-                request_id, prompt, image_data = self.request_queue.get(timeout=0.5)
-
-                print(f"Luồng {threading.current_thread().name} đang xử lý yêu cầu: {request_id}")
-
-                # Ghi lại thời gian bắt đầu và tài nguyên trước khi xử lý
-                start_time = time.time()
-                start_cpu = psutil.cpu_percent(interval=None)
-                start_memory = psutil.Process().memory_info().rss / (1024 * 1024)  # MB
-
-                # Gọi API Gemini với hoặc không có ảnh
-                response = self.client.generate_response(prompt, image_data=image_data)
-
-                # Tính toán thời gian và tài nguyên sử dụng
-                end_time = time.time()
-                end_cpu = psutil.cpu_percent(interval=None)
-                end_memory = psutil.Process().memory_info().rss / (1024 * 1024)  # MB
-
-                processing_time = round(end_time - start_time, 2)  # Thời gian xử lý (giây)
-                cpu_usage = round((start_cpu + end_cpu) / 2, 1)  # Sử dụng CPU trung bình (%)
-                memory_usage = round(end_memory - start_memory, 2)  # Sử dụng bộ nhớ (MB)
-
-                # Tạo thông tin cơ bản về phản hồi
-                basic_response = {
-                    "id": request_id,
-                    "prompt": prompt,
-                    "response": response,
-                    "thread": threading.current_thread().name,
-                    "timestamp": time.strftime("%H:%M:%S"),
-                    "has_image": image_data is not None,
-                    "imageData": image_data,
-                    "performance": {
-                        "time": processing_time,
-                        "cpu": cpu_usage,
-                        "memory": memory_usage
-                    }
-                }
-
-                # Đưa kết quả vào hàng đợi phản hồi
-                self.response_queue.put((request_id, prompt, response))
-
-                # Lưu thông tin cơ bản vào dictionary để theo dõi trạng thái
-                self.responses_dict[request_id] = basic_response
-
-                # Thêm nhiệm vụ xử lý vào ProcessManager
-                global process_manager
-                process_manager.add_task(request_id, prompt, response)
-
-                # Đánh dấu công việc đã hoàn thành
-                self.request_queue.task_done()
-
-            except queue.Empty:
-                # Hàng đợi trống, tiếp tục vòng lặp
-                continue
-            except Exception as e:
-                # Xử lý lỗi và đưa vào hàng đợi phản hồi
-                if 'request_id' in locals() and 'prompt' in locals():
-                    error_msg = f"Lỗi xử lý: {str(e)}"
-                    print(error_msg)
-                    # Thu thập thông tin về tài nguyên sử dụng khi có lỗi
-                    cpu_usage = psutil.cpu_percent(interval=None)
-                    memory_usage = psutil.Process().memory_info().rss / (1024 * 1024)  # MB
-
-                    processed_response = {
-                        "id": request_id,
-                        "prompt": prompt,
-                        "response": error_msg,
-                        "thread": threading.current_thread().name,
-                        "timestamp": time.strftime("%H:%M:%S"),
-                        "error": True,
-                        "has_image": 'image_data' in locals() and image_data is not None,
-                        "imageData": image_data if 'image_data' in locals() else None,
-                        "performance": {
-                            "time": 0,  # Không có thời gian xử lý do lỗi
-                            "cpu": round(cpu_usage, 1),
-                            "memory": round(memory_usage, 2)
-                        }
-                    }
-                    self.response_queue.put(processed_response)
-                    self.responses_dict[request_id] = processed_response
-                    self.request_queue.task_done()
-
-    def start(self, num_threads=MAX_THREADS):
-        """
-        Bắt đầu các luồng xử lý.
+        Gửi nội dung đến Gemini API, trong phiên chat nếu có.
 
         Args:
-            num_threads (int): Số lượng luồng cần tạo
+            contents: Nội dung từ _build_contents
+            chat (ChatSession, optional): Phiên chat chứa lịch sử hội thoại
+            stream (bool): Nhận phản hồi dạng stream
+
+        Returns:
+            GenerateContentResponse: Phản hồi (có thể duyệt từng đoạn nếu stream)
         """
-        self.stop_event.clear()
-        for i in range(num_threads):
-            thread = threading.Thread(target=self.worker, name=f"Thread-{i+1}", daemon=True)
-            thread.start()
-            self.threads.append(thread)
-            print(f"Đã khởi động luồng {thread.name}")
+        if self.use_threads:
+            send = chat.send_message if chat is not None else self.model.generate_content
+            return await asyncio.to_thread(send, contents, stream=stream)
+        send = chat.send_message_async if chat is not None else self.model.generate_content_async
+        return await send(contents, stream=stream)
 
-    def stop(self):
+    async def warm_up(self):
         """
-        Dừng tất cả các luồng.
+        Tạo GenerativeModel và mở sẵn kết nối đến Gemini API bằng một lời gọi đếm token (không
+        sinh nội dung), để yêu cầu đầu tiên không phải chờ import thư viện, tạo client, phân giải
+        DNS và bắt tay TLS.
         """
-        self.stop_event.set()
-        for thread in self.threads:
-            thread.join(timeout=1.0)
-        self.threads = []
+        if self.use_threads:
+            await asyncio.to_thread(self.model.count_tokens, self.context_prompt)
+        else:
+            await self.model.count_tokens_async(self.context_prompt)
 
-    def get_response(self, request_id):
+    @staticmethod
+    def _calibrate(contents, response):
+        """
+        Hiệu chỉnh bộ ước lượng token theo số token Gemini API đã đếm cho câu hỏi chỉ có văn bản.
         """
-        Lấy phản hồi theo request_id.
+        if not TOKEN_CALIBRATION_ENABLED:
+            return
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None and usage.prompt_token_count:
+            ESTIMATOR.calibrate(contents, usage.prompt_token_count)
 
-        Args:
-            request_id (str): ID của yêu cầu
+    def _start_chat(self, session_id):
+        """
+        Tạo ChatSession với lịch sử (đã giới hạn theo ngân sách token) của phiên, None nếu không dùng phiên.
+        """
+        if not session_id or self.session_store is None:
+            return None
+        return self.model.start_chat(history=self.session_store.history(session_id))
 
-        Returns:
-            dict: Phản hồi đã xử lý hoặc None nếu không tìm thấy
+    def _remember(self, session_id, prompt, response, has_image):
+        """
+        Lưu lượt hỏi-đáp vào phiên và tóm tắt các lượt cũ trong nền khi lịch sử vượt ngân sách.
         """
-        return self.responses_dict.get(request_id)
+        if self.session_store.append(session_id, prompt, response, has_image):
+            task = asyncio.get_running_loop().create_task(self._summarize(session_id))
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
 
-    def get_raw_response(self, request_id):
+    async def _summarize(self, session_id):
         """
-        Lấy phản hồi gốc (chưa xử lý) theo request_id.
+        Gộp các lượt cũ của phiên (và bản tóm tắt trước đó) thành một bản tóm tắt mới.
+        """
+        pending = self.session_store.begin_summary(session_id)
+        if pending is None:
+            return
+        summary, turns, last_seq = pending
+        lines = [f"Tóm tắt trước đó: {summary}"] if summary else []
+        for prompt, response in turns:
+            lines.append(f"Người dùng: {prompt}\nNemo AI: {response}")
+        request = (f"Tóm tắt ngắn gọn cuộc trò chuyện sau trong tối đa {SESSION_SUMMARY_WORDS} từ, "
+                   f"giữ lại các thông tin người dùng đã cung cấp và các ý chính:\n\n" + "\n\n".join(lines))
+        try:
+            response = await self._send(request)
+            self.session_store.finish_summary(session_id, response.text, last_seq)
+        except Exception as e:
+            # Lịch sử vẫn được giới hạn bằng cách bỏ các lượt cũ nhất; lần thêm lượt sau sẽ thử lại
+            self.session_store.abort_summary(session_id)
+            print(f"Lỗi khi tóm tắt phiên {session_id}: {str(e)}")
+
+    async def generate_response_async(self, prompt, image_data=None, image_id=None, session_id=None):
+        """
+        Phiên bản bất đồng bộ của generate_response, dùng generate_content_async.
 
         Args:
-            request_id (str): ID của yêu cầu
+            prompt (str): Câu hỏi hoặc yêu cầu của người dùng
+            image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            image_id (str, optional): ID của ảnh đã tải lên
+            session_id (str, optional): ID của phiên hội thoại, để gửi kèm lịch sử và lưu lượt này
 
         Returns:
-            tuple: (request_id, prompt, response) hoặc None nếu không tìm thấy
+            str: Phản hồi từ Gemini API
+
+        Raises:
+            RateLimitError: Khi Gemini API báo vượt hạn mức (HTTP 429)
+            Exception: Lỗi xử lý ảnh hoặc lỗi khác từ Gemini API, để AsyncEngine ghi nhận
+                là phản hồi lỗi (không được cache hay hậu xử lý)
         """
-        for item in list(self.response_queue.queue):
-            if isinstance(item, tuple) and len(item) >= 3 and item[0] == request_id:
-                return item
-        return None
+        image_part = await self._prepare_image_async(image_data, image_id)
+        chat = self._start_chat(session_id)
+        contents = self._build_contents(prompt, image_part)
+        try:
+            response = await self._send(contents, chat)
+        except self.rate_limit_errors as e:
+            raise RateLimitError(f"Gemini API báo vượt hạn mức: {str(e)}", parse_retry_after(e)) from e
+        if chat is None and image_part is None:
+            self._calibrate(contents, response)
+        if chat is not None:
+            self._remember(session_id, prompt, response.text, image_part is not None)
+        return response.text
+
+    async def generate_response_stream_async(self, prompt, image_data=None, image_id=None, session_id=None):
+        """
+        Gọi Gemini API ở chế độ stream và trả về từng đoạn phản hồi ngay khi nhận được.
 
-    def get_all_responses(self):
+        Args:
+            prompt (str): Câu hỏi hoặc yêu cầu của người dùng
+            image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            image_id (str, optional): ID của ảnh đã tải lên
+            session_id (str, optional): ID của phiên hội thoại, để gửi kèm lịch sử và lưu lượt này
+
+        Yields:
+            str: Đoạn phản hồi tiếp theo
+
+        Raises:
+            RateLimitError: Khi Gemini API báo vượt hạn mức (HTTP 429)
+            Exception: Lỗi xử lý ảnh hoặc lỗi khác từ Gemini API
         """
-        Lấy tất cả các phản hồi.
+        image_part = await self._prepare_image_async(image_data, image_id)
+        chat = self._start_chat(session_id)
+        contents = self._build_contents(prompt, image_part)
+        chunks = []
+        try:
+            response = await self._send(contents, chat, stream=True)
+            if self.use_threads:
+                iterator = iter(response)
+                while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+            else:
+                async for chunk in response:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        except self.rate_limit_errors as e:
+            raise RateLimitError(f"Gemini API báo vượt hạn mức: {str(e)}", parse_retry_after(e)) from e
+        if chat is None and image_part is None:
+            self._calibrate(contents, response)
+        if chat is not None:
+            self._remember(session_id, prompt, "".join(chunks), image_part is not None)
+
+class ChatServices:
+    """
+    Các thành phần xử lý yêu cầu của một ứng dụng Flask: hàng đợi, AsyncEngine, pool tiền
+    xử lý ảnh, các tiến trình hậu xử lý và các luồng nền.
 
-        Returns:
-            list: Danh sách các phản hồi
+    Các thành phần chỉ được tạo và khởi động khi gọi start(): ở request đầu tiên của mỗi
+    tiến trình, hoặc ngay sau khi worker của gunicorn được fork (gunicorn.conf.py). Nhờ vậy
+    việc import module, tiến trình cha của reloader Werkzeug hay tiến trình master của WSGI
+    server không tạo luồng hay tiến trình con nào.
+
+    Sau khi khởi động, một luồng nền làm trước những việc request đầu tiên phải chờ (khởi
+    động trước, WARMUP_ENABLED); /readyz chỉ báo sẵn sàng khi việc này đã xong.
+    """
+    def __init__(self, config, jinja_env=None):
+        """
+        Args:
+            config (flask.Config): Cấu hình của ứng dụng (các hằng số trong config.py và các giá trị ghi đè)
+            jinja_env (jinja2.Environment, optional): Môi trường template của ứng dụng, để biên dịch
+                trước các template khi khởi động
+        """
+        self.config = config
+        self.jinja_env = jinja_env
+        self.started = False
+        self.draining = False  # Đang dừng: không nhận yêu cầu mới
+        self.pid = None  # Tiến trình đã khởi động các thành phần
+        self.ready = threading.Event()  # Đã khởi động trước xong (hoặc không bật khởi động trước)
+        self.warmup = None  # Thời gian và lỗi (nếu có) của từng bước khởi động trước
+        self._lock = threading.Lock()
+
+    def start(self):
         """
-        return list(self.responses_dict.values())
+        Tạo và khởi động các thành phần (không làm gì nếu đã khởi động trong tiến trình này).
 
-    def clear_all_responses(self):
+        Raises:
+            RuntimeError: Nếu các thành phần đã được khởi động trước khi tiến trình bị fork
         """
-        Xóa tất cả các phản hồi.
+        if self.started and self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.started:
+                if self.pid != os.getpid():
+                    # Luồng và pool tiến trình không đi theo fork(), tiến trình con không dùng được
+                    raise RuntimeError("ChatServices đã được khởi động trước khi fork, hãy khởi động trong từng worker")
+                return
+            self._build()
+            self._start()
+            self.pid = os.getpid()
+            self.started = True
+            if self.config["WARMUP_ENABLED"]:
+                threading.Thread(target=self._warm_up, name="WarmUp", daemon=True).start()
+            else:
+                self.ready.set()
+
+    def _warm_up(self):
         """
-        self.responses_dict.clear()
+        Làm trước những việc request đầu tiên phải chờ: biên dịch template, nạp Pillow và
+        Python-Markdown, mở kết nối đến Gemini API.
 
-    def wait_for_completion(self):
+        Lỗi ở một bước chỉ được ghi lại: /readyz vẫn báo sẵn sàng khi đã thử xong, để instance
+        mới không bị giữ lại mãi vì Gemini API tạm thời lỗi.
         """
-        Đợi cho đến khi tất cả các yêu cầu được xử lý.
+        steps = [("templates", self._warm_templates), ("images", self.image_pipeline.warm_up),
+                 ("markdown", RENDERER.warm_up)]
+        if self.role != "web":
+            steps.append(("gemini_api", self._warm_api))
+
+        start = time.perf_counter()
+        results = {}
+        for name, step in steps:
+            step_start = time.perf_counter()
+            try:
+                step()
+                results[name] = {"seconds": round(time.perf_counter() - step_start, 3)}
+            except Exception as e:
+                results[name] = {"seconds": round(time.perf_counter() - step_start, 3), "error": str(e)}
+                print(f"Lỗi khi khởi động trước ({name}): {str(e)}")
+        self.warmup = {"seconds": round(time.perf_counter() - start, 3), "steps": results}
+        self.ready.set()
+        print(f"Đã khởi động trước trong {self.warmup['seconds']:.2f} giây (tiến trình {os.getpid()})")
+
+    def _warm_templates(self):
+        """Biên dịch trước các template (được giữ trong bộ nhớ đệm của Jinja)."""
+        if self.jinja_env is not None:
+            for name in self.jinja_env.list_templates():
+                self.jinja_env.get_template(name)
+
+    def _warm_api(self):
+        """Mở kết nối đến Gemini API trên event loop của AsyncEngine (nơi các lời gọi sau dùng lại)."""
+        future = asyncio.run_coroutine_threadsafe(self.gemini_client.warm_up(), self.request_engine.loop)
+        try:
+            future.result(timeout=self.config["WARMUP_TIMEOUT"])
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Gemini API không phản hồi sau {self.config['WARMUP_TIMEOUT']} giây")
+
+    def readiness(self):
         """
-        self.request_queue.join()
+        Trạng thái sẵn sàng nhận yêu cầu của tiến trình này (cho /readyz).
 
-# Khởi tạo ứng dụng Flask
-app = Flask(__name__)
-CORS(app)  # Cho phép cross-origin requests
+        Returns:
+            dict: ready, started, draining và kết quả khởi động trước
+        """
+        started = self.started and self.pid == os.getpid()
+        return {
+            "ready": started and self.ready.is_set() and not self.draining,
+            "started": started,
+            "draining": self.draining,
+            "warmup": self.warmup,
+        }
+
+    def _build(self):
+        """
+        Tạo các thành phần theo cấu hình (phải giữ khóa).
+        """
+        config = self.config
+        self.role = config["APP_ROLE"]
+
+        # Hàng đợi yêu cầu, kho phản hồi và kho kết quả hậu xử lý theo BACKEND: trong bộ nhớ,
+        # hàng đợi trên đĩa, hoặc dùng chung qua Redis để chạy nhiều tiến trình web/worker
+        self.request_queue, self.response_store, self.result_store = create_backends(
+            config["BACKEND"], config["REDIS_URL"], config["REDIS_PREFIX"])
+        # Stream (SSE) và việc gộp yêu cầu giống nhau chỉ hoạt động trong một tiến trình
+        self.shared_backend = config["BACKEND"] == "redis"
+
+        # Phản hồi từ Gemini API được chuyển thẳng sang ProcessManager để hậu xử lý,
+        # kết quả hậu xử lý được ResultCollector gom vào ResultStore theo request_id
+        self.process_manager = ProcessManager()
+        self.result_collector = ResultCollector(self.process_manager, self.result_store)
+
+        # Ảnh tải lên được lưu theo hash nội dung và dùng chung pool tiền xử lý với GeminiClient
+        self.image_pipeline = ImagePipeline()
+        self.image_store = ImageStore(self.image_pipeline)
+        # Lịch sử hội thoại theo session_id, giới hạn theo ngân sách token và số phiên
+        self.session_store = SessionStore()
+        if config["GEMINI_FAKE"]:
+            # Client giả lập cho kiểm thử tải (tools/loadgen.py), không cần API key
+            from tools.fake_gemini import FakeGeminiClient, FaultModel
+            self.gemini_client = FakeGeminiClient(FaultModel.from_spec(config["GEMINI_FAKE"]))
+            print(f"Đang dùng Gemini giả lập: {config['GEMINI_FAKE']}")
+        else:
+            self.gemini_client = GeminiClient(image_pipeline=self.image_pipeline, image_store=self.image_store,
+                                              session_store=self.session_store)
+        # Cache phản hồi trên đĩa cho các câu hỏi lặp lại (tùy chọn)
+        self.response_cache = ResponseCache() if config["RESPONSE_CACHE_ENABLED"] else None
+        # Giới hạn số yêu cầu/token mỗi phút theo hạn mức của Gemini API
+        self.rate_limiter = RateLimiter()
+        # Theo dõi tiến độ và kết quả của các batch job
+        self.batch_manager = BatchManager(
+            loader=lambda request_ids: self.request_engine.get_responses(request_ids, load_attachments=False))
+        # Ghi lưu lượng đã ẩn danh để phát lại bằng tools/replay.py (tùy chọn); chỉ ghi được khi
+        # yêu cầu được nhận và xử lý trong cùng một tiến trình (APP_ROLE = "all")
+        self.traffic_recorder = TrafficRecorder(config["TRAFFIC_RECORD_PATH"] if self.role == "all" else None)
+
+        # Gộp yêu cầu giống nhau theo COALESCE_REQUESTS, nhưng không bao giờ với backend dùng chung
+        self.request_engine = AsyncEngine(self.gemini_client, max_concurrency=config["MAX_CONCURRENT_REQUESTS"],
+                                          on_complete_many=self.process_manager.add_tasks,
+                                          response_cache=self.response_cache,
+                                          coalesce=config["COALESCE_REQUESTS"] and not self.shared_backend,
+                                          rate_limiter=self.rate_limiter, on_response=self._on_response,
+                                          request_queue=self.request_queue, response_store=self.response_store)
+        self.resource_sampler = ResourceSampler()
+
+    def _start(self):
+        """
+        Khởi động event loop, các tiến trình và các luồng nền (phải giữ khóa).
+        """
+        # Tiến trình chỉ nhận yêu cầu (APP_ROLE = "web") để việc gọi API và hậu xử lý cho worker.py
+        if self.role != "web":
+            self.request_engine.start()
+            self.process_manager.start(self.config["MAX_PROCESSES"])
+            self.result_collector.start()
+            print(f"Đã khởi động AsyncEngine ({self.config['MAX_CONCURRENT_REQUESTS']} yêu cầu đồng thời) "
+                  f"và {self.config['MAX_PROCESSES']} tiến trình")
+        print(f"Backend: {self.config['BACKEND']}, vai trò: {self.role}, tiến trình: {os.getpid()}")
+
+        # CPU/bộ nhớ được lấy mẫu định kỳ trong luồng nền, không đo trong từng yêu cầu
+        REGISTRY.add_collector(self._collect_metrics)
+        self.resource_sampler.start()
+        # Ghi trace của từng yêu cầu ra file (nếu cấu hình TRACE_EXPORT_PATH)
+        TRACER.start_exporter()
+        self.traffic_recorder.start()
+
+    def _on_response(self, basic_response):
+        """Cập nhật batch job và bản ghi lưu lượng khi một yêu cầu có phản hồi."""
+        self.batch_manager.record(basic_response)
+        self.traffic_recorder.complete(basic_response)
+
+    def _collect_metrics(self):
+        """Đọc độ dài các hàng đợi và số lời gọi/tiến trình đang làm việc ngay trước khi xuất /metrics."""
+        for priority_class in self.request_queue.classes:
+            QUEUE_DEPTH.set(self.request_queue.qsize(priority_class), queue=priority_class)
+        QUEUE_DEPTH.set(self.process_manager.pending_tasks(), queue="postprocess")
+        ACTIVE_WORKERS.set(self.request_engine.active_calls(), kind="api_calls")
+        ACTIVE_WORKERS.set(self.request_engine.concurrency.limit, kind="api_call_limit")
+        ACTIVE_WORKERS.set(sum(1 for process in self.process_manager.processes if process.is_alive()),
+                           kind="postprocessors")
+
+    def _pending_work(self):
+        """
+        Số yêu cầu tiến trình này còn phải xử lý trước khi dừng.
 
-# Khởi tạo ThreadManager và ProcessManager
-thread_manager = ThreadManager()
-process_manager = ProcessManager()
+        Với backend memory, yêu cầu còn trong hàng đợi sẽ mất khi dừng nên cũng phải chờ; với
+        sqlite/redis chúng vẫn nằm trong hàng đợi dùng chung/trên đĩa cho lần chạy sau hoặc worker khác.
+        """
+        pending = self.request_engine.active_calls() + self.process_manager.pending_tasks()
+        if self.config["BACKEND"] == "memory":
+            pending += self.request_engine.get_queue_size()
+        return pending
 
-# Bắt đầu các luồng và tiến trình
-thread_manager.start()
-process_manager.start()
+    def stop(self, drain_timeout=None):
+        """
+        Dừng nhận yêu cầu mới, chờ các yêu cầu đang xử lý xong (tối đa drain_timeout giây) rồi
+        dừng các luồng và tiến trình. Gọi nhiều lần không sao.
 
-print(f"Đã khởi động {MAX_THREADS} luồng và {MAX_PROCESSES} tiến trình")
+        Args:
+            drain_timeout (float, optional): Thời gian chờ tối đa (giây), mặc định SHUTDOWN_DRAIN_TIMEOUT
+        """
+        with self._lock:
+            if not self.started or self.pid != os.getpid():
+                return
+            self.draining = True
+            if drain_timeout is None:
+                drain_timeout = self.config["SHUTDOWN_DRAIN_TIMEOUT"]
+
+            if self.role != "web":
+                deadline = time.monotonic() + drain_timeout
+                pending = self._pending_work()
+                while pending and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    pending = self._pending_work()
+                if pending:
+                    print(f"Hết thời gian chờ, còn {pending} yêu cầu chưa xử lý xong")
+
+            # Yêu cầu đang xử lý dở (nếu còn) được trả lại hàng đợi trên đĩa/dùng chung khi hết hạn nhận
+            self.request_engine.stop()
+            self.result_collector.stop()
+            self.process_manager.stop()
+            self.resource_sampler.stop()
+            TRACER.stop_exporter()
+            self.traffic_recorder.stop()
+            self.image_pipeline.shutdown()
+            if self.response_cache is not None:
+                self.response_cache.close()
+            REGISTRY.remove_collector(self._collect_metrics)
+            self.started = False
+            self.ready.clear()
+            print(f"Đã dừng tất cả các luồng và tiến trình (tiến trình {os.getpid()}).")
+
+
+def _services():
+    """ChatServices của ứng dụng đang xử lý request."""
+    return current_app.extensions["chat"]
+
+def _service(name):
+    """Tham chiếu đến một thành phần của ChatServices của ứng dụng hiện tại, dùng như biến toàn cục."""
+    return LocalProxy(lambda: getattr(_services(), name))
+
+# Các route dùng các thành phần này như trước đây, nhưng chúng thuộc về ứng dụng tạo bởi create_app
+request_engine = _service("request_engine")
+result_store = _service("result_store")
+image_store = _service("image_store")
+session_store = _service("session_store")
+gemini_client = _service("gemini_client")
+response_cache = _service("response_cache")
+rate_limiter = _service("rate_limiter")
+batch_manager = _service("batch_manager")
+traffic_recorder = _service("traffic_recorder")
+
+bp = Blueprint("chat", __name__)
+
+@bp.before_app_request
+def _start_services():
+    """Khởi động các thành phần ở request đầu tiên của tiến trình; từ chối yêu cầu mới khi đang dừng."""
+    services = _services()
+    if services.draining:
+        if request.method == "POST":
+            response = jsonify({"error": "Server is shutting down"})
+            response.headers["Retry-After"] = "5"
+            return response, 503
+        return None
+    services.start()
+    return None
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Trang chủ."""
     return render_template('index.html')
 
-@app.route('/api/ask', methods=['POST'])
+def _client_id(data):
+    """
+    Xác định client gửi yêu cầu để bộ lập lịch chia lượt công bằng giữa các client.
+
+    Ưu tiên session_id trong body, sau đó là header X-Client-Id, cuối cùng là địa chỉ IP.
+    """
+    return data.get('session_id') or request.headers.get('X-Client-Id') or request.remote_addr
+
+def _image_tokens(image_id):
+    """Số token ước lượng của ảnh đã tải lên (theo kích thước sau khi thu nhỏ), 0 nếu không có ảnh."""
+    if not image_id:
+        return 0
+    try:
+        return image_tokens(*image_store.dimensions(image_id))
+    except (KeyError, OSError):
+        return 0
+
+def _save_data_url(image_data):
+    """
+    Lưu ảnh gửi kèm dạng data URL base64 vào ImageStore.
+
+    Chỉ nhận data URL: decode_image_data cũng đọc được đường dẫn file, nên nhận chuỗi bất kỳ
+    sẽ cho phép client đọc file ảnh trên server qua /api/images.
+
+    Returns:
+        str: ID của ảnh
+
+    Raises:
+        ValueError: Nếu không phải data URL base64 của ảnh hoặc không phải ảnh hợp lệ
+    """
+    if not isinstance(image_data, str) or not image_data.startswith('data:image/') or ';base64,' not in image_data:
+        raise ValueError("Image must be a base64 data URL (data:image/...;base64,...)")
+    image_id, _ = image_store.save(decode_image_data(image_data))
+    return image_id
+
+def _admit(prompt, image_token_count=0):
+    """
+    Kiểm tra kích thước câu hỏi trước khi đưa vào hàng đợi (không tốn một lượt gọi API).
+
+    Args:
+        prompt (str): Câu hỏi
+        image_token_count (int): Số token ước lượng của ảnh gửi kèm
+
+    Returns:
+        tuple: (câu hỏi (có thể đã cắt bớt), số token ước lượng, True nếu đã cắt bớt)
+
+    Raises:
+        TokenLimitError: Nếu câu hỏi vượt giới hạn token
+    """
+    # Context prompt được gửi kèm mọi câu hỏi nên cũng được tính vào giới hạn
+    fixed_tokens = image_token_count + ESTIMATOR.estimate(getattr(gemini_client, "context_prompt", ""))
+    try:
+        prompt, tokens, truncated = ESTIMATOR.admit(prompt, fixed_tokens)
+    except TokenLimitError:
+        ADMISSIONS.inc(outcome="rejected")
+        raise
+    ADMISSIONS.inc(outcome="truncated" if truncated else "accepted")
+    ESTIMATED_TOKENS.inc(tokens)
+    return prompt, tokens, truncated
+
+def _token_limit_error(e, **extra):
+    """Phản hồi 413 cho câu hỏi vượt giới hạn token."""
+    return jsonify({"error": str(e), "estimated_tokens": e.tokens, "limit": e.limit, **extra}), 413
+
+@bp.route('/api/ask', methods=['POST'])
 def ask():
     """API endpoint để gửi câu hỏi và ảnh."""
     data = request.json
     prompt = data.get('prompt')
     image_data = data.get('image')
+    image_id = data.get('image_id')
+    # Với backend dùng chung, yêu cầu có thể được xử lý ở tiến trình khác nên client
+    # nhận phản hồi qua /api/status thay vì stream
+    stream = bool(data.get('stream', False)) and not _services().shared_backend
+    # Cho phép bỏ qua cache để luôn lấy câu trả lời mới từ Gemini API
+    bypass_cache = bool(data.get('bypass_cache', False))
+
+    # Câu hỏi trong cùng một phiên được trả lời dựa trên lịch sử hội thoại của phiên
+    session_id = data.get('session_id')
 
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
 
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > 128):
+        return jsonify({"error": "session_id must be a string of at most 128 characters"}), 400
+
+    if image_id and not image_store.is_valid_id(image_id):
+        return jsonify({"error": "Invalid image_id"}), 400
+    if image_id and not image_store.exists(image_id):
+        return jsonify({"error": "Image not found"}), 404
+
+    if image_data:
+        # Ảnh gửi kèm dạng base64 cũng được lưu vào ImageStore, để phản hồi chỉ giữ image_id
+        try:
+            image_id = _save_data_url(image_data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        image_data = None
+
+    try:
+        prompt, tokens, truncated = _admit(prompt, _image_tokens(image_id))
+    except TokenLimitError as e:
+        return _token_limit_error(e)
+
     # Tạo một request mới với prompt và ảnh (nếu có)
-    request_id = thread_manager.add_request(prompt, image_data=image_data)
+    request_id = new_request_id()
+    # Ghi nhận trước khi đưa vào hàng đợi, vì phản hồi từ cache có thể xong ngay lập tức
+    if traffic_recorder.enabled:
+        traffic_recorder.arrival(request_id, "ask", prompt, image_id=image_id,
+                                 image_size=image_store.size(image_id) if image_id else 0, stream=stream)
+    try:
+        request_engine.add_request(prompt, request_id=request_id, image_data=image_data, stream=stream,
+                                   image_id=image_id, bypass_cache=bypass_cache, priority="interactive",
+                                   client_id=_client_id(data), session_id=session_id, tokens=tokens)
+    except Exception:
+        traffic_recorder.discard(request_id)
+        raise
 
     return jsonify({
         "id": request_id,
         "status": "processing",
-        "has_image": image_data is not None
+        "has_image": image_data is not None or image_id is not None,
+        "image_id": image_id,
+        "stream": stream,
+        "estimated_tokens": tokens,
+        "truncated": truncated
     })
 
-@app.route('/api/status/<request_id>', methods=['GET'])
-def status(request_id):
-    """API endpoint để kiểm tra trạng thái của yêu cầu."""
-    # Kiểm tra xem yêu cầu có trong responses_dict không
-    basic_response = thread_manager.get_response(request_id)
+@bp.route('/api/images', methods=['POST'])
+def upload_image():
+    """
+    API endpoint để tải ảnh lên (multipart, trường "image").
 
-    if basic_response:
-        # Kiểm tra xem có phản hồi đã xử lý từ ProcessManager không
-        processed_responses = process_manager.get_processed_responses()
+    Ảnh được định danh theo hash nội dung: tải lại cùng một ảnh trả về cùng một ID
+    mà không lưu thêm bản sao.
+    """
+    file = request.files.get('image')
+    if file is None:
+        return jsonify({"error": "Image file is required"}), 400
 
-        # Tìm phản hồi đã xử lý với request_id tương ứng
-        processed_response = None
-        for resp in processed_responses:
-            if resp[0] == request_id:
-                processed_response = resp
-                break
+    raw_bytes = file.read(IMAGE_UPLOAD_MAX_BYTES + 1)
+    if len(raw_bytes) > IMAGE_UPLOAD_MAX_BYTES:
+        return jsonify({"error": "Image is too large"}), 413
 
-        if processed_response:
-            # Nếu có phản hồi đã xử lý, cập nhật thông tin
-            req_id, prompt, processed_text, processor_id = processed_response
+    try:
+        image_id, existed = image_store.save(raw_bytes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "id": image_id,
+        "url": f"/api/images/{image_id}",
+        "size": len(raw_bytes),
+        "deduplicated": existed
+    })
+
+@bp.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """API endpoint trả về ảnh gốc đã tải lên."""
+    try:
+        raw_bytes, mime_type = image_store.load(image_id)
+    except KeyError:
+        return jsonify({"error": "Image not found"}), 404
+
+    # Nội dung ảnh không bao giờ thay đổi theo ID nên có thể cache lâu dài
+    response = send_file(io.BytesIO(raw_bytes), mimetype=mime_type, max_age=365 * 24 * 60 * 60)
+    response.headers["Cache-Control"] += ", immutable"
+    return response
+
+def _sse_event(event, data):
+    """Định dạng một sự kiện Server-Sent Events."""
+    return f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+
+@bp.route('/api/stream/<request_id>', methods=['GET'])
+def stream(request_id):
+    """API endpoint trả về phản hồi dạng Server-Sent Events, đẩy từng đoạn ngay khi nhận được."""
+    hub = request_engine.stream_hub
+    if not hub.has(request_id) and request_engine.get_response(request_id) is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    def generate():
+        # Nếu yêu cầu không dùng chế độ stream, subscribe() kết thúc ngay
+        # và client chỉ nhận một sự kiện done với phản hồi đầy đủ
+        for chunk in hub.subscribe(request_id, heartbeat=STREAM_HEARTBEAT_INTERVAL):
+            if chunk is None:
+                # Comment SSE để giữ kết nối khi yêu cầu còn đang chờ trong hàng đợi
+                yield ": keep-alive\n\n"
+            else:
+                yield _sse_event("chunk", {"text": chunk})
+
+        basic_response = request_engine.get_response(request_id)
+        yield _sse_event("done", _merge_processed(basic_response, None) if basic_response else None)
 
-            # Cập nhật phản hồi với thông tin đã xử lý
-            updated_response = basic_response.copy()
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _merge_processed(basic_response, processed_response):
+    """
+    Ghép phản hồi cơ bản với phản hồi đã hậu xử lý (nếu có).
+
+    Phản hồi luôn có trường html (phản hồi đã render sang HTML an toàn để chèn trực tiếp):
+    lấy từ kết quả hậu xử lý, hoặc render tại chỗ (có bộ nhớ đệm) khi chưa được hậu xử lý.
+
+    Args:
+        basic_response (dict): Phản hồi từ AsyncEngine
+        processed_response (tuple): (request_id, prompt, processed_text, processor_id, html) hoặc None;
+            processed_text là None nếu hậu xử lý lỗi (giữ nguyên phản hồi cơ bản, đánh dấu postprocess_error)
+
+    Returns:
+        dict: Bản sao phản hồi đã được cập nhật
+    """
+    updated_response = basic_response.copy()
+    html = None
+    if processed_response:
+        _, _, processed_text, processor_id, html = processed_response
+        if processed_text is None:
+            updated_response["postprocess_error"] = True
+        else:
             updated_response["response"] = processed_text
-            updated_response["processed"] = True
-            # Đảm bảo hiển thị nhất quán thông tin tiến trình
-            updated_response["processor"] = f"Tiến trình {processor_id}"
+        updated_response["processed"] = True
+        # Đảm bảo hiển thị nhất quán thông tin tiến trình
+        updated_response["processor"] = f"Tiến trình {processor_id}"
+    if html is None:
+        html = RENDERER.render(basic_response.get("response"))
+    updated_response["html"] = html
+    return updated_response
+
+@bp.route('/api/status/<request_id>', methods=['GET'])
+def status(request_id):
+    """
+    API endpoint để kiểm tra trạng thái của yêu cầu.
+
+    Với tham số ?wait=<giây>, yêu cầu được giữ lại (long-poll) cho đến khi có
+    phản hồi đã hậu xử lý hoặc hết thời gian chờ.
+    """
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), STATUS_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number"}), 400
+
+    if wait > 0:
+        deadline = time.time() + wait
+        basic_response = request_engine.wait_for_response(request_id, wait)
+        # Phản hồi lỗi không được gửi sang ProcessManager nên không cần chờ thêm
+        if basic_response and not basic_response.get("error"):
+            result_store.wait(request_id, max(deadline - time.time(), 0))
 
-            return jsonify({
+    return jsonify(_status_payload(request_id))
+
+@bp.route('/api/status', methods=['GET'])
+def bulk_status():
+    """
+    API endpoint để kiểm tra trạng thái của nhiều yêu cầu trong một lần: /api/status?ids=id1,id2,...
+    """
+    ids = [request_id for request_id in request.args.get('ids', '').split(',') if request_id]
+    if not ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(ids) > STATUS_BULK_MAX_IDS:
+        return jsonify({"error": f"At most {STATUS_BULK_MAX_IDS} ids per request"}), 400
+
+    results = {request_id: _status_payload(request_id) for request_id in ids}
+    completed = sum(1 for payload in results.values() if payload["status"] == "completed")
+    return jsonify({
+        "results": results,
+        "completed": completed,
+        "pending": len(ids) - completed
+    })
+
+def _status_payload(request_id):
+    """
+    Trạng thái của một yêu cầu: phản hồi (đã hậu xử lý nếu có) hoặc trạng thái đang xử lý.
+
+    Ở chế độ debug, payload có thêm trace (thời gian của từng bước xử lý).
+    """
+    # Kiểm tra xem yêu cầu có trong responses_dict không
+    basic_response = request_engine.get_response(request_id)
+
+    if basic_response:
+        # Tra cứu phản hồi đã hậu xử lý theo request_id mà không lấy mất kết quả của yêu cầu khác
+        processed_response = result_store.get(request_id)
+
+        if processed_response:
+            payload = {
                 "status": "completed",
-                "data": updated_response
-            })
+                "data": _merge_processed(basic_response, processed_response)
+            }
         else:
             # Nếu chưa có phản hồi đã xử lý, trả về phản hồi cơ bản
-            return jsonify({
+            payload = {
                 "status": "completed",
-                "data": basic_response,
+                "data": _merge_processed(basic_response, None),
                 "processing_status": "waiting_for_process"
-            })
+            }
+        # Ghi lại lần đầu client nhận được kết quả cuối cùng (phản hồi lỗi không được hậu xử lý)
+        if processed_response or basic_response.get("error"):
+            TRACER.picked_up(request_id)
     else:
         # Kiểm tra xem yêu cầu có đang được xử lý không
-        queue_size = thread_manager.request_queue.qsize()
-        return jsonify({
+        queue_size = request_engine.get_queue_size()
+        payload = {
             "status": "processing",
             "queue_size": queue_size
-        })
+        }
+
+    if current_app.debug:
+        payload["trace"] = TRACER.get(request_id)
+    return payload
+
+# Các trường bị bỏ khỏi /api/responses nếu không được yêu cầu qua ?fields=... (ảnh base64 có thể rất lớn;
+# ảnh đã tải lên vẫn lấy được qua /api/images/<image_id>)
+_RESPONSE_HEAVY_FIELDS = ("imageData",)
+
+# Con trỏ ?since=... được lùi lại một chút so với thời điểm đọc, để phản hồi được ghi cùng lúc
+# (hoặc từ tiến trình khác với đồng hồ lệch ít) vẫn có trong lần đồng bộ sau; client gộp theo ID
+_SYNC_OVERLAP = 1.0
 
-@app.route('/api/responses', methods=['GET'])
+@bp.route('/api/responses', methods=['GET'])
 def responses():
-    """API endpoint để lấy tất cả các phản hồi."""
-    # Lấy tất cả phản hồi cơ bản từ ThreadManager
-    basic_responses = thread_manager.get_all_responses()
-
-    # Lấy tất cả phản hồi đã xử lý từ ProcessManager
-    processed_responses = process_manager.get_processed_responses()
-
-    # Tạo dictionary để tra cứu nhanh các phản hồi đã xử lý theo request_id
-    processed_dict = {}
-    processor_dict = {}
-    for resp in processed_responses:
-        req_id, _, processed_text, processor_id = resp
-        processed_dict[req_id] = processed_text
-        processor_dict[req_id] = processor_id
-
-    # Cập nhật phản hồi cơ bản với thông tin đã xử lý (nếu có)
-    for response in basic_responses:
-        req_id = response["id"]
-        if req_id in processed_dict:
-            response["response"] = processed_dict[req_id]
-            response["processed"] = True
-            if req_id in processor_dict:
-                # Đảm bảo hiển thị nhất quán thông tin tiến trình
-                response["processor"] = f"Tiến trình {processor_dict[req_id]}"
-
-    return jsonify(basic_responses)
-
-@app.route('/api/responses/clear', methods=['POST'])
+    """
+    API endpoint trả về lịch sử phản hồi theo trang, mới nhất trước.
+
+    Tham số:
+        limit: Số phản hồi mỗi trang (mặc định RESPONSES_PAGE_SIZE)
+        cursor: next_cursor của trang trước để lấy trang tiếp theo
+        since: Giá trị sync của lần đồng bộ trước, chỉ lấy các phản hồi mới hoặc vừa được hậu xử lý
+        fields: Danh sách trường cần lấy, cách nhau bởi dấu phẩy (mặc định mọi trường trừ imageData)
+
+    Trả về {"responses": [...], "next_cursor": ... hoặc null, "sync": ...}, kèm ETag để
+    lịch sử không đổi chỉ trả về 304.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', RESPONSES_PAGE_SIZE)), 1), RESPONSES_PAGE_MAX_SIZE)
+        since = float(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({"error": "limit and since must be numbers"}), 400
+    cursor = request.args.get('cursor')
+    fields = {field.strip() for field in request.args.get('fields', '').split(',') if field.strip()} or None
+    sync = f"{time.time() - _SYNC_OVERLAP:.3f}"
+
+    # Trang được chọn từ chỉ mục (ID, thời điểm hoàn thành), chỉ nội dung của trang được đọc
+    index = request_engine.response_index()
+    if since is not None:
+        changed = result_store.changed_since(since)
+        index = [(request_id, completed_at) for request_id, completed_at in index
+                 if completed_at > since or request_id in changed]
+
+    # ID bắt đầu bằng thời điểm tạo nên sắp xếp theo ID là sắp xếp theo thời gian
+    index.sort(reverse=True)
+    if cursor:
+        index = [(request_id, completed_at) for request_id, completed_at in index if request_id < cursor]
+    page_index = index[:limit]
+    next_cursor = page_index[-1][0] if len(index) > limit else None
+    page_ids = [request_id for request_id, _ in page_index]
+    processed_dict = result_store.get_many(page_ids)
+
+    # Nội dung của một trang chỉ đổi khi có phản hồi mới hoặc phản hồi được hậu xử lý, nên ETag
+    # được tính trước khi đọc, ghép và render để trả về 304 mà không phải tạo lại nội dung
+    signature = [(request_id, completed_at, request_id in processed_dict) for request_id, completed_at in page_index]
+    etag = hashlib.sha1(repr((sorted(request.args.items(multi=True)), signature, next_cursor))
+                        .encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag, weak=True)
+        return not_modified
+
+    # Chỉ đọc lại ảnh đã ghi ra đĩa khi client thật sự cần
+    load_attachments = fields is not None and "imageData" in fields
+    merged_responses = []
+    for response in request_engine.get_responses(page_ids, load_attachments=load_attachments):
+        merged = _merge_processed(response, processed_dict.get(response["id"]))
+        if fields is not None:
+            merged = {key: value for key, value in merged.items() if key in fields or key == "id"}
+        else:
+            for key in _RESPONSE_HEAVY_FIELDS:
+                merged.pop(key, None)
+        merged_responses.append(merged)
+
+    result = jsonify({"responses": merged_responses, "next_cursor": next_cursor, "sync": sync})
+    result.set_etag(etag, weak=True)
+    # Trình duyệt luôn kiểm tra lại với server (If-None-Match) thay vì dùng bản cũ
+    result.headers["Cache-Control"] = "no-cache"
+    return result
+
+@bp.route('/api/responses/stats', methods=['GET'])
+def responses_stats():
+    """API endpoint trả về thống kê của kho lưu trữ phản hồi (số mục, dung lượng, trúng/trượt, loại bỏ)
+    và số yêu cầu đã được gộp với một yêu cầu giống hệt."""
+    stats = request_engine.responses_dict.stats()
+    stats["coalesced_requests"] = request_engine.coalesced
+    # Kết quả hậu xử lý (kèm HTML) cũng được giới hạn theo dung lượng và thời gian sống
+    stats["processed_results"] = result_store.stats()
+    # Bộ nhớ đệm render Markdown của tiến trình web (phản hồi chưa được hậu xử lý)
+    stats["markdown_cache"] = RENDERER.stats()
+    return jsonify(stats)
+
+@bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """API endpoint trả về thống kê của cache phản hồi (số mục, trúng/trượt, thời gian tiết kiệm)."""
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **response_cache.stats()})
+
+@bp.route('/api/limits', methods=['GET'])
+def limits():
+    """API endpoint trả về trạng thái giới hạn tốc độ và số lời gọi đồng thời hiện tại."""
+    return jsonify({
+        "rate_limit": rate_limiter.stats(),
+        "concurrency": request_engine.concurrency.stats(),
+        "tokens": ESTIMATOR.stats()
+    })
+
+@bp.route('/api/http/stats', methods=['GET'])
+def http_stats():
+    """API endpoint trả về số byte trước/sau khi nén và thời gian mã hóa JSON/nén theo từng endpoint."""
+    return jsonify(current_app.extensions["response_codec"].stats())
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness probe: 200 khi tiến trình đã khởi động và khởi động trước xong, 503 nếu chưa
+    (hoặc đang dừng). Request đầu tiên đến đây cũng khởi động các thành phần.
+    """
+    status = _services().readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@bp.route('/api/queue/stats', methods=['GET'])
+def queue_stats():
+    """API endpoint trả về số yêu cầu đang chờ và thời gian chờ theo từng lớp ưu tiên."""
+    return jsonify(request_engine.request_queue.stats())
+
+@bp.route('/api/sessions/stats', methods=['GET'])
+def sessions_stats():
+    """API endpoint trả về số phiên hội thoại, số token đang giữ và số lần tóm tắt."""
+    return jsonify(session_store.stats())
+
+@bp.route('/api/sessions/<session_id>', methods=['DELETE'])
+def clear_session(session_id):
+    """API endpoint để bắt đầu lại cuộc trò chuyện của một phiên."""
+    session_store.clear(session_id)
+    return jsonify({"status": "success"})
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """API endpoint trả về số liệu hoạt động theo định dạng văn bản của Prometheus."""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.route('/api/responses/clear', methods=['POST'])
 def clear_responses():
     """API endpoint để xóa tất cả các phản hồi."""
-    thread_manager.clear_all_responses()
-    # Không cần xóa phản hồi từ ProcessManager vì chúng sẽ tự động bị xóa khi lấy ra
+    request_engine.clear_all_responses()
+    result_store.clear()
     return jsonify({"status": "success", "message": "Đã xóa tất cả lịch sử chat"})
 
-@app.route('/api/batch', methods=['POST'])
+@bp.route('/api/batch', methods=['POST'])
 def batch():
-    """API endpoint để gửi nhiều câu hỏi cùng lúc."""
+    """
+    API endpoint để tạo một batch job gồm nhiều câu hỏi.
+
+    Body nhận "prompts" (danh sách câu hỏi) hoặc "items" (danh sách câu hỏi hoặc
+    {"prompt", "image_id"/"image"}), cùng "image_id" tùy chọn dùng chung cho các câu hỏi không có ảnh riêng.
+    """
     data = request.json
-    prompts = data.get('prompts', [])
+    items = data.get('items', data.get('prompts', []))
 
-    if not prompts or not isinstance(prompts, list):
+    if not items or not isinstance(items, list):
         return jsonify({"error": "Prompts array is required"}), 400
-
-    request_ids = []
-    for prompt in prompts:
-        request_id = thread_manager.add_request(prompt)
-        request_ids.append(request_id)
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} prompts per batch"}), 413
+
+    # Kiểm tra toàn bộ batch trước khi đưa yêu cầu nào vào hàng đợi
+    default_image_id = data.get('image_id')
+    uploaded = {}  # Ảnh base64 giống nhau trong batch chỉ được giải mã và lưu một lần
+    image_token_counts = {}  # Số token của mỗi ảnh, chỉ đọc header một lần
+    requests_to_add = []
+    truncated_count = 0
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict) or not item.get('prompt'):
+            return jsonify({"error": "Each item needs a prompt"}), 400
+
+        image_id = item.get('image_id') or default_image_id
+        image_data = item.get('image')
+        if image_data:
+            # Giá trị không phải chuỗi bị _save_data_url từ chối trước khi dùng làm khóa
+            if not isinstance(image_data, str) or image_data not in uploaded:
+                try:
+                    uploaded[image_data] = _save_data_url(image_data)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+            image_id = uploaded[image_data]
+        elif image_id and not image_store.is_valid_id(image_id):
+            return jsonify({"error": "Invalid image_id"}), 400
+        elif image_id and not image_store.exists(image_id):
+            return jsonify({"error": f"Image not found: {image_id}"}), 404
+
+        if image_id not in image_token_counts:
+            image_token_counts[image_id] = _image_tokens(image_id)
+        try:
+            prompt, tokens, truncated = _admit(item['prompt'], image_token_counts[image_id])
+        except TokenLimitError as e:
+            return _token_limit_error(e, index=index)
+        truncated_count += truncated
+        requests_to_add.append((prompt, image_id, tokens))
+
+    # Yêu cầu hàng loạt có độ ưu tiên thấp hơn để không chặn các câu hỏi trực tiếp
+    client_id = _client_id(data)
+    job = batch_manager.create(len(requests_to_add), client_id)
+    for request_id, (prompt, image_id, tokens) in zip(job.item_ids, requests_to_add):
+        if traffic_recorder.enabled:
+            traffic_recorder.arrival(request_id, "batch", prompt, image_id=image_id,
+                                     image_size=image_store.size(image_id) if image_id else 0,
+                                     batch_id=job.id, batch_size=len(job.item_ids))
+        try:
+            request_engine.add_request(prompt, request_id=request_id, image_id=image_id,
+                                       priority="batch", client_id=client_id, tokens=tokens)
+        except Exception:
+            traffic_recorder.discard(request_id)
+            raise
 
     return jsonify({
-        "ids": request_ids,
-        "status": "processing"
+        "job_id": job.id,
+        "ids": job.item_ids,
+        "total": len(job.item_ids),
+        "status": "processing",
+        "estimated_tokens": sum(tokens for _, _, tokens in requests_to_add),
+        "truncated": truncated_count
     })
 
+@bp.route('/api/batch/<job_id>', methods=['GET'])
+def batch_progress(job_id):
+    """API endpoint trả về tiến độ của một batch job."""
+    job = batch_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Batch job not found"}), 404
+    return jsonify(job.progress())
+
+@bp.route('/api/batch/<job_id>/results', methods=['GET'])
+def batch_results(job_id):
+    """
+    API endpoint trả về kết quả của batch job dạng NDJSON (mỗi dòng một kết quả) theo thứ tự hoàn thành.
+
+    Mặc định kết nối được giữ cho đến khi mọi câu hỏi hoàn thành; với ?follow=0 chỉ trả về
+    các kết quả đã có. Dòng trống là tín hiệu giữ kết nối khi chưa có kết quả mới.
+    """
+    if batch_manager.get(job_id) is None:
+        return jsonify({"error": "Batch job not found"}), 404
+    follow = request.args.get('follow', '1') not in ('0', 'false')
+
+    def generate():
+        for result in batch_manager.iter_results(job_id, follow=follow, heartbeat=STREAM_HEARTBEAT_INTERVAL):
+            if result is None:
+                yield "\n"
+            else:
+                yield current_app.json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def create_app(config=None):
+    """
+    Tạo ứng dụng Flask.
+
+    Chỉ tạo ứng dụng và đăng ký các route, không tạo luồng hay tiến trình nào: các thành phần
+    xử lý (ChatServices, trong app.extensions["chat"]) được khởi động ở request đầu tiên của
+    mỗi tiến trình, hoặc khi gọi app.extensions["chat"].start().
+
+    Args:
+        config (dict, optional): Giá trị ghi đè các hằng số trong config.py, ví dụ {"BACKEND": "sqlite"}
+
+    Returns:
+        Flask: Ứng dụng
+
+    Raises:
+        ValueError: Nếu thiếu GEMINI_API_KEY khi không dùng Gemini giả lập
+    """
+    app = Flask(__name__)
+    app.config.from_object("config")
+    if config:
+        app.config.update(config)
+    if not app.config["GEMINI_FAKE"] and not app.config["GEMINI_API_KEY"]:
+        raise ValueError("GEMINI_API_KEY không được cấu hình. Vui lòng kiểm tra file .env")
+
+    CORS(app)  # Cho phép cross-origin requests
+    # Mã hóa JSON bằng orjson (nếu có) và nén phản hồi theo Accept-Encoding
+    ResponseCodec().init_app(app)
+    services = ChatServices(app.config, app.jinja_env)
+    app.extensions["chat"] = services
+    app.register_blueprint(bp)
+    # Chờ các yêu cầu đang xử lý rồi dừng khi tiến trình kết thúc (server phát triển, waitress);
+    # với gunicorn, hook worker_exit trong gunicorn.conf.py dừng sớm hơn
+    atexit.register(services.stop)
+    return app
+
 if __name__ == '__main__':
     # Tạo thư mục templates nếu chưa tồn tại
     os.makedirs('templates', exist_ok=True)
 
-    try:
-        # Chạy ứng dụng Flask
-        app.run(debug=True, host='0.0.0.0', port=5000)
-    finally:
-        # Đảm bảo dừng tất cả các luồng và tiến trình khi ứng dụng kết thúc
-        thread_manager.stop()
-        process_manager.stop()
-        print("Đã dừng tất cả các luồng và tiến trình.")
+    # Ở chế độ debug, reloader chạy lại module trong một tiến trình con: tiến trình cha chỉ
+    # tạo ứng dụng, các thành phần chỉ được khởi động trong tiến trình xử lý request
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,613 @@
+"""
+Module xử lý yêu cầu đến Gemini API bằng asyncio.
+
+Thay cho mô hình mỗi yêu cầu chiếm một luồng của ThreadManager, AsyncEngine
+chạy một event loop duy nhất trong một luồng nền và giữ hàng trăm lời gọi
+API đồng thời dưới dạng coroutine. Số lời gọi đồng thời được điều chỉnh theo
+AIMD và tốc độ gọi được giới hạn theo hạn mức của Gemini API (rate_limiter.py).
+"""
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (MAX_CONCURRENT_REQUESTS, COALESCE_REQUESTS, RATE_LIMIT_MAX_RETRIES, SCHEDULER_DEFAULT_CLASS,
+                    SCHEDULER_TOKEN_UNIT)
+from metrics import (REQUESTS, REQUEST_ERRORS, QUEUE_WAIT, GEMINI_CALLS, GEMINI_LATENCY, CACHE_LOOKUPS,
+                     COALESCED)
+from rate_limiter import AdaptiveConcurrency, RateLimitError, backoff_delay, estimate_tokens
+from response_store import ResponseStore
+from scheduler import FairScheduler
+from stream_hub import StreamHub
+from tracing import TRACER, current_request
+
+
+def new_request_id():
+    """
+    Tạo ID yêu cầu không trùng lặp (kể cả khi nhiều yêu cầu được tạo trong cùng một mili giây).
+
+    Phần đầu vẫn là thời điểm tạo (mili giây) để ID sắp xếp được theo thời gian như trước.
+    """
+    return f"req_{int(time.time() * 1000)}_{uuid.uuid4().hex[:12]}"
+
+
+class AsyncEngine:
+    """
+    Điều phối các yêu cầu đến Gemini API trên một event loop asyncio.
+
+    Giữ nguyên giao diện add_request / get_response của ThreadManager để các
+    route Flask không phải thay đổi.
+    """
+    def __init__(self, client, max_concurrency=MAX_CONCURRENT_REQUESTS, on_complete=None, response_cache=None,
+                 coalesce=COALESCE_REQUESTS, rate_limiter=None, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 on_response=None, request_queue=None, response_store=None, on_complete_many=None):
+        """
+        Khởi tạo AsyncEngine.
+
+        Args:
+            client: Đối tượng có các phương thức generate_response_async(prompt, image_data, image_id)
+                và generate_response_stream_async(prompt, image_data, image_id)
+            max_concurrency (int): Số lời gọi API tối đa được chạy đồng thời (giới hạn thực tế
+                được giảm khi API báo vượt hạn mức và tăng dần trở lại)
+            on_complete (callable, optional): Hàm được gọi với (request_id, prompt, response)
+                sau khi có phản hồi, ví dụ ProcessManager.add_task
+            response_cache (ResponseCache, optional): Cache phản hồi cho các câu hỏi lặp lại;
+                khi dùng, client cần có phương thức cache_key(prompt, image_data, image_id)
+            coalesce (bool): Gộp các yêu cầu giống nhau (cùng khóa cache) đang chờ hoặc đang
+                chạy thành một lời gọi API; chỉ có tác dụng khi client có phương thức cache_key
+            rate_limiter (RateLimiter, optional): Giới hạn số yêu cầu và số token mỗi phút
+            max_retries (int): Số lần thử lại tối đa khi client báo RateLimitError
+            on_response (callable, optional): Hàm được gọi với phản hồi cơ bản (dict) của mọi
+                yêu cầu, kể cả phản hồi lỗi, ví dụ BatchManager.record
+            request_queue (optional): Hàng đợi yêu cầu (FairScheduler, DurableQueue hoặc RedisQueue),
+                mặc định là FairScheduler trong bộ nhớ
+            response_store (optional): Nơi lưu phản hồi (ResponseStore hoặc RedisResponseStore),
+                mặc định là ResponseStore trong bộ nhớ
+            on_complete_many (callable, optional): Dùng thay cho on_complete: được gọi một lần với
+                danh sách (request_id, prompt, response) của các phản hồi xong trong cùng một vòng
+                của event loop, ví dụ ProcessManager.add_tasks (một lần put cho cả lô)
+        """
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.on_complete = on_complete
+        self.on_complete_many = on_complete_many
+        self._completed = []  # Phản hồi chờ gửi on_complete_many ở cuối vòng hiện tại của event loop
+        self.on_response = on_response
+        self.response_cache = response_cache
+        # Đọc/ghi cache (SQLite) chạy trên luồng riêng để không chặn event loop, và không phải
+        # xếp hàng sau các lời gọi API đang chiếm executor mặc định
+        self._cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ResponseCache") \
+            if response_cache is not None else None
+        self.coalesce = coalesce and hasattr(client, "cache_key")
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        # Hàng đợi theo lớp ưu tiên, chia lượt công bằng giữa các client
+        self.request_queue = request_queue if request_queue is not None else FairScheduler()
+        # Lưu trữ các phản hồi theo request_id (LRU + TTL)
+        self.responses_dict = response_store if response_store is not None else ResponseStore()
+        self.stream_hub = StreamHub()  # Các đoạn phản hồi của yêu cầu dạng stream
+
+        self.loop = None
+        self.thread = None
+        self.dispatcher = None
+        self._stopping = threading.Event()
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self._tasks = set()
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+        # Yêu cầu dẫn đầu theo khóa cache; các yêu cầu giống hệt đến sau được gắn vào đó
+        self._leaders = {}
+        self._leaders_lock = threading.Lock()
+        self.coalesced = 0  # Số yêu cầu đã được gộp (không phải gọi API riêng)
+
+    def add_request(self, prompt, request_id=None, image_data=None, stream=False, image_id=None,
+                    bypass_cache=False, priority=None, client_id=None, session_id=None, tokens=None):
+        """
+        Thêm một yêu cầu vào hàng đợi.
+
+        Args:
+            prompt (str): Câu hỏi hoặc yêu cầu của người dùng
+            request_id: ID của yêu cầu (nếu có)
+            image_data (str, optional): Dữ liệu ảnh dạng base64 hoặc đường dẫn đến file ảnh
+            stream (bool): Gọi API ở chế độ stream và đẩy từng đoạn phản hồi vào stream_hub
+            image_id (str, optional): ID của ảnh đã tải lên qua ImageStore
+            bypass_cache (bool): Không dùng phản hồi đã cache (phản hồi mới vẫn được lưu vào cache)
+            priority (str, optional): Lớp ưu tiên ("interactive" hoặc "batch")
+            client_id (str, optional): Client/phiên gửi yêu cầu, để chia lượt công bằng giữa các client
+            session_id (str, optional): Phiên hội thoại; câu trả lời phụ thuộc lịch sử của phiên nên
+                yêu cầu không dùng cache và không được gộp với yêu cầu khác
+            tokens (int, optional): Số token ước lượng của câu hỏi (kể cả ảnh), dùng cho giới hạn
+                token mỗi phút và chia lượt giữa các client; mặc định ước lượng từ prompt
+        """
+        if request_id is None:
+            request_id = new_request_id()
+
+        job = {
+            "id": request_id,
+            "prompt": prompt,
+            "image_data": image_data,
+            "image_id": image_id,
+            "stream": stream,
+            "bypass_cache": bypass_cache,
+            "cache_key": None,
+            "session_id": session_id,
+            "tokens": tokens if tokens is not None else estimate_tokens(
+                prompt, image_data is not None or image_id is not None),
+            "queued_at": time.time(),
+            "followers": [],
+        }
+        if session_id is None and (self.response_cache is not None or self.coalesce):
+            job["cache_key"] = self.client.cache_key(prompt, image_data=image_data, image_id=image_id)
+
+        priority = priority or SCHEDULER_DEFAULT_CLASS
+        TRACER.start(request_id, start=job["queued_at"], priority=priority, stream=stream)
+        if stream:
+            # Mở stream ngay để client có thể kết nối trước khi yêu cầu được xử lý
+            self.stream_hub.open(request_id)
+
+        with self._idle:
+            self._in_flight += 1
+        REQUESTS.inc(priority=priority)
+
+        if self.coalesce and job["cache_key"] is not None and self._attach(job):
+            TRACER.add_span(request_id, "enqueue", job["queued_at"], time.time(), coalesced=True)
+            return request_id
+        self.request_queue.put(job, priority_class=priority, client_id=client_id,
+                               cost=max(1.0, job["tokens"] / SCHEDULER_TOKEN_UNIT))
+        TRACER.add_span(request_id, "enqueue", job["queued_at"], time.time())
+        return request_id
+
+    def _attach(self, job):
+        """
+        Gắn yêu cầu vào một yêu cầu giống hệt đang chờ hoặc đang chạy (single-flight).
+
+        Nếu chưa có, yêu cầu này trở thành yêu cầu dẫn đầu cho khóa cache của nó.
+
+        Args:
+            job (dict): Yêu cầu mới
+
+        Returns:
+            bool: True nếu đã gắn vào yêu cầu khác (không cần đưa vào hàng đợi)
+        """
+        with self._leaders_lock:
+            leader = self._leaders.get(job["cache_key"])
+            if leader is None:
+                self._leaders[job["cache_key"]] = job
+                return False
+
+            if job["stream"] and leader["stream"]:
+                # Đọc chung các đoạn phản hồi của yêu cầu dẫn đầu; nếu không được, stream
+                # riêng sẽ nhận toàn bộ phản hồi trong một đoạn khi hoàn thành
+                self.stream_hub.alias(job["id"], leader["id"])
+            leader["followers"].append(job)
+            self.coalesced += 1
+            COALESCED.inc()
+            return True
+
+    def start(self):
+        """
+        Khởi động event loop trong một luồng nền.
+        """
+        if self.thread is not None:
+            return
+
+        self._stopping.clear()
+        self.concurrency = AdaptiveConcurrency(self.max_concurrency)
+
+        # Yêu cầu còn lại trên đĩa từ lần chạy trước được xử lý lại (được tính vào
+        # _in_flight khi luồng điều phối nhận chúng, như yêu cầu từ tiến trình khác)
+        self.request_queue.replay()
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run_loop, name="AsyncEngine", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+        self.dispatcher = threading.Thread(target=self._dispatch, name="AsyncEngine-dispatch", daemon=True)
+        self.dispatcher.start()
+        print(f"Đã khởi động AsyncEngine với tối đa {self.max_concurrency} yêu cầu đồng thời")
+
+    def stop(self, timeout=5.0):
+        """
+        Dừng event loop sau khi hủy các yêu cầu đang chạy.
+
+        Args:
+            timeout (float): Thời gian tối đa chờ event loop dừng (giây)
+        """
+        if self.thread is None:
+            return
+
+        # Đánh thức luồng điều phối đang chờ get()
+        self._stopping.set()
+        self.request_queue.interrupt()
+
+        # Hủy các task đang chạy cũng trả lại chỗ trống cho luồng điều phối đang chờ acquire()
+        future = asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop)
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            pass
+        self.dispatcher.join(timeout=timeout)
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=timeout)
+        self.thread = None
+        self.dispatcher = None
+
+    async def _cancel_tasks(self):
+        """
+        Hủy các yêu cầu còn đang chạy.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _dispatch(self):
+        """
+        Lấy yêu cầu từ hàng đợi và tạo một coroutine xử lý trên event loop.
+
+        Chỉ lấy yêu cầu tiếp theo khi còn chỗ trống (AdaptiveConcurrency), nhờ vậy các yêu
+        cầu chưa được xử lý vẫn nằm trong request_queue và qsize() phản ánh
+        đúng số yêu cầu đang chờ. Lệnh get() chặn cho đến khi có yêu cầu mới
+        nên luồng không phải thức dậy định kỳ để kiểm tra tín hiệu dừng.
+        """
+        while True:
+            self.concurrency.acquire()
+            if self._stopping.is_set():
+                return
+            job = self.request_queue.get()
+            if job is None or self._stopping.is_set():
+                return
+            if job.get("remote"):
+                # Yêu cầu do tiến trình khác (hoặc lần chạy trước) thêm vào hàng đợi dùng chung
+                with self._idle:
+                    self._in_flight += 1
+            self.loop.call_soon_threadsafe(self._spawn, job)
+
+    def _spawn(self, job):
+        """
+        Tạo task xử lý một yêu cầu (chạy trong luồng của event loop).
+        """
+        task = self.loop.create_task(self._process(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _stream_response(self, job):
+        """
+        Gọi API ở chế độ stream, đẩy từng đoạn vào stream_hub.
+
+        Returns:
+            str: Toàn bộ phản hồi sau khi ghép các đoạn
+        """
+        chunks = []
+        async for chunk in self.client.generate_response_stream_async(
+                job["prompt"], image_data=job["image_data"], image_id=job["image_id"], **self._session_args(job)):
+            if not chunks:
+                job["first_chunk_at"] = time.time()
+            chunks.append(chunk)
+            job["streamed"] = True
+            self.stream_hub.publish(job["id"], chunk)
+        return "".join(chunks)
+
+    @staticmethod
+    def _session_args(job):
+        # Chỉ truyền session_id khi có, để client không hỗ trợ phiên (ví dụ client giả lập) vẫn dùng được
+        return {"session_id": job["session_id"]} if job.get("session_id") else {}
+
+    async def _call_api(self, job):
+        """
+        Gọi Gemini API trong giới hạn tốc độ, thử lại với backoff khi bị báo vượt hạn mức.
+
+        Mỗi lỗi 429 làm giảm số lời gọi đồng thời (AIMD) và tạm dừng các yêu cầu
+        mới theo gợi ý retry-after; mỗi lời gọi thành công giúp tăng dần trở lại.
+
+        Args:
+            job (dict): Yêu cầu cần xử lý
+
+        Returns:
+            str: Phản hồi từ Gemini API
+
+        Raises:
+            RateLimitError: Nếu vẫn bị từ chối sau max_retries lần thử lại
+        """
+        # Yêu cầu được phát lại từ hàng đợi cũ có thể chưa có số token ước lượng
+        tokens = job.get("tokens") or estimate_tokens(
+            job["prompt"], job["image_data"] is not None or job["image_id"] is not None)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(tokens)
+
+            start_time = time.time()
+            job.pop("first_chunk_at", None)
+            try:
+                if job["stream"]:
+                    response = await self._stream_response(job)
+                else:
+                    response = await self.client.generate_response_async(
+                        job["prompt"], image_data=job["image_data"], image_id=job["image_id"],
+                        **self._session_args(job))
+            except RateLimitError as e:
+                GEMINI_CALLS.inc(outcome="rate_limited")
+                TRACER.add_span(job["id"], "gemini_call", start_time, time.time(), attempt=attempt + 1,
+                                outcome="rate_limited", error=True)
+                self.concurrency.on_overload()
+                attempt += 1
+                # Không thử lại khi client đã nhận được một phần phản hồi dạng stream
+                if attempt > self.max_retries or job.get("streamed"):
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                if self.rate_limiter is not None and e.retry_after is not None:
+                    self.rate_limiter.pause(e.retry_after)
+                print(f"Gemini API báo vượt hạn mức, thử lại {job['id']} sau {delay:.1f}s "
+                      f"(lần {attempt}/{self.max_retries})")
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                GEMINI_CALLS.inc(outcome="error")
+                TRACER.add_span(job["id"], "gemini_call", start_time, time.time(), attempt=attempt + 1,
+                                outcome="error", error=True, **{"error.message": str(e)})
+                raise
+
+            latency = time.time() - start_time
+            GEMINI_CALLS.inc(outcome="ok")
+            TRACER.add_span(job["id"], "gemini_call", start_time, start_time + latency, attempt=attempt + 1,
+                            outcome="ok", stream=job["stream"])
+            GEMINI_LATENCY.observe(latency)
+            # Với stream, thời gian đến đoạn đầu tiên mới phản ánh tải của API; tổng thời gian
+            # còn phụ thuộc độ dài câu trả lời nên chỉ dùng cho histogram
+            first_chunk_at = job.get("first_chunk_at")
+            self.concurrency.on_success(first_chunk_at - start_time if first_chunk_at is not None else latency)
+            if self.rate_limiter is not None:
+                self.rate_limiter.consume(estimate_tokens(response))
+            return response
+
+    def _build_response(self, job, response, processing_time, error):
+        """
+        Tạo phản hồi cơ bản của một yêu cầu.
+        """
+        image_data = job["image_data"]
+        image_id = job["image_id"]
+        basic_response = {
+            "id": job["id"],
+            "prompt": job["prompt"],
+            "response": response,
+            "thread": "AsyncEngine",
+            "timestamp": time.strftime("%H:%M:%S"),
+            # Thời điểm có phản hồi (giây), dùng cho /api/responses?since=...
+            "completed_at": round(time.time(), 3),
+            "has_image": image_data is not None or image_id is not None,
+            # Ảnh đã tải lên được trả về dưới dạng URL thay vì lặp lại dữ liệu base64
+            "imageData": f"/api/images/{image_id}" if image_id else image_data,
+            "image_id": image_id,
+            "performance": {
+                "time": processing_time,
+                "in_flight": len(self._tasks),
+                "concurrency_limit": self.concurrency.limit
+            }
+        }
+        if error:
+            basic_response["error"] = True
+        return basic_response
+
+    def _complete(self, job, basic_response):
+        """
+        Lưu phản hồi và chuyển sang bước hậu xử lý nếu thành công.
+        """
+        self.responses_dict[job["id"]] = basic_response
+        self.stream_hub.purge()
+        if basic_response.get("error"):
+            REQUEST_ERRORS.inc()
+        if self.on_response is not None:
+            self.on_response(basic_response)
+        if self.on_complete_many is not None and not basic_response.get("error"):
+            # Trace kết thúc khi có kết quả hậu xử lý
+            self._completed.append((job["id"], job["prompt"], basic_response["response"]))
+            if len(self._completed) == 1:
+                self.loop.call_soon(self._flush_completed)
+        elif self.on_complete is not None and not basic_response.get("error"):
+            self.on_complete(job["id"], job["prompt"], basic_response["response"])
+        else:
+            TRACER.end(job["id"], error=bool(basic_response.get("error")))
+
+    def _flush_completed(self):
+        """
+        Gửi các phản hồi đã xong trong vòng vừa rồi của event loop cho on_complete_many.
+        """
+        completed, self._completed = self._completed, []
+        self.on_complete_many(completed)
+
+    def _resolve_followers(self, job, response, error):
+        """
+        Trả phản hồi của yêu cầu dẫn đầu cho các yêu cầu đã được gắn vào nó.
+
+        Args:
+            job (dict): Yêu cầu dẫn đầu
+            response (str): Phản hồi của yêu cầu dẫn đầu
+            error (bool): Phản hồi có phải là lỗi hay không
+        """
+        with self._leaders_lock:
+            # Từ thời điểm này, yêu cầu giống hệt mới sẽ tạo một lời gọi API mới
+            if self._leaders.get(job["cache_key"]) is job:
+                del self._leaders[job["cache_key"]]
+            followers = job["followers"]
+            job["followers"] = []
+
+        now = time.time()
+        for follower in followers:
+            try:
+                TRACER.add_span(follower["id"], "coalesced_wait", follower["queued_at"], now, leader=job["id"])
+                basic_response = self._build_response(
+                    follower, response, round(now - follower["queued_at"], 2), error)
+                basic_response["performance"]["coalesced_with"] = job["id"]
+                self._complete(follower, basic_response)
+            finally:
+                if follower["stream"]:
+                    if not job["stream"]:
+                        self.stream_hub.publish(follower["id"], response)
+                    self.stream_hub.close(follower["id"])
+                with self._idle:
+                    self._in_flight -= 1
+                    self._idle.notify_all()
+
+    async def _process(self, job):
+        """
+        Xử lý một yêu cầu: gọi Gemini API và lưu phản hồi.
+
+        Args:
+            job (dict): Yêu cầu gồm id, prompt, image_data, image_id, stream, bypass_cache,
+                cache_key và danh sách các yêu cầu giống hệt được gắn vào (followers)
+        """
+        request_id = job["id"]
+        stream = job["stream"]
+        cache_key = job["cache_key"]
+        # Các bước bên trong (ví dụ tiền xử lý ảnh của client) ghi span vào trace của yêu cầu này
+        current_request.set(request_id)
+        # Phản hồi dành cho các yêu cầu được gắn vào; giữ lỗi "đã bị hủy" nếu yêu cầu dẫn đầu
+        # bị hủy trước khi có phản hồi
+        outcome = ("Lỗi xử lý: yêu cầu đã bị hủy", True)
+        try:
+            start_time = time.time()
+            QUEUE_WAIT.observe(max(start_time - job["queued_at"], 0))
+            TRACER.add_span(request_id, "queue_wait", job["queued_at"], start_time)
+            cached = None
+            try:
+                if self.response_cache is not None and cache_key is not None and not job["bypass_cache"]:
+                    cached = await self.loop.run_in_executor(
+                        self._cache_executor, self.response_cache.get, cache_key)
+                    CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+                    TRACER.add_span(request_id, "cache_lookup", start_time, time.time(), hit=cached is not None)
+
+                if cached is not None:
+                    response = cached[0]
+                    if stream:
+                        self.stream_hub.publish(request_id, response)
+                else:
+                    response = await self._call_api(job)
+                error = False
+            except Exception as e:
+                response = f"Lỗi xử lý: {str(e)}"
+                error = True
+                print(response)
+
+            processing_time = round(time.time() - start_time, 2)
+
+            # Chỉ cache phản hồi thành công vừa nhận từ API
+            if self.response_cache is not None and cache_key is not None and cached is None and not error:
+                await self.loop.run_in_executor(
+                    self._cache_executor, self.response_cache.set, cache_key, response, processing_time)
+
+            basic_response = self._build_response(job, response, processing_time, error)
+            if self.response_cache is not None:
+                basic_response["performance"]["cache"] = {
+                    "hit": cached is not None,
+                    # Thời gian gọi API ban đầu của phản hồi đã cache, tức thời gian tiết kiệm được
+                    "saved": cached[1] if cached is not None else 0,
+                    "hit_ratio": self.response_cache.hit_ratio()
+                }
+            self._complete(job, basic_response)
+            # Chỉ xác nhận khi đã có phản hồi: yêu cầu bị hủy giữa chừng (khi dừng ứng dụng)
+            # vẫn còn trong hàng đợi trên đĩa và được phát lại khi khởi động
+            outcome = (response, error)
+            self.request_queue.ack(job)
+        finally:
+            # Trả phản hồi cho các yêu cầu được gắn vào đúng một lần, kể cả khi bị hủy giữa chừng
+            self._resolve_followers(job, *outcome)
+            # Đóng stream sau khi đã lưu phản hồi để client nhận được dữ liệu đầy đủ
+            if stream:
+                self.stream_hub.close(request_id)
+            self.concurrency.release()
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def get_response(self, request_id):
+        """
+        Lấy phản hồi theo request_id.
+
+        Args:
+            request_id (str): ID của yêu cầu
+
+        Returns:
+            dict: Phản hồi hoặc None nếu chưa có
+        """
+        return self.responses_dict.get(request_id)
+
+    def wait_for_response(self, request_id, timeout):
+        """
+        Chờ đến khi có phản hồi cho request_id hoặc hết thời gian.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            timeout (float): Thời gian chờ tối đa (giây)
+
+        Returns:
+            dict: Phản hồi hoặc None nếu hết thời gian
+        """
+        return self.responses_dict.wait(request_id, timeout)
+
+    def response_index(self):
+        """
+        ID và thời điểm hoàn thành của tất cả các phản hồi (không đọc nội dung).
+
+        Returns:
+            list: Danh sách (request_id, completed_at)
+        """
+        return list(self.responses_dict.index())
+
+    def get_responses(self, request_ids, load_attachments=True):
+        """
+        Lấy phản hồi của các yêu cầu theo thứ tự của request_ids (bỏ qua ID không còn).
+        """
+        return self.responses_dict.get_many(request_ids, load_attachments=load_attachments)
+
+    def get_all_responses(self, load_attachments=True):
+        """
+        Lấy tất cả các phản hồi.
+
+        Args:
+            load_attachments (bool): Đọc lại ảnh đính kèm đã ghi ra đĩa vào trường imageData
+
+        Returns:
+            list: Danh sách các phản hồi
+        """
+        return list(self.responses_dict.values(load_attachments=load_attachments))
+
+    def clear_all_responses(self):
+        """
+        Xóa tất cả các phản hồi.
+        """
+        self.responses_dict.clear()
+
+    def active_calls(self):
+        """
+        Số yêu cầu đang được xử lý trên event loop.
+        """
+        return len(self._tasks)
+
+    def get_queue_size(self):
+        """
+        Số yêu cầu đang chờ trong hàng đợi (chưa được gửi đến API).
+        """
+        return self.request_queue.qsize()
+
+    def wait_for_completion(self, timeout=None):
+        """
+        Đợi cho đến khi tất cả các yêu cầu được xử lý.
+
+        Args:
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            bool: True nếu không còn yêu cầu nào đang xử lý
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
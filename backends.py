@@ -0,0 +1,504 @@
+"""
+Module chọn nơi lưu hàng đợi yêu cầu và kết quả (backend).
+
+- memory: hàng đợi và kết quả nằm trong bộ nhớ của tiến trình (mặc định, một tiến trình web)
+- sqlite: hàng đợi trên đĩa (DurableQueue), kết quả trong bộ nhớ
+- redis:  hàng đợi và kết quả dùng chung qua một server Redis, để nhiều tiến trình
+          web (ví dụ các worker của gunicorn) và nhiều tiến trình xử lý (worker.py)
+          trên nhiều máy cùng làm việc với một hàng đợi
+
+Backend redis dùng thư viện redis-py, chỉ cần cài khi dùng backend này.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from config import (BACKEND, REDIS_URL, REDIS_PREFIX, SCHEDULER_CLASSES, SCHEDULER_DEFAULT_CLASS,
+                    SCHEDULER_AGING, RESPONSE_STORE_TTL, DURABLE_QUEUE_VISIBILITY_TIMEOUT, REDIS_POLL_INTERVAL)
+from durable_queue import DurableQueue
+from response_store import ResponseStore
+from result_store import ResultStore
+from scheduler import FairScheduler
+
+# Các trường của yêu cầu được gửi qua Redis (các trường còn lại chỉ có ý nghĩa trong bộ nhớ)
+_PERSISTED_FIELDS = ("id", "prompt", "image_data", "image_id", "stream", "bypass_cache", "cache_key", "session_id", "tokens", "queued_at")
+
+
+def create_backends(backend=BACKEND, url=REDIS_URL, prefix=REDIS_PREFIX):
+    """
+    Tạo hàng đợi yêu cầu, kho phản hồi và kho kết quả hậu xử lý theo backend.
+
+    Args:
+        backend (str): "memory", "sqlite" hoặc "redis"
+        url (str): Địa chỉ server Redis (chỉ dùng với backend redis)
+        prefix (str): Tiền tố của các khóa trong Redis
+
+    Returns:
+        tuple: (request_queue, response_store, result_store)
+
+    Raises:
+        ValueError: Nếu backend không được hỗ trợ
+    """
+    if backend == "memory":
+        return FairScheduler(), ResponseStore(), ResultStore()
+    if backend == "sqlite":
+        return DurableQueue(), ResponseStore(), ResultStore()
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Backend redis cần thư viện redis-py: pip install redis")
+        client = redis.Redis.from_url(url, decode_responses=True)
+        return RedisQueue(client, prefix), RedisResponseStore(client, prefix), RedisResultStore(client, prefix)
+    raise ValueError(f"Backend không được hỗ trợ: {backend}")
+
+
+class RedisQueue:
+    """
+    Hàng đợi yêu cầu dùng chung trong Redis với claim/ack và visibility timeout.
+
+    Mỗi lớp ưu tiên là một list; yêu cầu được nhận bằng RPOPLPUSH sang list
+    "processing" và hạn nhận được ghi vào hash "claims", nên yêu cầu của một
+    worker bị dừng giữa chừng được trả lại hàng đợi khi hết hạn. Có cùng giao
+    diện với FairScheduler / DurableQueue (phục vụ theo thứ tự đến trong mỗi lớp).
+
+    Yêu cầu luôn được dựng lại từ dữ liệu trong Redis, nên không giữ được các yêu
+    cầu được gộp (followers) hay stream của tiến trình đã thêm vào: khi dùng hàng
+    đợi này cần tắt coalesce và stream của AsyncEngine.
+    """
+    def __init__(self, client, prefix=REDIS_PREFIX, classes=SCHEDULER_CLASSES, default_class=SCHEDULER_DEFAULT_CLASS,
+                 aging=SCHEDULER_AGING, visibility_timeout=DURABLE_QUEUE_VISIBILITY_TIMEOUT,
+                 poll_interval=REDIS_POLL_INTERVAL):
+        """
+        Args:
+            client (redis.Redis): Kết nối Redis (decode_responses=True)
+            prefix (str): Tiền tố của các khóa
+            classes (tuple): Tên các lớp ưu tiên, từ cao đến thấp
+            default_class (str): Lớp dùng khi put() không chỉ định lớp
+            aging (float): Yêu cầu ở lớp thấp chờ lâu hơn khoảng này (giây) được phục vụ trước
+            visibility_timeout (float): Thời gian một yêu cầu đã nhận được giữ riêng (giây)
+            poll_interval (float): Chu kỳ kiểm tra hàng đợi khi đang rỗng (giây)
+        """
+        if default_class not in classes:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {default_class}")
+        self.client = client
+        self.classes = tuple(classes)
+        self.default_class = default_class
+        self.aging = aging
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._keys = {name: f"{prefix}queue:{name}" for name in self.classes}
+        self._processing_key = f"{prefix}queue:processing"
+        self._claims_key = f"{prefix}queue:claims"
+
+        self._lock = threading.Lock()
+        self._claimed = {}  # request_id -> dữ liệu thô trong list processing (để ack)
+        self._interrupted = threading.Event()
+        self._aged_last = False
+        self._last_reap = 0.0
+        self._waits = {name: deque(maxlen=1000) for name in self.classes}
+        self._counters = {name: {"enqueued": 0, "dequeued": 0, "aged": 0} for name in self.classes}
+
+    def put(self, item, priority_class=None, client_id=None, cost=1.0):
+        """
+        Đưa một yêu cầu vào hàng đợi dùng chung.
+
+        Args:
+            item (dict): Yêu cầu (có trường "id")
+            priority_class (str, optional): Lớp ưu tiên (mặc định là default_class)
+            client_id (str, optional): Client/phiên gửi yêu cầu
+            cost (float): Chi phí của yêu cầu (không dùng, hàng đợi này phục vụ theo thứ tự đến)
+
+        Raises:
+            ValueError: Nếu lớp ưu tiên không tồn tại
+        """
+        priority_class = priority_class or self.default_class
+        if priority_class not in self.classes:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {priority_class}")
+
+        payload = {key: item.get(key) for key in _PERSISTED_FIELDS}
+        payload["priority"] = priority_class
+        payload["owner"] = self.owner
+        payload["enqueued_at"] = time.time()
+        with self._lock:
+            self._counters[priority_class]["enqueued"] += 1
+        # LPUSH để phần tử cũ nhất luôn ở cuối list (RPOPLPUSH lấy từ cuối)
+        self.client.lpush(self._keys[priority_class], json.dumps(payload, ensure_ascii=False))
+
+    def get(self, timeout=None):
+        """
+        Nhận yêu cầu tiếp theo, chặn cho đến khi có yêu cầu.
+
+        Args:
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            dict: Yêu cầu đã nhận, hoặc None nếu hết thời gian chờ hay bị interrupt()
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            if self._interrupted.is_set():
+                self._interrupted.clear()
+                return None
+
+            item = self._claim()
+            if item is not None:
+                return item
+
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            self._interrupted.wait(wait)
+
+    def _claim(self):
+        """
+        Nhận yêu cầu tiếp theo theo lớp ưu tiên và aging.
+        """
+        now = time.time()
+        # Định kỳ trả lại các yêu cầu đã hết hạn nhận của các worker khác
+        if now - self._last_reap > self.visibility_timeout / 10:
+            self.replay(release_all=False)
+
+        # Aging giống FairScheduler: không chọn nhờ aging hai lần liên tiếp
+        order = list(self.classes)
+        aged_class = None
+        if not self._aged_last:
+            for name in reversed(self.classes[1:]):
+                oldest = self.client.lindex(self._keys[name], -1)
+                if oldest is not None and now - json.loads(oldest)["enqueued_at"] > self.aging:
+                    order.remove(name)
+                    order.insert(0, name)
+                    aged_class = name
+                    break
+
+        for name in order:
+            raw = self.client.rpoplpush(self._keys[name], self._processing_key)
+            if raw is None:
+                continue
+            payload = json.loads(raw)
+            self.client.hset(self._claims_key, payload["id"], now + self.visibility_timeout)
+
+            self._aged_last = name == aged_class
+            with self._lock:
+                self._claimed[payload["id"]] = raw
+                counters = self._counters[name]
+                counters["dequeued"] += 1
+                if self._aged_last:
+                    counters["aged"] += 1
+                self._waits[name].append(now - payload["enqueued_at"])
+
+            item = {key: payload.get(key) for key in _PERSISTED_FIELDS}
+            item["followers"] = []
+            # Yêu cầu do tiến trình khác thêm vào chưa được AsyncEngine của tiến trình này tính
+            item["remote"] = payload["owner"] != self.owner
+            return item
+
+        self._aged_last = False
+        return None
+
+    def ack(self, item):
+        """
+        Xác nhận đã xử lý xong một yêu cầu.
+
+        Args:
+            item (dict): Yêu cầu đã nhận từ get()
+        """
+        with self._lock:
+            raw = self._claimed.pop(item["id"], None)
+        if raw is not None:
+            self.client.lrem(self._processing_key, 1, raw)
+        self.client.hdel(self._claims_key, item["id"])
+
+    def interrupt(self):
+        """
+        Đánh thức luồng đang chờ trong get() (get() trả về None), dùng khi dừng AsyncEngine.
+        """
+        self._interrupted.set()
+
+    def replay(self, release_all=False):
+        """
+        Trả lại hàng đợi các yêu cầu đã hết hạn nhận.
+
+        Args:
+            release_all (bool): Trả lại mọi yêu cầu đang được nhận, kể cả khi chưa hết hạn;
+                chỉ dùng khi chắc chắn không còn worker nào khác đang chạy
+
+        Returns:
+            int: Số yêu cầu đã được trả lại hàng đợi
+        """
+        now = time.time()
+        self._last_reap = now
+        claims = self.client.hgetall(self._claims_key)
+        released = 0
+        for raw in self.client.lrange(self._processing_key, 0, -1):
+            payload = json.loads(raw)
+            deadline = claims.get(payload["id"])
+            if deadline is None and not release_all:
+                # Worker bị dừng giữa RPOPLPUSH và HSET: bắt đầu tính hạn nhận từ bây giờ
+                self.client.hset(self._claims_key, payload["id"], now + self.visibility_timeout)
+                continue
+            if release_all or float(deadline) < now:
+                # Chỉ yêu cầu còn trong list processing mới được trả lại (tránh trả lại hai lần)
+                if self.client.lrem(self._processing_key, 1, raw):
+                    self.client.rpush(self._keys[payload["priority"]], raw)
+                    released += 1
+                self.client.hdel(self._claims_key, payload["id"])
+        if released:
+            print(f"Trả lại {released} yêu cầu đã hết hạn nhận vào hàng đợi Redis")
+        return released
+
+    def qsize(self, priority_class=None):
+        """
+        Số yêu cầu đang chờ (của một lớp hoặc của tất cả các lớp).
+        """
+        names = [priority_class] if priority_class is not None else self.classes
+        return sum(self.client.llen(self._keys[name]) for name in names)
+
+    def stats(self):
+        """
+        Thống kê theo từng lớp ưu tiên, cùng định dạng với FairScheduler.stats().
+
+        Số đã vào/ra hàng đợi và thời gian chờ chỉ tính trong tiến trình hiện tại.
+        """
+        now = time.time()
+        claimed = self.client.hlen(self._claims_key)
+        result = {}
+        for name in self.classes:
+            oldest = self.client.lindex(self._keys[name], -1)
+            with self._lock:
+                waits = sorted(self._waits[name])
+                counters = dict(self._counters[name])
+            result[name] = {
+                "depth": self.client.llen(self._keys[name]),
+                **counters,
+                "wait": {
+                    "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                    "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                    "max": round(waits[-1], 3) if waits else 0.0,
+                    "oldest_pending": round(now - json.loads(oldest)["enqueued_at"], 3) if oldest else 0.0,
+                },
+            }
+        result["claimed"] = claimed
+        return result
+
+
+class RedisResponseStore:
+    """
+    Kho phản hồi dùng chung trong Redis, cùng giao diện với ResponseStore.
+
+    Mỗi phản hồi là một khóa JSON có TTL; một sorted set theo thời gian lưu
+    danh sách ID để liệt kê các phản hồi gần đây.
+    """
+    def __init__(self, client, prefix=REDIS_PREFIX, ttl=RESPONSE_STORE_TTL, poll_interval=REDIS_POLL_INTERVAL):
+        """
+        Args:
+            client (redis.Redis): Kết nối Redis (decode_responses=True)
+            prefix (str): Tiền tố của các khóa
+            ttl (float): Thời gian sống của mỗi phản hồi (giây)
+            poll_interval (float): Chu kỳ kiểm tra khi chờ một phản hồi (giây)
+        """
+        self.client = client
+        self.prefix = f"{prefix}response:"
+        self.index_key = f"{prefix}responses"
+        self.ttl = int(ttl)
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+
+    def __setitem__(self, request_id, response):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + request_id, json.dumps(response, ensure_ascii=False), ex=self.ttl)
+        # Điểm là thời điểm hoàn thành để index() không phải đọc nội dung phản hồi
+        pipe.zadd(self.index_key, {request_id: response.get("completed_at") or time.time()})
+        pipe.zremrangebyscore(self.index_key, 0, time.time() - self.ttl)
+        pipe.execute()
+
+    def get(self, request_id, default=None, load_attachments=True):
+        """
+        Lấy phản hồi theo request_id.
+
+        Returns:
+            dict: Phản hồi hoặc default
+        """
+        raw = self.client.get(self.prefix + request_id)
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(raw)
+
+    def wait(self, request_id, timeout):
+        """
+        Chờ đến khi có phản hồi cho request_id hoặc hết thời gian.
+
+        Returns:
+            dict: Phản hồi hoặc None nếu hết thời gian
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.get(request_id)
+            remaining = deadline - time.monotonic()
+            if response is not None or remaining <= 0:
+                return response
+            time.sleep(min(self.poll_interval, remaining))
+
+    def __contains__(self, request_id):
+        return bool(self.client.exists(self.prefix + request_id))
+
+    def __len__(self):
+        return self.client.zcard(self.index_key)
+
+    def values(self, load_attachments=True):
+        """
+        Lấy tất cả các phản hồi còn hiệu lực, từ cũ đến mới.
+        """
+        ids = self.client.zrangebyscore(self.index_key, time.time() - self.ttl, "+inf")
+        if not ids:
+            return []
+        raws = self.client.mget([self.prefix + request_id for request_id in ids])
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    def index(self):
+        """
+        ID và thời điểm lưu của các phản hồi còn hiệu lực, chỉ đọc sorted set (không đọc nội dung).
+
+        Returns:
+            list: Danh sách (request_id, completed_at)
+        """
+        return self.client.zrangebyscore(self.index_key, time.time() - self.ttl, "+inf", withscores=True)
+
+    def get_many(self, request_ids, load_attachments=True):
+        """
+        Lấy phản hồi của nhiều yêu cầu bằng một lệnh MGET, theo thứ tự của request_ids.
+        """
+        request_ids = list(request_ids)
+        if not request_ids:
+            return []
+        raws = self.client.mget([self.prefix + request_id for request_id in request_ids])
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    def clear(self):
+        """
+        Xóa tất cả các phản hồi.
+        """
+        ids = self.client.zrange(self.index_key, 0, -1)
+        if ids:
+            self.client.delete(*[self.prefix + request_id for request_id in ids])
+        self.client.delete(self.index_key)
+
+    def stats(self):
+        """
+        Thống kê của kho phản hồi (số lần trúng/trượt chỉ tính trong tiến trình hiện tại).
+        """
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class RedisResultStore:
+    """
+    Kho phản hồi đã hậu xử lý dùng chung trong Redis, cùng giao diện với ResultStore.
+
+    Như RedisResponseStore, mỗi kết quả là một khóa JSON có TTL riêng và một sorted set
+    theo thời gian lưu danh sách ID (cho changed_since và get_all).
+    """
+    def __init__(self, client, prefix=REDIS_PREFIX, ttl=RESPONSE_STORE_TTL, poll_interval=REDIS_POLL_INTERVAL):
+        """
+        Args:
+            client (redis.Redis): Kết nối Redis (decode_responses=True)
+            prefix (str): Tiền tố của các khóa
+            ttl (float): Thời gian sống của mỗi kết quả (giây)
+            poll_interval (float): Chu kỳ kiểm tra khi chờ một kết quả (giây)
+        """
+        self.client = client
+        self.prefix = f"{prefix}processed:"
+        self.updated_key = f"{prefix}processed_at"  # sorted set: request_id -> thời điểm có kết quả
+        self.ttl = int(ttl)
+        self.poll_interval = poll_interval
+
+    def put(self, request_id, prompt, processed_response, processor_id, html=None):
+        """
+        Lưu một phản hồi đã hậu xử lý (kèm HTML đã render).
+        """
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + request_id,
+                 json.dumps([request_id, prompt, processed_response, processor_id, html], ensure_ascii=False),
+                 ex=self.ttl)
+        pipe.zadd(self.updated_key, {request_id: time.time()})
+        pipe.zremrangebyscore(self.updated_key, 0, time.time() - self.ttl)
+        pipe.expire(self.updated_key, self.ttl)
+        pipe.execute()
+
+    def get(self, request_id):
+        """
+        Lấy phản hồi đã hậu xử lý theo request_id.
+
+        Returns:
+            tuple: (request_id, prompt, processed_response, processor_id, html) hoặc None
+        """
+        raw = self.client.get(self.prefix + request_id)
+        return tuple(json.loads(raw)) if raw is not None else None
+
+    def wait(self, request_id, timeout):
+        """
+        Chờ đến khi có phản hồi đã hậu xử lý cho request_id hoặc hết thời gian.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.get(request_id)
+            remaining = deadline - time.monotonic()
+            if result is not None or remaining <= 0:
+                return result
+            time.sleep(min(self.poll_interval, remaining))
+
+    def get_many(self, request_ids):
+        """
+        Lấy phản hồi đã hậu xử lý của nhiều yêu cầu bằng một lệnh MGET.
+        """
+        request_ids = list(request_ids)
+        if not request_ids:
+            return {}
+        raws = self.client.mget([self.prefix + request_id for request_id in request_ids])
+        return {request_id: tuple(json.loads(raw)) for request_id, raw in zip(request_ids, raws) if raw is not None}
+
+    def changed_since(self, since):
+        """
+        ID các yêu cầu có kết quả hậu xử lý sau thời điểm since.
+        """
+        return set(self.client.zrangebyscore(self.updated_key, f"({since}", "+inf"))
+
+    def get_all(self):
+        """
+        Lấy tất cả các phản hồi đã hậu xử lý.
+
+        Returns:
+            dict: request_id -> (request_id, prompt, processed_response, processor_id, html)
+        """
+        return self.get_many(self.client.zrangebyscore(self.updated_key, time.time() - self.ttl, "+inf"))
+
+    def clear(self):
+        """
+        Xóa tất cả các phản hồi đã hậu xử lý.
+        """
+        ids = self.client.zrange(self.updated_key, 0, -1)
+        if ids:
+            self.client.delete(*[self.prefix + request_id for request_id in ids])
+        self.client.delete(self.updated_key)
+
+    def stats(self):
+        """
+        Số kết quả còn trong chỉ mục (mỗi kết quả tự hết hạn theo TTL của khóa).
+        """
+        return {"backend": "redis", "entries": self.client.zcard(self.updated_key)}
@@ -0,0 +1,207 @@
+"""
+Module quản lý các batch job (nhiều câu hỏi gửi trong một lần).
+
+Mỗi batch job giữ danh sách ID của các yêu cầu con và thứ tự hoàn thành của chúng
+(chỉ ID, nội dung được đọc lại từ kho phản hồi khi trả kết quả), để client theo dõi
+tiến độ và tải toàn bộ kết quả trong một lần (NDJSON) thay vì hỏi trạng thái từng yêu cầu.
+"""
+import threading
+import time
+import uuid
+
+from async_engine import new_request_id
+from config import BATCH_JOB_TTL
+
+
+class BatchJob:
+    """
+    Một batch job và kết quả của các yêu cầu con.
+    """
+    def __init__(self, job_id, item_ids, client_id=None):
+        """
+        Args:
+            job_id (str): ID của batch job
+            item_ids (list): ID của các yêu cầu con theo thứ tự gửi
+            client_id (str, optional): Client đã tạo batch job
+        """
+        self.id = job_id
+        self.item_ids = item_ids
+        self.client_id = client_id
+        self.created_at = time.time()
+        self.finished_at = None
+        self.results = []  # ID, vị trí và trạng thái lỗi theo thứ tự hoàn thành (không giữ nội dung)
+        self.failed = 0
+
+    def progress(self):
+        """
+        Tiến độ của batch job.
+
+        Returns:
+            dict: Số yêu cầu đã xong/lỗi/đang chờ, phần trăm và thời gian ước lượng còn lại
+        """
+        total = len(self.item_ids)
+        completed = len(self.results)
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        eta = None
+        if 0 < completed < total:
+            eta = round(elapsed / completed * (total - completed), 1)
+        return {
+            "job_id": self.id,
+            "status": "completed" if completed == total else "processing",
+            "total": total,
+            "completed": completed,
+            "failed": self.failed,
+            "pending": total - completed,
+            "percent": round(completed * 100 / total, 1) if total else 100.0,
+            "elapsed": round(elapsed, 2),
+            "eta": eta,
+        }
+
+
+class BatchManager:
+    """
+    Lưu các batch job và cập nhật tiến độ khi AsyncEngine hoàn thành từng yêu cầu.
+    """
+    def __init__(self, ttl=BATCH_JOB_TTL, loader=None):
+        """
+        Args:
+            ttl (float): Thời gian giữ lại một batch job sau khi tạo (giây)
+            loader (callable, optional): Hàm nhận danh sách request_id và trả về các phản hồi
+                cơ bản còn lưu (ví dụ AsyncEngine.get_responses), dùng để điền nội dung kết quả
+        """
+        self.ttl = ttl
+        self.loader = loader
+        self._jobs = {}
+        self._item_jobs = {}  # request_id -> (batch job, vị trí trong batch)
+        self._condition = threading.Condition()
+        self._last_purge = time.time()
+
+    def create(self, count, client_id=None):
+        """
+        Tạo một batch job mới với count yêu cầu con.
+
+        Args:
+            count (int): Số yêu cầu trong batch
+            client_id (str, optional): Client tạo batch job
+
+        Returns:
+            BatchJob: Batch job mới với ID của các yêu cầu con đã được cấp
+        """
+        job = BatchJob(f"batch_{uuid.uuid4().hex}", [new_request_id() for _ in range(count)], client_id)
+        with self._condition:
+            self._purge_expired(force=True)
+            self._jobs[job.id] = job
+            for index, item_id in enumerate(job.item_ids):
+                self._item_jobs[item_id] = (job, index)
+        return job
+
+    def get(self, job_id):
+        """
+        Lấy batch job theo ID, None nếu không tồn tại.
+        """
+        with self._condition:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            if job is not None and time.time() - job.created_at > self.ttl:
+                return None
+            return job
+
+    def record(self, response):
+        """
+        Ghi nhận phản hồi của một yêu cầu (dùng làm callback on_response của AsyncEngine).
+
+        Args:
+            response (dict): Phản hồi cơ bản của yêu cầu
+        """
+        with self._condition:
+            self._purge_expired()
+            entry = self._item_jobs.pop(response["id"], None)
+            if entry is None:
+                return
+            job, index = entry
+            result = {"id": response["id"], "index": index}
+            if response.get("error"):
+                result["error"] = True
+                job.failed += 1
+            job.results.append(result)
+            if len(job.results) == len(job.item_ids):
+                job.finished_at = time.time()
+            self._condition.notify_all()
+
+    def iter_results(self, job_id, follow=True, heartbeat=None):
+        """
+        Đọc kết quả của batch job theo thứ tự hoàn thành.
+
+        Args:
+            job_id (str): ID của batch job
+            follow (bool): Chờ các yêu cầu chưa xong; nếu False chỉ trả về kết quả hiện có
+            heartbeat (float, optional): Nếu không có kết quả mới sau khoảng thời gian
+                này (giây), trả về None để nơi gọi có thể gửi tín hiệu giữ kết nối
+
+        Yields:
+            dict hoặc None: Kết quả gọn của một yêu cầu (id, index, prompt, response, error),
+                hoặc None khi hết thời gian heartbeat. Nếu phản hồi không còn trong kho thì
+                prompt và response là None và có thêm "expired": True
+        """
+        position = 0
+        while True:
+            with self._condition:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                total = len(job.item_ids)
+                if follow and position < total:
+                    self._condition.wait_for(
+                        lambda: len(job.results) > position or job_id not in self._jobs, timeout=heartbeat)
+                new_results = job.results[position:]
+
+            if not new_results:
+                if not follow or position >= total:
+                    return
+                yield None
+                continue
+
+            # Đọc nội dung và trả dữ liệu ra ngoài khi đã nhả khóa để không chặn AsyncEngine
+            for result in self._load(new_results):
+                yield result
+            position += len(new_results)
+
+            if position >= total or not follow:
+                return
+
+    def _load(self, results):
+        """
+        Điền câu hỏi và phản hồi vào các kết quả gọn bằng một lần gọi loader.
+        """
+        responses = {}
+        if self.loader is not None:
+            responses = {response["id"]: response for response in self.loader([result["id"] for result in results])}
+        loaded = []
+        for result in results:
+            response = responses.get(result["id"])
+            if response is None:
+                loaded.append(dict(result, prompt=None, response=None, expired=True))
+            else:
+                loaded.append(dict(result, prompt=response["prompt"], response=response["response"]))
+        return loaded
+
+    def _purge_expired(self, force=False):
+        """
+        Xóa các batch job quá thời gian giữ lại (phải giữ khóa).
+
+        Chỉ duyệt toàn bộ các batch job mỗi ttl/10 giây, trừ khi force.
+
+        Args:
+            force (bool): Duyệt ngay, không chờ đến chu kỳ
+        """
+        now = time.time()
+        if not force and now - self._last_purge < self.ttl / 10:
+            return
+        self._last_purge = now
+        expired = [job for job in self._jobs.values() if now - job.created_at > self.ttl]
+        for job in expired:
+            del self._jobs[job.id]
+            for item_id in job.item_ids:
+                self._item_jobs.pop(item_id, None)
+        if expired:
+            self._condition.notify_all()
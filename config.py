@@ -10,12 +10,127 @@ load_dotenv()
 # Cấu hình API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = "gemini-2.0-flash-001"
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")  # Địa chỉ REST API thay thế, ví dụ http://127.0.0.1:8081 (tools/fake_gemini.py)
+GEMINI_FAKE = os.getenv("GEMINI_FAKE")  # Dùng client giả lập trong tiến trình để đo tải, ví dụ "latency=fixed:0.5;error_rate=0.01"
 
 # Cấu hình đa luồng
 MAX_THREADS = 5  # Số lượng luồng tối đa
 
+# Cấu hình asyncio
+MAX_CONCURRENT_REQUESTS = 100  # Số lời gọi Gemini API tối đa chạy đồng thời trên event loop
+COALESCE_REQUESTS = True  # Gộp các yêu cầu giống hệt đang chờ/đang chạy thành một lời gọi API
+
+# Cấu hình lập lịch yêu cầu
+SCHEDULER_CLASSES = ("interactive", "batch")  # Các lớp ưu tiên, từ cao đến thấp
+SCHEDULER_DEFAULT_CLASS = "interactive"  # Lớp mặc định của một yêu cầu
+SCHEDULER_AGING = 30  # Yêu cầu ở lớp thấp chờ quá thời gian này (giây) được phục vụ trước lớp cao
+SCHEDULER_TOKEN_UNIT = 1000  # Yêu cầu lớn hơn số token này chiếm nhiều lượt hơn tương ứng khi chia lượt giữa các client
+
+# Cấu hình backend của hàng đợi yêu cầu và kết quả (backends.py)
+BACKEND = os.getenv("BACKEND", "memory")  # "memory", "sqlite" (hàng đợi trên đĩa) hoặc "redis" (dùng chung giữa nhiều tiến trình/máy)
+APP_ROLE = os.getenv("APP_ROLE", "all")  # "all": nhận và xử lý yêu cầu; "web": chỉ nhận yêu cầu; "worker": chỉ xử lý (worker.py)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")  # Địa chỉ server Redis
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "chat:")  # Tiền tố của các khóa trong Redis
+REDIS_POLL_INTERVAL = 0.05  # Chu kỳ kiểm tra hàng đợi/phản hồi trong Redis khi đang chờ (giây)
+
+# Cấu hình hàng đợi trên đĩa (BACKEND = "sqlite", giữ lại các yêu cầu đang chờ/đang xử lý khi khởi động lại)
+DURABLE_QUEUE_PATH = "data/request_queue.sqlite3"  # File SQLite của hàng đợi
+DURABLE_QUEUE_VISIBILITY_TIMEOUT = 600  # Thời gian một yêu cầu đã nhận được giữ trước khi trả lại hàng đợi (giây)
+DURABLE_QUEUE_POLL_INTERVAL = 1.0  # Chu kỳ kiểm tra yêu cầu mới từ tiến trình khác (giây)
+DURABLE_QUEUE_SYNCHRONOUS = "NORMAL"  # "NORMAL" hoặc "FULL" (an toàn cả khi mất điện, chậm hơn)
+
+# Cấu hình giới hạn tốc độ gọi Gemini API (mặc định theo hạn mức tier 1 của gemini-2.0-flash;
+# tier miễn phí: 15 yêu cầu và 1.000.000 token mỗi phút)
+RATE_LIMIT_RPM = 2000  # Số yêu cầu tối đa mỗi phút, None để không giới hạn
+RATE_LIMIT_TPM = 4000000  # Số token tối đa mỗi phút, None để không giới hạn
+RATE_LIMIT_BURST = 50  # Số yêu cầu tối đa được gửi dồn cùng lúc
+RATE_LIMIT_MAX_RETRIES = 5  # Số lần thử lại tối đa khi API báo vượt hạn mức (HTTP 429)
+RATE_LIMIT_BACKOFF_BASE = 1.0  # Thời gian chờ cơ bản của exponential backoff (giây)
+RATE_LIMIT_BACKOFF_MAX = 60.0  # Thời gian chờ tối đa giữa hai lần thử lại (giây)
+ADAPTIVE_CONCURRENCY_MIN = 1  # Số lời gọi đồng thời tối thiểu khi bị giảm do quá tải
+ADAPTIVE_DECREASE_FACTOR = 0.5  # Hệ số nhân số lời gọi đồng thời khi gặp lỗi 429
+ADAPTIVE_DECREASE_COOLDOWN = 2.0  # Khoảng thời gian tối thiểu giữa hai lần giảm (giây)
+ADAPTIVE_LATENCY_TARGET = 20.0  # Độ trễ (giây) mà vượt quá được coi là API đang quá tải
+
 # Cấu hình đa tiến trình
 MAX_PROCESSES = 3  # Số lượng tiến trình tối đa
+PROCESS_BATCH_SIZE = 8  # Số nhiệm vụ tối đa một tiến trình gom lại trong một lần xử lý (lô lớn giảm chi phí IPC nhưng có thể để tiến trình khác rảnh)
+
+# Cấu hình khởi động
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") != "0"  # Mở sẵn kết nối API, nạp template/thư viện trước khi /readyz báo sẵn sàng
+WARMUP_TIMEOUT = 10  # Thời gian chờ tối đa của lời gọi API khi khởi động (giây)
 
 # Cấu hình timeout
 REQUEST_TIMEOUT = 30  # Thời gian timeout cho mỗi request (giây)
+SHUTDOWN_DRAIN_TIMEOUT = 20  # Thời gian chờ các yêu cầu đang xử lý xong khi dừng ứng dụng (giây)
+STATUS_MAX_WAIT = 30  # Thời gian chờ tối đa của /api/status?wait=<giây> (long-poll)
+STATUS_BULK_MAX_IDS = 1000  # Số ID tối đa trong một lần tra cứu /api/status?ids=...
+RESPONSES_PAGE_SIZE = 50  # Số phản hồi mặc định trong một trang của /api/responses
+RESPONSES_PAGE_MAX_SIZE = 200  # Số phản hồi tối đa trong một trang (?limit=...)
+
+# Cấu hình ước lượng token và giới hạn kích thước câu hỏi (token_estimator.py)
+TOKEN_LIMIT_PER_REQUEST = 30000  # Số token ước lượng tối đa của một câu hỏi (kể cả ảnh), None để không giới hạn
+TOKEN_LIMIT_ACTION = "reject"  # "reject": trả về lỗi 413; "truncate": cắt bớt câu hỏi cho vừa giới hạn
+TOKEN_CHARS_PER_TOKEN = 4.0  # Số ký tự trung bình mỗi token ban đầu, được hiệu chỉnh dần theo số token thật
+TOKEN_CALIBRATION_ENABLED = True  # Hiệu chỉnh theo số token Gemini API báo lại (usage_metadata) trong mỗi phản hồi
+
+# Cấu hình phiên hội thoại (session_store.py)
+SESSION_MAX_SESSIONS = 10000  # Số phiên tối đa giữ trong bộ nhớ (phiên lâu không dùng nhất bị loại trước)
+SESSION_IDLE_TTL = 60 * 60  # Phiên không có câu hỏi mới sau khoảng thời gian này bị loại (giây)
+SESSION_TOKEN_BUDGET = 4000  # Số token tối đa của lịch sử gửi kèm mỗi câu hỏi
+SESSION_KEEP_TURNS = 4  # Số lượt hỏi-đáp gần nhất được giữ nguyên văn khi tóm tắt các lượt cũ
+SESSION_SUMMARY_WORDS = 150  # Độ dài tối đa của bản tóm tắt các lượt cũ (số từ)
+
+# Cấu hình batch job
+BATCH_MAX_ITEMS = 10000  # Số câu hỏi tối đa trong một batch job
+BATCH_JOB_TTL = 24 * 60 * 60  # Thời gian giữ lại một batch job và kết quả của nó (giây)
+
+# Cấu hình số liệu hoạt động (/metrics)
+METRICS_SAMPLE_INTERVAL = 5  # Chu kỳ lấy mẫu CPU/bộ nhớ của tiến trình (giây)
+
+# Cấu hình theo dõi từng yêu cầu (tracing.py)
+TRACING_ENABLED = True  # Ghi thời gian của từng bước xử lý cho mỗi yêu cầu
+TRACE_MAX_TRACES = 1000  # Số trace gần nhất giữ trong bộ nhớ
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")  # File ghi trace theo OTLP/JSON (ví dụ data/traces.jsonl), None để không ghi
+TRACE_EXPORT_INTERVAL = 5  # Chu kỳ ghi trace ra file (giây)
+
+# Cấu hình ghi lưu lượng để phát lại (traffic_recorder.py, tools/replay.py)
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")  # File ghi lưu lượng đã ẩn danh (ví dụ data/traffic.jsonl), None để không ghi
+TRAFFIC_RECORD_INTERVAL = 5  # Chu kỳ ghi lưu lượng ra file (giây)
+TRAFFIC_RECORD_ARRIVAL_TTL = 600  # Yêu cầu chưa có kết quả sau thời gian này bị bỏ khỏi bản ghi (giây)
+TRAFFIC_RECORD_MAX_KEYS = 100000  # Số câu hỏi/ảnh/batch khác nhau tối đa được nhớ để đánh số lặp lại
+
+# Cấu hình nén và mã hóa JSON của phản hồi HTTP (http_codec.py)
+COMPRESSION_ENABLED = True  # Nén phản hồi theo Accept-Encoding (zstd, br, gzip tùy thư viện đã cài)
+COMPRESSION_MIN_BYTES = 1024  # Phản hồi nhỏ hơn ngưỡng này (byte) không được nén
+COMPRESSION_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}  # Mức nén của từng thuật toán
+
+# Cấu hình stream (Server-Sent Events)
+STREAM_HEARTBEAT_INTERVAL = 15  # Gửi tín hiệu giữ kết nối sau mỗi khoảng thời gian không có dữ liệu (giây)
+STREAM_RETENTION = 60  # Thời gian giữ lại các đoạn phản hồi sau khi stream kết thúc (giây)
+
+# Cấu hình lưu trữ phản hồi
+RESPONSE_STORE_MAX_BYTES = 64 * 1024 * 1024  # Tổng dung lượng phản hồi giữ trong bộ nhớ (byte)
+RESPONSE_STORE_TTL = 24 * 60 * 60  # Thời gian giữ một phản hồi (giây)
+RESPONSE_SPILL_DIR = "data/attachments"  # Thư mục lưu ảnh đính kèm lớn thay vì giữ trong bộ nhớ
+ATTACHMENT_SPILL_THRESHOLD = 64 * 1024  # Ảnh đính kèm lớn hơn ngưỡng này (byte) được ghi ra đĩa
+RESULT_STORE_MAX_BYTES = 64 * 1024 * 1024  # Tổng dung lượng phản hồi đã hậu xử lý và HTML giữ trong bộ nhớ (byte)
+
+# Cấu hình render Markdown phía server (markdown_renderer.py)
+MARKDOWN_EXTENSIONS = ("fenced_code", "tables", "sane_lists")  # Các extension của Python-Markdown
+MARKDOWN_CACHE_SIZE = 1024  # Số phản hồi đã render giữ trong bộ nhớ đệm của mỗi tiến trình
+
+# Cấu hình tiền xử lý ảnh
+IMAGE_MAX_SIDE = 1536  # Cạnh dài nhất của ảnh gửi đến Gemini API (pixel)
+IMAGE_FORMAT = "JPEG"  # Định dạng mã hóa lại: "JPEG" hoặc "WEBP"
+IMAGE_QUALITY = 85  # Chất lượng nén ảnh (1-100)
+IMAGE_WORKERS = 2  # Số luồng xử lý ảnh
+IMAGE_STORE_DIR = "data/images"  # Thư mục lưu ảnh tải lên (theo hash nội dung)
+IMAGE_CACHE_SIZE = 64  # Số ảnh đã tiền xử lý giữ trong bộ nhớ đệm
+IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024  # Kích thước tối đa của một ảnh tải lên (byte)
+
+# Cấu hình cache phản hồi (lưu trên đĩa, giữ lại sau khi khởi động lại)
+RESPONSE_CACHE_ENABLED = False  # Bật cache phản hồi cho các câu hỏi lặp lại
+RESPONSE_CACHE_PATH = "data/response_cache.sqlite3"  # File SQLite lưu cache
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # Thời gian sống của một phản hồi trong cache (giây)
+RESPONSE_CACHE_MAX_ENTRIES = 10000  # Số phản hồi tối đa trong cache
@@ -0,0 +1,340 @@
+"""
+Module hàng đợi yêu cầu lưu trên đĩa (SQLite, chế độ WAL).
+
+Yêu cầu được ghi xuống đĩa khi vào hàng đợi và chỉ bị xóa khi đã xử lý xong
+(ack), nên các yêu cầu đang chờ hoặc đang xử lý không bị mất khi ứng dụng khởi
+động lại. Mỗi yêu cầu được lấy ra bằng cách "nhận" (claim) trong một khoảng
+thời gian (visibility timeout); nếu tiến trình nhận nó bị dừng trước khi ack,
+yêu cầu sẽ được trả lại hàng đợi khi hết thời gian này hoặc khi khởi động lại.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from config import (SCHEDULER_CLASSES, SCHEDULER_DEFAULT_CLASS, SCHEDULER_AGING, DURABLE_QUEUE_PATH,
+                    DURABLE_QUEUE_VISIBILITY_TIMEOUT, DURABLE_QUEUE_POLL_INTERVAL, DURABLE_QUEUE_SYNCHRONOUS)
+
+# Các trường của yêu cầu được ghi xuống đĩa (các trường còn lại chỉ có ý nghĩa trong bộ nhớ)
+_PERSISTED_FIELDS = ("id", "prompt", "image_data", "image_id", "stream", "bypass_cache", "cache_key", "session_id", "tokens", "queued_at")
+
+
+class DurableQueue:
+    """
+    Hàng đợi bền vững với claim/ack, visibility timeout và phát lại khi khởi động.
+
+    Có cùng giao diện put() / get() / ack() / qsize() / interrupt() / replay() / stats()
+    với FairScheduler để AsyncEngine dùng thay thế. Lớp ưu tiên và aging được giữ
+    nguyên; việc chia lượt theo client chỉ có ở FairScheduler (hàng đợi này phục vụ
+    theo thứ tự đến trong mỗi lớp).
+    """
+    def __init__(self, path=DURABLE_QUEUE_PATH, visibility_timeout=DURABLE_QUEUE_VISIBILITY_TIMEOUT,
+                 classes=SCHEDULER_CLASSES, default_class=SCHEDULER_DEFAULT_CLASS, aging=SCHEDULER_AGING,
+                 poll_interval=DURABLE_QUEUE_POLL_INTERVAL, synchronous=DURABLE_QUEUE_SYNCHRONOUS):
+        """
+        Khởi tạo DurableQueue và tạo bảng nếu chưa có.
+
+        Args:
+            path (str): Đường dẫn file SQLite
+            visibility_timeout (float): Thời gian một yêu cầu đã nhận được giữ riêng trước khi
+                được trả lại hàng đợi nếu chưa ack (giây)
+            classes (tuple): Tên các lớp ưu tiên, từ cao đến thấp
+            default_class (str): Lớp dùng khi put() không chỉ định lớp
+            aging (float): Yêu cầu ở lớp thấp chờ lâu hơn khoảng này (giây) được phục vụ trước
+            poll_interval (float): Chu kỳ kiểm tra yêu cầu do tiến trình khác thêm vào
+                hoặc hết visibility timeout (giây)
+            synchronous (str): Chế độ PRAGMA synchronous ("NORMAL": không mất dữ liệu khi ứng
+                dụng bị dừng; "FULL": không mất dữ liệu cả khi mất điện, chậm hơn)
+        """
+        if default_class not in classes:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {default_class}")
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.classes = tuple(classes)
+        self.default_class = default_class
+        self.aging = aging
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._local = {}  # request_id -> đối tượng gốc của các yêu cầu do tiến trình này thêm vào
+        self._interrupted = False
+        self._aged_last = False
+        self._waits = {name: deque(maxlen=1000) for name in self.classes}
+        self._counters = {name: {"enqueued": 0, "dequeued": 0, "aged": 0} for name in self.classes}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: tự quản lý transaction (BEGIN IMMEDIATE khi nhận yêu cầu)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS request_queue ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " request_id TEXT NOT NULL UNIQUE,"
+            " priority INTEGER NOT NULL,"
+            " client_id TEXT,"
+            " payload TEXT NOT NULL,"
+            " enqueued_at REAL NOT NULL,"
+            " claimed_until REAL,"
+            " owner TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_priority ON request_queue(priority, seq)")
+
+    def put(self, item, priority_class=None, client_id=None, cost=1.0):
+        """
+        Ghi một yêu cầu xuống đĩa và đưa vào hàng đợi.
+
+        Args:
+            item (dict): Yêu cầu (có trường "id")
+            priority_class (str, optional): Lớp ưu tiên (mặc định là default_class)
+            client_id (str, optional): Client/phiên gửi yêu cầu
+            cost (float): Chi phí của yêu cầu (không dùng, hàng đợi này phục vụ theo thứ tự đến)
+
+        Raises:
+            ValueError: Nếu lớp ưu tiên không tồn tại
+        """
+        priority_class = priority_class or self.default_class
+        if priority_class not in self.classes:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {priority_class}")
+
+        payload = json.dumps({key: item.get(key) for key in _PERSISTED_FIELDS}, ensure_ascii=False)
+        with self._condition:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO request_queue (request_id, priority, client_id, payload, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (item["id"], self.classes.index(priority_class), client_id, payload, time.time())
+            )
+            self._local[item["id"]] = item
+            self._counters[priority_class]["enqueued"] += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Nhận yêu cầu tiếp theo, chặn cho đến khi có yêu cầu.
+
+        Args:
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            dict: Yêu cầu đã nhận, hoặc None nếu hết thời gian chờ hay bị interrupt()
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                if self._interrupted:
+                    self._interrupted = False
+                    return None
+
+                item = self._claim()
+                if item is not None:
+                    return item
+
+                wait = self.poll_interval
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return None
+                self._condition.wait(wait)
+
+    def _claim(self):
+        """
+        Nhận yêu cầu tiếp theo theo lớp ưu tiên và aging (phải giữ khóa).
+        """
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Yêu cầu đầu tiên còn nhìn thấy được (chưa nhận hoặc đã hết hạn nhận) của mỗi lớp
+            heads = []
+            for priority in range(len(self.classes)):
+                row = self._conn.execute(
+                    "SELECT seq, request_id, payload, enqueued_at FROM request_queue"
+                    " WHERE priority = ? AND (claimed_until IS NULL OR claimed_until < ?)"
+                    " ORDER BY seq LIMIT 1",
+                    (priority, now)
+                ).fetchone()
+                if row is not None:
+                    heads.append((priority, row))
+
+            if not heads:
+                self._conn.execute("COMMIT")
+                return None
+
+            # Aging giống FairScheduler: không chọn nhờ aging hai lần liên tiếp
+            priority, row = heads[0]
+            aged = [head for head in heads[1:] if now - head[1][3] > self.aging]
+            if aged and not self._aged_last:
+                priority, row = aged[-1]
+                self._counters[self.classes[priority]]["aged"] += 1
+                self._aged_last = True
+            else:
+                self._aged_last = False
+
+            seq, request_id, payload, enqueued_at = row
+            self._conn.execute(
+                "UPDATE request_queue SET claimed_until = ?, owner = ?, attempts = attempts + 1 WHERE seq = ?",
+                (now + self.visibility_timeout, self.owner, seq)
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        name = self.classes[priority]
+        self._counters[name]["dequeued"] += 1
+        self._waits[name].append(now - enqueued_at)
+
+        # Dùng lại đối tượng gốc nếu yêu cầu do tiến trình này thêm vào (giữ các yêu cầu
+        # được gộp và stream), nếu không thì dựng lại từ dữ liệu trên đĩa và đánh dấu là
+        # yêu cầu AsyncEngine chưa tính (từ lần chạy trước hoặc từ tiến trình khác).
+        # Đối tượng gốc chỉ được trả về một lần: khi hết hạn nhận và được nhận lại trong lúc
+        # lần trước có thể vẫn đang chạy, lần sau là một yêu cầu riêng, không dùng chung
+        # danh sách yêu cầu được gộp và không bị tính hai lần vào _in_flight
+        item = self._local.pop(request_id, None)
+        if item is None:
+            item = json.loads(payload)
+            item["followers"] = []
+            item["remote"] = True
+        return item
+
+    def ack(self, item):
+        """
+        Xác nhận đã xử lý xong một yêu cầu và xóa nó khỏi đĩa.
+
+        Args:
+            item (dict): Yêu cầu đã nhận từ get()
+        """
+        with self._condition:
+            self._conn.execute("DELETE FROM request_queue WHERE request_id = ?", (item["id"],))
+            self._local.pop(item["id"], None)
+
+    def interrupt(self):
+        """
+        Đánh thức luồng đang chờ trong get() (get() trả về None), dùng khi dừng AsyncEngine.
+        """
+        with self._condition:
+            self._interrupted = True
+            self._condition.notify_all()
+
+    def replay(self, release_all=False):
+        """
+        Trả lại hàng đợi các yêu cầu đã nhận nhưng chưa ack (gọi khi khởi động).
+
+        Mặc định chỉ trả lại yêu cầu do chính tiến trình này hoặc do một tiến trình đã dừng
+        trên cùng máy nhận; yêu cầu của tiến trình khác còn chạy được trả lại khi hết
+        visibility timeout, giống RedisQueue.replay().
+
+        Args:
+            release_all (bool): Trả lại cả yêu cầu do tiến trình khác nhận; chỉ dùng khi
+                tiến trình này là nơi duy nhất đọc hàng đợi.
+
+        Returns:
+            int: Số yêu cầu từ lần chạy trước đang có trong hàng đợi sau khi phát lại
+        """
+        with self._condition:
+            if release_all:
+                self._conn.execute("UPDATE request_queue SET claimed_until = NULL, owner = NULL")
+            else:
+                owners = [owner for (owner,) in self._conn.execute(
+                    "SELECT DISTINCT owner FROM request_queue WHERE owner IS NOT NULL")]
+                for owner in owners:
+                    if owner == self.owner or self._owner_dead(owner):
+                        self._conn.execute(
+                            "UPDATE request_queue SET claimed_until = NULL, owner = NULL WHERE owner = ?", (owner,))
+            # Yêu cầu do chính đối tượng này thêm vào đã được AsyncEngine tính từ trước
+            count = sum(
+                1 for (request_id,) in self._conn.execute(
+                    "SELECT request_id FROM request_queue WHERE claimed_until IS NULL")
+                if request_id not in self._local
+            )
+            self._condition.notify_all()
+        if count:
+            print(f"Phát lại {count} yêu cầu còn trong hàng đợi trên đĩa")
+        return count
+
+    @staticmethod
+    def _owner_dead(owner):
+        """
+        Kiểm tra tiến trình đã nhận yêu cầu có còn chạy hay không (chỉ biết được trên cùng máy).
+
+        Args:
+            owner (str): Chủ sở hữu dạng "hostname:pid"
+
+        Returns:
+            bool: True nếu chắc chắn tiến trình không còn chạy
+        """
+        hostname, _, pid = owner.rpartition(":")
+        if hostname != socket.gethostname() or not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def qsize(self, priority_class=None):
+        """
+        Số yêu cầu đang chờ (chưa được nhận), của một lớp hoặc của tất cả các lớp.
+        """
+        now = time.time()
+        query = "SELECT COUNT(*) FROM request_queue WHERE (claimed_until IS NULL OR claimed_until < ?)"
+        params = [now]
+        if priority_class is not None:
+            query += " AND priority = ?"
+            params.append(self.classes.index(priority_class))
+        with self._condition:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def stats(self):
+        """
+        Thống kê theo từng lớp ưu tiên, cùng định dạng với FairScheduler.stats().
+
+        Returns:
+            dict: Với mỗi lớp: số yêu cầu đang chờ và đang được nhận, số đã vào/ra hàng đợi,
+                số lần được ưu tiên nhờ aging và thời gian chờ (trung bình, p95, tối đa, hiện tại)
+        """
+        now = time.time()
+        with self._condition:
+            rows = self._conn.execute(
+                "SELECT priority,"
+                " SUM(CASE WHEN claimed_until IS NULL OR claimed_until < ? THEN 1 ELSE 0 END),"
+                " SUM(CASE WHEN claimed_until >= ? THEN 1 ELSE 0 END),"
+                " MIN(CASE WHEN claimed_until IS NULL OR claimed_until < ? THEN enqueued_at END)"
+                " FROM request_queue GROUP BY priority",
+                (now, now, now)
+            ).fetchall()
+            by_priority = {row[0]: row[1:] for row in rows}
+
+            result = {}
+            for priority, name in enumerate(self.classes):
+                depth, claimed, oldest = by_priority.get(priority, (0, 0, None))
+                waits = sorted(self._waits[name])
+                result[name] = {
+                    "depth": depth or 0,
+                    "claimed": claimed or 0,
+                    **self._counters[name],
+                    "wait": {
+                        "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                        "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                        "max": round(waits[-1], 3) if waits else 0.0,
+                        "oldest_pending": round(now - oldest, 3) if oldest is not None else 0.0,
+                    },
+                }
+        return result
+
+    def close(self):
+        """
+        Đóng kết nối SQLite.
+        """
+        with self._condition:
+            self._conn.close()
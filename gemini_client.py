@@ -2,7 +2,7 @@
 Module để tương tác với Gemini API.
 """
 import google.generativeai as genai
-from config import GEMINI_API_KEY, GEMINI_MODEL, REQUEST_TIMEOUT
+from config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_API_ENDPOINT, REQUEST_TIMEOUT
 
 class GeminiClient:
     """
@@ -15,7 +15,12 @@ class GeminiClient:
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY không được cấu hình. Vui lòng kiểm tra file .env")
 
-        genai.configure(api_key=GEMINI_API_KEY)
+        if GEMINI_API_ENDPOINT:
+            # API thay thế (ví dụ server giả lập trong tools/fake_gemini.py) chỉ hỗ trợ REST
+            genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                            client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+        else:
+            genai.configure(api_key=GEMINI_API_KEY)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
 
     def generate_response(self, prompt, image_data=None):
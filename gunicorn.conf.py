@@ -0,0 +1,42 @@
+"""
+Cấu hình gunicorn cho ứng dụng web: gunicorn -c gunicorn.conf.py wsgi:app
+
+Mỗi worker có event loop AsyncEngine và pool tiến trình hậu xử lý riêng, còn các request
+HTTP chủ yếu chờ (long-poll /api/status, stream SSE), nên dùng ít worker nhiều luồng
+(gthread). Với BACKEND memory hoặc sqlite, phản hồi chỉ nằm trong bộ nhớ của worker đã
+nhận yêu cầu nên phải chạy đúng một worker; nhiều worker cần BACKEND=redis.
+"""
+import multiprocessing
+import os
+
+from config import BACKEND, STATUS_MAX_WAIT, SHUTDOWN_DRAIN_TIMEOUT
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() if BACKEND == "redis" else 1))
+# Mỗi long-poll hoặc stream SSE giữ một luồng trong suốt thời gian chờ
+threads = int(os.getenv("WEB_THREADS", 64))
+# Worker gthread gửi heartbeat từ luồng chính nên request chờ lâu không làm worker bị coi là treo
+timeout = STATUS_MAX_WAIT + 30
+# Đủ thời gian để ChatServices.stop() chờ các yêu cầu đang xử lý
+graceful_timeout = SHUTDOWN_DRAIN_TIMEOUT + 10
+keepalive = 5
+# create_app() không tạo luồng hay tiến trình nên nạp trước trong master cũng an toàn,
+# và các worker dùng chung phần bộ nhớ của các module đã import (copy-on-write)
+preload_app = True
+
+
+def when_ready(server):
+    """Import các thư viện nặng trong master trước khi fork, để các worker không phải import lại."""
+    from app import preload_imports
+    preload_imports()
+
+
+def post_worker_init(worker):
+    """Khởi động các thành phần ngay sau khi fork thay vì đợi request đầu tiên."""
+    worker.wsgi.extensions["chat"].start()
+
+
+def worker_exit(server, worker):
+    """Chờ các yêu cầu đang xử lý rồi dừng các luồng và tiến trình của worker."""
+    worker.wsgi.extensions["chat"].stop()
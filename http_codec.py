@@ -0,0 +1,241 @@
+"""
+Module mã hóa JSON nhanh và nén phản hồi HTTP của ứng dụng Flask.
+
+JSON được mã hóa bằng orjson nếu đã cài (nhanh hơn nhiều lần so với thư viện json
+chuẩn), và phản hồi đủ lớn được nén theo Accept-Encoding của client: zstd hoặc brotli
+nếu đã cài thư viện tương ứng, luôn có gzip. Số byte trước/sau khi nén và thời gian
+mã hóa/nén được ghi nhận theo từng endpoint (/metrics và /api/http/stats).
+
+Phản hồi dạng stream (Server-Sent Events, NDJSON) và file gửi trực tiếp không được
+nén để không làm chậm việc đẩy từng đoạn dữ liệu.
+"""
+import gzip
+import threading
+import time
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES, COMPRESSION_LEVELS
+from metrics import HTTP_RESPONSE_BYTES, HTTP_RESPONSES, HTTP_ENCODE_TIME
+
+# Các thư viện tùy chọn: không có thì dùng json chuẩn và chỉ nén gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Các kiểu nội dung được nén (ảnh JPEG/PNG/WEBP đã được nén sẵn)
+_COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/x-ndjson", "image/svg+xml")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider của Flask dùng orjson khi có, giữ nguyên giao diện của jsonify.
+
+    Ký tự tiếng Việt được giữ nguyên dạng UTF-8 thay vì thoát thành \\uXXXX (ngắn hơn 2-3
+    lần), và thứ tự khóa giữ như trong dict thay vì sắp xếp lại.
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        """
+        Mã hóa obj thành chuỗi JSON (dùng json chuẩn nếu cần tùy chọn orjson không hỗ trợ).
+        """
+        if orjson is not None and set(kwargs) <= {"indent", "separators"}:
+            option = orjson.OPT_NON_STR_KEYS
+            if kwargs.get("indent"):
+                option |= orjson.OPT_INDENT_2
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+            except TypeError:
+                # Giá trị orjson không mã hóa được (ví dụ số nguyên quá lớn)
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Tạo phản hồi JSON như jsonify và ghi lại thời gian mã hóa cho ResponseCodec.
+        """
+        start = time.perf_counter()
+        result = super().response(*args, **kwargs)
+        g.json_encode_time = g.get("json_encode_time", 0.0) + time.perf_counter() - start
+        return result
+
+
+def available_encodings():
+    """
+    Các thuật toán nén dùng được, theo thứ tự ưu tiên khi client chấp nhận như nhau.
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def compress(data, encoding, levels=COMPRESSION_LEVELS):
+    """
+    Nén dữ liệu bằng một thuật toán.
+
+    Args:
+        data (bytes): Dữ liệu cần nén
+        encoding (str): "zstd", "br" hoặc "gzip"
+        levels (dict): Mức nén của từng thuật toán
+
+    Returns:
+        bytes: Dữ liệu đã nén
+
+    Raises:
+        ValueError: Nếu thuật toán không được hỗ trợ
+    """
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=levels.get("zstd", 3)).compress(data)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=levels.get("br", 4))
+    if encoding == "gzip":
+        # mtime=0 để cùng nội dung luôn cho cùng kết quả nén
+        return gzip.compress(data, compresslevel=levels.get("gzip", 6), mtime=0)
+    raise ValueError(f"Thuật toán nén không được hỗ trợ: {encoding}")
+
+
+class ResponseCodec:
+    """
+    Gắn JSON provider nhanh và bước nén phản hồi vào một ứng dụng Flask.
+    """
+    def __init__(self, enabled=COMPRESSION_ENABLED, min_bytes=COMPRESSION_MIN_BYTES, levels=COMPRESSION_LEVELS):
+        """
+        Args:
+            enabled (bool): Có nén phản hồi hay không (JSON vẫn được mã hóa bằng orjson nếu có)
+            min_bytes (int): Phản hồi nhỏ hơn ngưỡng này (byte) không được nén
+            levels (dict): Mức nén của từng thuật toán
+        """
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.levels = dict(levels)
+        self.encodings = available_encodings()
+        # endpoint -> số phản hồi, số byte trước/sau khi nén, tổng thời gian mã hóa/nén, số lần theo cách nén
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Thay JSON provider của ứng dụng và đăng ký bước nén sau mỗi request.
+        """
+        app.json = FastJSONProvider(app)
+        app.after_request(self.after_request)
+        app.extensions["response_codec"] = self
+
+    def _negotiate(self, response):
+        """
+        Chọn thuật toán nén cho một phản hồi, None nếu không nén.
+        """
+        if (not self.enabled or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or "Content-Encoding" in response.headers):
+            return None
+        mimetype = response.mimetype or ""
+        if not (mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_TYPES):
+            return None
+        if response.content_length is not None and response.content_length < self.min_bytes:
+            return None
+        return request.accept_encodings.best_match(self.encodings)
+
+    def after_request(self, response):
+        """
+        Nén phản hồi nếu client chấp nhận và ghi nhận số byte, thời gian mã hóa/nén.
+        """
+        # Bỏ tên blueprint ("chat.status" -> "status")
+        endpoint = (request.endpoint or "unknown").rpartition(".")[2]
+        json_time = g.pop("json_encode_time", None)
+        encoding = self._negotiate(response)
+        # Phản hồi stream không biết trước kích thước, chỉ được đếm số lần
+        raw_size = wire_size = 0 if response.is_streamed else response.content_length or 0
+        compress_time = None
+
+        if encoding is not None:
+            data = response.get_data()
+            start = time.perf_counter()
+            compressed = compress(data, encoding, self.levels)
+            compress_time = time.perf_counter() - start
+            if len(compressed) < len(data):
+                response.set_data(compressed)
+                response.headers["Content-Encoding"] = encoding
+                wire_size = len(compressed)
+            else:
+                encoding = None
+        if self.enabled:
+            # Nội dung phụ thuộc Accept-Encoding, cache trung gian phải tách theo header này
+            response.vary.add("Accept-Encoding")
+
+        self._record(endpoint, encoding or "identity", raw_size, wire_size, json_time, compress_time)
+        return response
+
+    def _record(self, endpoint, encoding, raw_size, wire_size, json_time, compress_time):
+        """
+        Ghi nhận một phản hồi vào /metrics và thống kê theo endpoint.
+        """
+        HTTP_RESPONSES.inc(endpoint=endpoint, encoding=encoding)
+        HTTP_RESPONSE_BYTES.inc(raw_size, endpoint=endpoint, kind="raw")
+        HTTP_RESPONSE_BYTES.inc(wire_size, endpoint=endpoint, kind="wire")
+        if json_time is not None:
+            HTTP_ENCODE_TIME.observe(json_time, endpoint=endpoint, stage="json")
+        if compress_time is not None:
+            HTTP_ENCODE_TIME.observe(compress_time, endpoint=endpoint, stage="compress")
+
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = {"responses": 0, "raw_bytes": 0, "wire_bytes": 0,
+                                                 "json_seconds": 0.0, "compress_seconds": 0.0, "encodings": {}}
+            stats["responses"] += 1
+            stats["raw_bytes"] += raw_size
+            stats["wire_bytes"] += wire_size
+            stats["json_seconds"] += json_time or 0.0
+            stats["compress_seconds"] += compress_time or 0.0
+            stats["encodings"][encoding] = stats["encodings"].get(encoding, 0) + 1
+
+    def stats(self):
+        """
+        Thống kê theo endpoint: số phản hồi, số byte trước/sau khi nén, tỷ lệ nén và
+        thời gian mã hóa/nén trung bình (ms).
+        """
+        with self._lock:
+            snapshot = {endpoint: dict(stats, encodings=dict(stats["encodings"]))
+                        for endpoint, stats in self._stats.items()}
+        endpoints = {}
+        for endpoint, stats in sorted(snapshot.items()):
+            count = stats.pop("responses")
+            json_seconds = stats.pop("json_seconds")
+            compress_seconds = stats.pop("compress_seconds")
+            endpoints[endpoint] = {
+                "responses": count,
+                **stats,
+                "ratio": round(stats["wire_bytes"] / stats["raw_bytes"], 3) if stats["raw_bytes"] else 1.0,
+                "json_ms_avg": round(json_seconds * 1000 / count, 3),
+                "compress_ms_avg": round(compress_seconds * 1000 / count, 3),
+            }
+        return {
+            "json_encoder": "orjson" if orjson is not None else "json",
+            "compression": self.encodings if self.enabled else [],
+            "min_bytes": self.min_bytes,
+            "endpoints": endpoints,
+        }
@@ -0,0 +1,148 @@
+"""
+Module tiền xử lý ảnh trong bộ nhớ trước khi gửi đến Gemini API.
+
+Ảnh được giải mã, thu nhỏ về độ phân giải tối đa và mã hóa lại mà không cần ghi
+file tạm. Việc xử lý chạy trên một pool luồng riêng (PIL nhả GIL khi giải mã,
+thay đổi kích thước và mã hóa) để không chiếm các luồng gọi API.
+"""
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_WORKERS
+
+# Định dạng đầu ra được hỗ trợ và mime type tương ứng
+_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+def decode_image_data(image_data):
+    """
+    Lấy bytes gốc của ảnh từ data URL base64 hoặc đường dẫn file.
+
+    Args:
+        image_data (str): Data URL dạng "data:image/...;base64,..." hoặc đường dẫn file
+
+    Returns:
+        bytes: Dữ liệu ảnh gốc
+
+    Raises:
+        ValueError: Nếu định dạng ảnh không hợp lệ
+    """
+    if image_data.startswith('data:image'):
+        try:
+            return base64.b64decode(image_data.split(',', 1)[1])
+        except (IndexError, ValueError):
+            raise ValueError("Định dạng ảnh không hợp lệ")
+    if os.path.isfile(image_data):
+        with open(image_data, "rb") as f:
+            return f.read()
+    raise ValueError("Định dạng ảnh không hợp lệ")
+
+
+class ImagePipeline:
+    """
+    Chuẩn hóa ảnh trong bộ nhớ: giải mã, xoay theo EXIF, thu nhỏ và mã hóa lại.
+    """
+    def __init__(self, max_side=IMAGE_MAX_SIDE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY,
+                 workers=IMAGE_WORKERS):
+        """
+        Khởi tạo ImagePipeline.
+
+        Args:
+            max_side (int): Cạnh dài nhất của ảnh sau khi thu nhỏ (pixel)
+            image_format (str): Định dạng đầu ra ("JPEG" hoặc "WEBP")
+            quality (int): Chất lượng nén (1-100)
+            workers (int): Số luồng xử lý ảnh
+        """
+        image_format = image_format.upper()
+        if image_format not in _MIME_TYPES:
+            raise ValueError(f"Định dạng ảnh không được hỗ trợ: {image_format}")
+
+        self.max_side = max_side
+        self.image_format = image_format
+        self.mime_type = _MIME_TYPES[image_format]
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ImagePipeline")
+
+    def process_bytes(self, raw_bytes):
+        """
+        Chuẩn hóa ảnh từ bytes gốc.
+
+        Args:
+            raw_bytes (bytes): Dữ liệu ảnh gốc (JPEG, PNG, WebP, ...)
+
+        Returns:
+            tuple: (bytes đã mã hóa lại, mime type)
+
+        Raises:
+            ValueError: Nếu không đọc được ảnh
+        """
+        # Pillow chỉ được import khi xử lý ảnh lần đầu (đã import rồi thì chỉ là tra cứu sys.modules)
+        from PIL import Image, ImageOps
+
+        try:
+            image = Image.open(io.BytesIO(raw_bytes))
+            # Với JPEG, giải mã trực tiếp ở độ phân giải thấp hơn (1/2, 1/4, 1/8)
+            # khi ảnh lớn hơn nhiều so với kích thước cần, nhanh hơn giải mã đầy đủ rồi thu nhỏ
+            scale = self.max_side / max(image.size)
+            if image.format == "JPEG" and scale < 1:
+                image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+            image = ImageOps.exif_transpose(image)
+        except Exception as e:
+            raise ValueError(f"Không đọc được ảnh: {str(e)}")
+
+        if max(image.size) > self.max_side:
+            image.thumbnail((self.max_side, self.max_side), Image.BICUBIC, reducing_gap=2.0)
+
+        # JPEG không hỗ trợ kênh alpha hay bảng màu
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format=self.image_format, quality=self.quality)
+        return output.getvalue(), self.mime_type
+
+    def process(self, image_data):
+        """
+        Chuẩn hóa ảnh từ data URL hoặc đường dẫn file ngay trong luồng gọi.
+
+        Args:
+            image_data (str): Data URL base64 hoặc đường dẫn file
+
+        Returns:
+            tuple: (bytes đã mã hóa lại, mime type)
+        """
+        return self.process_bytes(decode_image_data(image_data))
+
+    def warm_up(self):
+        """
+        Import Pillow và mã hóa thử một ảnh nhỏ để nạp sẵn bộ giải mã/mã hóa, tránh làm chậm
+        ảnh đầu tiên.
+        """
+        from PIL import Image
+
+        sample = io.BytesIO()
+        Image.new("RGB", (16, 16)).save(sample, format="PNG")
+        self.process_bytes(sample.getvalue())
+
+    def submit(self, image_data):
+        """
+        Đưa ảnh vào pool xử lý.
+
+        Args:
+            image_data (str): Data URL base64 hoặc đường dẫn file
+
+        Returns:
+            concurrent.futures.Future: Kết quả (bytes, mime type)
+        """
+        return self.executor.submit(self.process, image_data)
+
+    def shutdown(self):
+        """
+        Dừng pool xử lý ảnh.
+        """
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,187 @@
+"""
+Module lưu trữ ảnh theo nội dung (content-addressed).
+
+Mỗi ảnh được định danh bằng hash SHA-256 của bytes gốc, nên cùng một ảnh chỉ
+được lưu một lần dù được tải lên nhiều lần. Ảnh đã tiền xử lý được giữ trong
+bộ nhớ đệm theo ID để dùng lại cho các câu hỏi tiếp theo về cùng một ảnh.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from config import IMAGE_STORE_DIR, IMAGE_CACHE_SIZE
+
+# ID ảnh: "img_" + 32 ký tự đầu của hash SHA-256
+_IMAGE_ID_PATTERN = re.compile(r"^img_[0-9a-f]{32}$")
+
+# Mime type của các định dạng ảnh được chấp nhận khi tải lên
+_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+}
+
+
+def _open_image(source):
+    """
+    Mở ảnh bằng Pillow (chỉ đọc phần header); Pillow chỉ được import khi cần lần đầu.
+    """
+    from PIL import Image
+    return Image.open(source)
+
+
+class ImageStore:
+    """
+    Lưu ảnh gốc trên đĩa theo hash nội dung và đệm ảnh đã tiền xử lý trong bộ nhớ.
+    """
+    def __init__(self, pipeline, directory=IMAGE_STORE_DIR, cache_size=IMAGE_CACHE_SIZE):
+        """
+        Khởi tạo ImageStore.
+
+        Args:
+            pipeline (ImagePipeline): Dùng để tiền xử lý ảnh khi chưa có trong bộ nhớ đệm
+            directory (str): Thư mục lưu ảnh gốc
+            cache_size (int): Số ảnh đã tiền xử lý tối đa giữ trong bộ nhớ
+        """
+        self.pipeline = pipeline
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # image_id -> (bytes, mime type)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_valid_id(image_id):
+        """
+        Kiểm tra ID ảnh có đúng định dạng (tránh dùng ID làm đường dẫn tùy ý).
+        """
+        return isinstance(image_id, str) and bool(_IMAGE_ID_PATTERN.match(image_id))
+
+    def _path(self, image_id):
+        return os.path.join(self.directory, image_id)
+
+    def save(self, raw_bytes):
+        """
+        Lưu ảnh gốc nếu chưa có.
+
+        Args:
+            raw_bytes (bytes): Dữ liệu ảnh gốc
+
+        Returns:
+            tuple: (image_id, True nếu ảnh đã tồn tại từ trước)
+
+        Raises:
+            ValueError: Nếu dữ liệu không phải là ảnh được hỗ trợ
+        """
+        image_id = "img_" + hashlib.sha256(raw_bytes).hexdigest()[:32]
+        path = self._path(image_id)
+        if os.path.exists(path):
+            return image_id, True
+
+        # Chỉ đọc phần header để xác định định dạng, không giải mã toàn bộ ảnh
+        try:
+            image_format = _open_image(io.BytesIO(raw_bytes)).format
+        except Exception:
+            raise ValueError("Dữ liệu không phải là ảnh hợp lệ")
+        if image_format not in _MIME_TYPES:
+            raise ValueError(f"Định dạng ảnh không được hỗ trợ: {image_format}")
+
+        # Ghi vào file tạm rồi đổi tên để các luồng khác không đọc phải file ghi dở
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(raw_bytes)
+        os.replace(temp_path, path)
+        return image_id, False
+
+    def exists(self, image_id):
+        """
+        Kiểm tra ảnh có tồn tại hay không.
+        """
+        return self.is_valid_id(image_id) and os.path.exists(self._path(image_id))
+
+    def dimensions(self, image_id):
+        """
+        Kích thước (rộng, cao) của ảnh gốc, chỉ đọc phần header.
+
+        Raises:
+            KeyError: Nếu không tìm thấy ảnh
+        """
+        if not self.exists(image_id):
+            raise KeyError(image_id)
+        with _open_image(self._path(image_id)) as image:
+            return image.size
+
+    def size(self, image_id):
+        """
+        Kích thước ảnh gốc (bytes), 0 nếu không tìm thấy ảnh.
+        """
+        if not self.exists(image_id):
+            return 0
+        return os.path.getsize(self._path(image_id))
+
+    def load(self, image_id):
+        """
+        Đọc ảnh gốc.
+
+        Returns:
+            tuple: (bytes, mime type)
+
+        Raises:
+            KeyError: Nếu không tìm thấy ảnh
+        """
+        if not self.exists(image_id):
+            raise KeyError(image_id)
+        with open(self._path(image_id), "rb") as f:
+            raw_bytes = f.read()
+        image_format = _open_image(io.BytesIO(raw_bytes)).format
+        return raw_bytes, _MIME_TYPES.get(image_format, "application/octet-stream")
+
+    def get_processed(self, image_id):
+        """
+        Lấy ảnh đã tiền xử lý, dùng bộ nhớ đệm nếu có.
+
+        Args:
+            image_id (str): ID của ảnh
+
+        Returns:
+            tuple: (bytes đã mã hóa lại, mime type)
+
+        Raises:
+            ValueError: Nếu không tìm thấy hoặc không đọc được ảnh
+        """
+        with self._lock:
+            cached = self._cache.get(image_id)
+            if cached is not None:
+                self._cache.move_to_end(image_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        try:
+            raw_bytes, _ = self.load(image_id)
+        except KeyError:
+            raise ValueError(f"Không tìm thấy ảnh: {image_id}")
+        processed = self.pipeline.process_bytes(raw_bytes)
+
+        with self._lock:
+            self._cache[image_id] = processed
+            self._cache.move_to_end(image_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return processed
+
+    def submit_processed(self, image_id):
+        """
+        Lấy ảnh đã tiền xử lý trên pool của ImagePipeline.
+
+        Returns:
+            concurrent.futures.Future: Kết quả (bytes, mime type)
+        """
+        return self.pipeline.executor.submit(self.get_processed, image_id)
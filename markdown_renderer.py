@@ -0,0 +1,212 @@
+"""
+Module chuyển phản hồi dạng Markdown sang HTML đã làm sạch ở phía server.
+
+Phản hồi được render một lần trong tiến trình hậu xử lý và HTML được lưu cùng văn bản
+gốc, nên trình duyệt chỉ cần chèn HTML thay vì chạy thư viện Markdown trên mỗi tin
+nhắn và mỗi lần mở lịch sử. HTML thô trong phản hồi không được giữ lại (hiển thị như
+văn bản), và kết quả render chỉ gồm các thẻ, thuộc tính và đường dẫn an toàn.
+"""
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+from config import MARKDOWN_EXTENSIONS, MARKDOWN_CACHE_SIZE
+
+# Các thẻ được giữ lại sau khi làm sạch, kèm các thuộc tính được phép của từng thẻ
+_ALLOWED_TAGS = {
+    "p": (), "br": (), "hr": (), "blockquote": (), "pre": (), "code": ("class",),
+    "h1": (), "h2": (), "h3": (), "h4": (), "h5": (), "h6": (),
+    "strong": (), "em": (), "b": (), "i": (), "del": (), "sup": (), "sub": (),
+    "ul": (), "ol": ("start",), "li": (),
+    "a": ("href", "title"),
+    "table": (), "thead": (), "tbody": (), "tr": (), "th": ("style",), "td": ("style",),
+}
+_VOID_TAGS = {"br", "hr"}
+
+# Thẻ bị bỏ cả nội dung bên trong (không chỉ bỏ thẻ)
+_DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript"}
+
+# Giá trị thuộc tính được chấp nhận
+_SAFE_URL = re.compile(r"^(https?:|mailto:|#|/(?!/))", re.IGNORECASE)
+_SAFE_CLASS = re.compile(r"^language-[\w+#.-]+$")
+_SAFE_STYLE = re.compile(r"^text-align:\s*(left|right|center);?$")
+_SAFE_START = re.compile(r"^\d{1,9}$")
+
+
+class _Sanitizer(HTMLParser):
+    """
+    Giữ lại các thẻ và thuộc tính trong danh sách cho phép, thoát mọi phần còn lại thành văn bản.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0  # Độ sâu bên trong các thẻ bị bỏ cả nội dung
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in _ALLOWED_TAGS:
+            return
+
+        allowed = _ALLOWED_TAGS[tag]
+        rendered = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            value = value.strip()
+            if name == "href" and not _SAFE_URL.match(value):
+                continue
+            if ((name == "class" and not _SAFE_CLASS.match(value))
+                    or (name == "style" and not _SAFE_STYLE.match(value))
+                    or (name == "start" and not _SAFE_START.match(value))):
+                continue
+            rendered.append(f' {name}="{html.escape(value)}"')
+        if tag == "a":
+            # Liên kết trong phản hồi luôn mở ở tab mới và không lộ trang nguồn
+            rendered.append(' rel="nofollow noopener noreferrer" target="_blank"')
+
+        self.parts.append(f"<{tag}{''.join(rendered)}>")
+        if tag not in _VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Đóng cả các thẻ con chưa được đóng để HTML luôn cân bằng
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        self.parts.extend(f"</{tag}>" for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return "".join(self.parts)
+
+
+def sanitize_html(fragment):
+    """
+    Làm sạch một đoạn HTML theo danh sách thẻ và thuộc tính cho phép.
+
+    Args:
+        fragment (str): Đoạn HTML cần làm sạch
+
+    Returns:
+        str: HTML chỉ gồm các thẻ và thuộc tính an toàn
+    """
+    sanitizer = _Sanitizer()
+    sanitizer.feed(fragment)
+    return sanitizer.result()
+
+
+class MarkdownRenderer:
+    """
+    Render Markdown sang HTML đã làm sạch, với bộ nhớ đệm LRU theo nội dung.
+    """
+    def __init__(self, extensions=MARKDOWN_EXTENSIONS, cache_size=MARKDOWN_CACHE_SIZE):
+        """
+        Args:
+            extensions (tuple): Các extension của Python-Markdown được bật
+            cache_size (int): Số kết quả render tối đa giữ trong bộ nhớ đệm, 0 để tắt
+        """
+        self.extensions = list(extensions)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # hash nội dung -> HTML
+        self._lock = threading.Lock()
+        # markdown.Markdown giữ trạng thái trong lúc render nên mỗi luồng dùng một đối tượng riêng
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def _converter(self):
+        converter = getattr(self._local, "converter", None)
+        if converter is None:
+            # Python-Markdown và các extension chỉ được import khi render lần đầu
+            import markdown
+            converter = markdown.Markdown(extensions=self.extensions)
+            # Không giữ HTML thô trong phản hồi: hiển thị như văn bản thay vì chèn vào trang
+            converter.preprocessors.deregister("html_block")
+            converter.inlinePatterns.deregister("html")
+            self._local.converter = converter
+        return converter
+
+    def render(self, text):
+        """
+        Render một phản hồi Markdown sang HTML đã làm sạch.
+
+        Args:
+            text (str): Phản hồi dạng Markdown
+
+        Returns:
+            str: HTML an toàn để chèn trực tiếp vào trang
+        """
+        if not text:
+            return ""
+        key = hashlib.sha256(text.encode("utf-8")).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        converter = self._converter()
+        try:
+            rendered = sanitize_html(converter.convert(text))
+        finally:
+            converter.reset()
+
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = rendered
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return rendered
+
+    def warm_up(self):
+        """
+        Import Python-Markdown, nạp các extension và render thử một đoạn (không lưu vào bộ nhớ
+        đệm), để phản hồi đầu tiên không phải chờ những việc này.
+        """
+        converter = self._converter()
+        try:
+            sanitize_html(converter.convert("**warm-up**\n\n```\ncode\n```\n\n| a |\n|---|\n| b |"))
+        finally:
+            converter.reset()
+
+    def stats(self):
+        """
+        Số kết quả trong bộ nhớ đệm và số lần trúng/trượt.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+RENDERER = MarkdownRenderer()
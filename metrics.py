@@ -0,0 +1,387 @@
+"""
+Module thu thập số liệu hoạt động (metrics) theo định dạng văn bản của Prometheus.
+
+Các bộ đếm (Counter), giá trị tức thời (Gauge) và phân bố (Histogram) được cập
+nhật ngay tại nơi xảy ra sự kiện (AsyncEngine, ProcessManager) và được xuất ra
+ở /metrics. Số liệu tài nguyên của tiến trình (CPU, bộ nhớ) được một luồng nền
+lấy mẫu định kỳ thay vì đo trong mỗi yêu cầu.
+"""
+import math
+import os
+import threading
+
+from config import METRICS_SAMPLE_INTERVAL
+
+# Ngưỡng mặc định của histogram thời gian (giây)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    """
+    Định dạng một giá trị số theo cú pháp của Prometheus.
+    """
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    """
+    Tạo phần {name="value",...} của một dòng số liệu.
+    """
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    # Giá trị nhãn cần thoát dấu \, " và xuống dòng
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    """
+    Phần chung của các loại số liệu: tên, mô tả, nhãn và khóa.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Args:
+            name (str): Tên số liệu (chữ thường, phân cách bằng dấu gạch dưới)
+            documentation (str): Mô tả ngắn, xuất ra ở dòng # HELP
+            labels (tuple): Tên các nhãn
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """
+        Chuyển các nhãn của một lần cập nhật thành khóa theo thứ tự khai báo.
+
+        Raises:
+            ValueError: Nếu nhãn không khớp với khai báo
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} cần các nhãn {self.labels}, nhận được {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def value(self, **labels):
+        """
+        Giá trị hiện tại với các nhãn đã cho.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        """
+        Xuất số liệu theo định dạng văn bản của Prometheus.
+
+        Returns:
+            list: Các dòng văn bản
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Bộ đếm chỉ tăng (số yêu cầu, số lỗi, ...).
+    """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Tăng bộ đếm.
+
+        Args:
+            amount (float): Giá trị tăng thêm (không âm)
+            **labels: Giá trị của các nhãn
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Giá trị tức thời có thể tăng hoặc giảm (độ dài hàng đợi, bộ nhớ, ...).
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Đặt giá trị.
+
+        Args:
+            value (float): Giá trị mới
+            **labels: Giá trị của các nhãn
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Phân bố giá trị (thời gian chờ, độ trễ, ...) theo các ngưỡng cố định.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): Tên số liệu
+            documentation (str): Mô tả ngắn
+            labels (tuple): Tên các nhãn
+            buckets (tuple): Các ngưỡng trên, tăng dần (ngưỡng +Inf được thêm tự động)
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        """
+        Ghi nhận một giá trị.
+
+        Args:
+            value (float): Giá trị quan sát được
+            **labels: Giá trị của các nhãn
+        """
+        key = self._key(labels)
+        with self._lock:
+            # [số đếm theo từng ngưỡng (không cộng dồn), tổng, số lần]
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {key: [list(state[0]), state[1], state[2]] for key, state in self._values.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Tập hợp các số liệu được xuất ra ở /metrics.
+
+    Ngoài các số liệu được cập nhật trực tiếp, có thể đăng ký hàm thu thập được
+    gọi ngay trước khi xuất (ví dụ để đọc độ dài hàng đợi tại thời điểm hỏi).
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Đăng ký một số liệu.
+
+        Returns:
+            Số liệu đã đăng ký (để có thể khai báo và đăng ký trong một dòng)
+
+        Raises:
+            ValueError: Nếu tên số liệu đã được dùng
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Số liệu đã tồn tại: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Đăng ký hàm (không tham số) được gọi trước mỗi lần xuất số liệu.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        """
+        Bỏ đăng ký một hàm thu thập (không làm gì nếu chưa đăng ký).
+        """
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self):
+        """
+        Xuất tất cả các số liệu theo định dạng văn bản của Prometheus.
+
+        Returns:
+            str: Nội dung cho /metrics
+        """
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Lỗi khi thu thập số liệu: {str(e)}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Hàng đợi và các luồng/tiến trình đang làm việc
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "chat_queue_depth", "Số yêu cầu đang chờ theo hàng đợi (các lớp ưu tiên của AsyncEngine, postprocess của ProcessManager)",
+    ("queue",)))
+ACTIVE_WORKERS = REGISTRY.register(Gauge(
+    "chat_active_workers", "Số lời gọi API đang chạy, giới hạn hiện tại và số tiến trình hậu xử lý còn sống",
+    ("kind",)))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "chat_queue_wait_seconds", "Thời gian yêu cầu chờ trong hàng đợi trước khi được xử lý"))
+
+# Yêu cầu và lời gọi Gemini API
+REQUESTS = REGISTRY.register(Counter(
+    "chat_requests_total", "Số yêu cầu đã nhận", ("priority",)))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    "chat_request_errors_total", "Số yêu cầu kết thúc với phản hồi lỗi"))
+GEMINI_CALLS = REGISTRY.register(Counter(
+    "chat_gemini_calls_total", "Số lời gọi Gemini API theo kết quả (ok, rate_limited, error)", ("outcome",)))
+GEMINI_LATENCY = REGISTRY.register(Histogram(
+    "chat_gemini_latency_seconds", "Thời gian của một lời gọi Gemini API thành công"))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "chat_cache_lookups_total", "Số lần tra cứu cache phản hồi (hit, miss)", ("result",)))
+COALESCED = REGISTRY.register(Counter(
+    "chat_coalesced_requests_total", "Số yêu cầu được gộp vào một yêu cầu giống hệt đang chờ/đang chạy"))
+ADMISSIONS = REGISTRY.register(Counter(
+    "chat_admissions_total", "Số câu hỏi được nhận theo kết quả kiểm tra kích thước (accepted, truncated, rejected)",
+    ("outcome",)))
+ESTIMATED_TOKENS = REGISTRY.register(Counter(
+    "chat_estimated_tokens_total", "Tổng số token ước lượng của các câu hỏi đã nhận"))
+
+# Mã hóa JSON và nén phản hồi HTTP (http_codec.py)
+ENCODE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+HTTP_RESPONSE_BYTES = REGISTRY.register(Counter(
+    "chat_http_response_bytes_total", "Số byte phản hồi HTTP theo endpoint, trước khi nén (raw) và thực gửi đi (wire)",
+    ("endpoint", "kind")))
+HTTP_RESPONSES = REGISTRY.register(Counter(
+    "chat_http_responses_total", "Số phản hồi HTTP theo endpoint và cách nén (identity nếu không nén)",
+    ("endpoint", "encoding")))
+HTTP_ENCODE_TIME = REGISTRY.register(Histogram(
+    "chat_http_encode_seconds", "Thời gian mã hóa JSON (json) và nén (compress) một phản hồi HTTP",
+    ("endpoint", "stage"), buckets=ENCODE_BUCKETS))
+
+# Hậu xử lý trong ProcessManager
+POSTPROCESS_LATENCY = REGISTRY.register(Histogram(
+    "chat_postprocess_seconds", "Thời gian từ khi gửi phản hồi sang ProcessManager đến khi có kết quả hậu xử lý"))
+
+# Tài nguyên của tiến trình, do ResourceSampler cập nhật
+PROCESS_CPU = REGISTRY.register(Gauge(
+    "chat_process_cpu_percent", "Phần trăm CPU của tiến trình web và các tiến trình hậu xử lý", ("process",)))
+PROCESS_MEMORY = REGISTRY.register(Gauge(
+    "chat_process_resident_memory_bytes", "Bộ nhớ thường trú (RSS) của tiến trình web và các tiến trình hậu xử lý",
+    ("process",)))
+PROCESS_THREADS = REGISTRY.register(Gauge(
+    "chat_process_threads", "Số luồng của tiến trình web"))
+
+
+class ResourceSampler:
+    """
+    Luồng nền lấy mẫu CPU và bộ nhớ của tiến trình hiện tại và các tiến trình con.
+
+    Thay cho việc gọi psutil trong mỗi yêu cầu: số đo của cả tiến trình không thuộc
+    về riêng yêu cầu nào, và lấy mẫu định kỳ không làm chậm yêu cầu.
+    """
+    def __init__(self, interval=METRICS_SAMPLE_INTERVAL):
+        """
+        Args:
+            interval (float): Chu kỳ lấy mẫu (giây)
+        """
+        # psutil chỉ được import khi tạo ResourceSampler (lúc khởi động ChatServices), không phải khi import module
+        import psutil
+
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self._children = {}  # pid -> psutil.Process (giữ lại để cpu_percent tính theo khoảng giữa hai lần đo)
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        """
+        Lấy một mẫu và cập nhật các Gauge.
+        """
+        import psutil
+
+        with self.process.oneshot():
+            PROCESS_CPU.set(self.process.cpu_percent(interval=None), process="web")
+            PROCESS_MEMORY.set(self.process.memory_info().rss, process="web")
+            PROCESS_THREADS.set(self.process.num_threads())
+
+        cpu = 0.0
+        memory = 0
+        alive = {}
+        for child in self.process.children():
+            child = self._children.get(child.pid, child)
+            try:
+                cpu += child.cpu_percent(interval=None)
+                memory += child.memory_info().rss
+            except psutil.Error:
+                continue
+            alive[child.pid] = child
+        self._children = alive
+        PROCESS_CPU.set(round(cpu, 1), process="postprocessors")
+        PROCESS_MEMORY.set(memory, process="postprocessors")
+
+    def run(self):
+        """
+        Vòng lặp lấy mẫu cho đến khi dừng.
+        """
+        import psutil
+
+        while not self.stop_event.is_set():
+            try:
+                self.sample()
+            except psutil.Error as e:
+                print(f"Lỗi khi lấy mẫu tài nguyên: {str(e)}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        """
+        Bắt đầu luồng lấy mẫu.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="ResourceSampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Dừng luồng lấy mẫu.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
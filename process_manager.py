@@ -2,7 +2,10 @@
 Module quản lý đa tiến trình để xử lý dữ liệu từ Gemini API.
 """
 import multiprocessing as mp
-from config import MAX_PROCESSES
+from config import MAX_PROCESSES, PROCESS_BATCH_SIZE
+from markdown_renderer import RENDERER
+from metrics import POSTPROCESS_LATENCY
+from tracing import TRACER, make_span
 import time
 import os
 import queue
@@ -19,14 +22,19 @@ class ProcessManager:
         """
         Khởi tạo ProcessManager với các hàng đợi và danh sách tiến trình.
         """
-        # Sử dụng Manager để tạo các hàng đợi có thể chia sẻ giữa các tiến trình
-        self.manager = mp.Manager()
-        self.input_queue = self.manager.Queue()
-        self.output_queue = self.manager.Queue()
+        # Dùng mp.Queue (pipe + luồng feeder) thay cho mp.Manager().Queue():
+        # mỗi put/get không còn phải đi vòng qua một tiến trình server riêng.
+        # Mỗi thông điệp trên input_queue là một danh sách (lô) nhiệm vụ, trên output_queue
+        # là một lô kết quả kèm các span trace đo được trong tiến trình hậu xử lý.
+        self.input_queue = mp.Queue()
+        self.output_queue = mp.Queue()
         self.processes = []
+        # request_id -> thời điểm gửi sang hậu xử lý (chỉ trong tiến trình chính), để đo
+        # thời gian hậu xử lý và số nhiệm vụ đang chờ
+        self.submitted = {}
 
     @staticmethod
-    def post_processor(input_queue, output_queue, processor_id):
+    def post_processor(input_queue, output_queue, processor_id, batch_size=PROCESS_BATCH_SIZE):
         """
         Hàm xử lý cho mỗi tiến trình.
 
@@ -34,36 +42,66 @@ class ProcessManager:
             input_queue: Hàng đợi đầu vào
             output_queue: Hàng đợi đầu ra
             processor_id (int): ID của tiến trình
+            batch_size (int): Số nhiệm vụ tối đa gom lại trong một lần xử lý
         """
         print(f"Tiến trình {processor_id} đã bắt đầu")
+        # Nạp sẵn Python-Markdown trong lúc chưa có nhiệm vụ để phản hồi đầu tiên không phải chờ import
+        RENDERER.warm_up()
 
-        while True:
+        stopping = False
+        while not stopping:
             try:
-                # Lấy dữ liệu từ hàng đợi đầu vào
-                data = input_queue.get(timeout=1.0)
-
-                # Kiểm tra tín hiệu dừng
+                # Chặn cho đến khi có dữ liệu, tín hiệu dừng được gửi qua chính hàng đợi
+                data = input_queue.get()
                 if data == "STOP":
-                    print(f"Tiến trình {processor_id} nhận tín hiệu dừng")
                     break
+                tasks = list(data)
 
-                # Giải nén dữ liệu
-                request_id, prompt, response = data
+                # Gom thêm các nhiệm vụ đang chờ sẵn để xử lý và trả kết quả theo lô
+                while len(tasks) < batch_size:
+                    try:
+                        data = input_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if data == "STOP":
+                        stopping = True
+                        break
+                    tasks.extend(data)
 
-                # Xử lý dữ liệu (ví dụ: định dạng, phân tích, v.v.)
-                processed_response = ProcessManager.process_response(prompt, response, processor_id)
+                results = []
+                spans = []
+                for request_id, prompt, response, trace in tasks:
+                    start = time.time_ns()
+                    attributes = {"request.id": request_id, "processor.id": processor_id}
+                    try:
+                        # Xử lý dữ liệu (ví dụ: định dạng, phân tích, v.v.)
+                        processed_response = ProcessManager.process_response(prompt, response, processor_id)
+                        # Render phản hồi sang HTML một lần tại đây để trình duyệt chỉ cần chèn HTML
+                        html = RENDERER.render(response)
+                    except Exception as e:
+                        # Lỗi của một nhiệm vụ không làm mất cả lô: vẫn trả kết quả (processed_response
+                        # là None) để yêu cầu kết thúc ở trạng thái lỗi thay vì chờ mãi
+                        print(f"Lỗi khi hậu xử lý {request_id} trong tiến trình {processor_id}: {str(e)}")
+                        processed_response = html = None
+                        attributes["error"] = str(e)
+                    # Thông tin tiến trình được truyền qua processor_id
+                    results.append((request_id, prompt, processed_response, processor_id, html))
 
-                # Đưa kết quả đã xử lý vào hàng đợi đầu ra
-                # Thông tin tiến trình được truyền qua processor_id
-                output_queue.put((request_id, prompt, processed_response, processor_id))
+                    # Span được tạo với ngữ cảnh trace gửi kèm nhiệm vụ và gửi trả về cùng kết quả
+                    if trace is not None:
+                        spans.append(make_span(trace["trace_id"], trace["span_id"], "postprocess_queue",
+                                               trace["submitted_at"], start, attributes))
+                        spans.append(make_span(trace["trace_id"], trace["span_id"], "postprocess",
+                                               start, time.time_ns(), {**attributes, "batch.size": len(tasks)}))
+
+                # Đưa cả lô kết quả vào hàng đợi đầu ra bằng một lần put
+                output_queue.put((results, spans))
 
-            except queue.Empty:
-                # Hàng đợi trống, tiếp tục vòng lặp
-                continue
             except Exception as e:
                 # Xử lý lỗi
                 print(f"Lỗi trong tiến trình {processor_id}: {str(e)}")
 
+        print(f"Tiến trình {processor_id} nhận tín hiệu dừng")
         print(f"Tiến trình {processor_id} đã kết thúc")
 
     @staticmethod
@@ -134,7 +172,76 @@ class ProcessManager:
             prompt (str): Câu hỏi gốc
             response (str): Phản hồi từ Gemini API
         """
-        self.input_queue.put((request_id, prompt, response))
+        self.submitted[request_id] = time.monotonic()
+        self.input_queue.put([(request_id, prompt, response, self._trace_context(request_id))])
+
+    def add_tasks(self, tasks):
+        """
+        Thêm nhiều nhiệm vụ xử lý vào hàng đợi bằng một lần put.
+
+        Args:
+            tasks (list): Danh sách (request_id, prompt, response)
+        """
+        if tasks:
+            now = time.monotonic()
+            for request_id, _, _ in tasks:
+                self.submitted[request_id] = now
+            self.input_queue.put([(request_id, prompt, response, self._trace_context(request_id))
+                                  for request_id, prompt, response in tasks])
+
+    @staticmethod
+    def _trace_context(request_id):
+        """
+        Ngữ cảnh trace gửi kèm nhiệm vụ sang tiến trình hậu xử lý, None nếu không theo dõi.
+        """
+        trace = TRACER.context(request_id)
+        if trace is not None:
+            trace["submitted_at"] = time.time_ns()
+        return trace
+
+    def _finish(self, message):
+        """
+        Ghi nhận thời gian hậu xử lý và các span của một lô kết quả vừa nhận.
+
+        Args:
+            message (tuple): (danh sách kết quả, danh sách span) từ tiến trình hậu xử lý
+
+        Returns:
+            list: Danh sách (request_id, prompt, processed_response, processor_id, html)
+        """
+        results, spans = message
+        TRACER.record_remote(spans)
+        now = time.monotonic()
+        for result in results:
+            submitted_at = self.submitted.pop(result[0], None)
+            if submitted_at is not None:
+                POSTPROCESS_LATENCY.observe(now - submitted_at)
+            # Kết quả hậu xử lý là kết quả cuối cùng của yêu cầu (processed_response None: hậu xử lý lỗi)
+            TRACER.end(result[0], error=result[2] is None)
+        return results
+
+    def pending_tasks(self):
+        """
+        Số nhiệm vụ đã gửi nhưng chưa có kết quả hậu xử lý.
+        """
+        return len(self.submitted)
+
+    def wait_processed_responses(self, timeout=None):
+        """
+        Chờ lô phản hồi đã xử lý tiếp theo từ hàng đợi đầu ra.
+
+        Args:
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            list: Danh sách (request_id, prompt, processed_response, processor_id, html),
+                rỗng nếu hết thời gian chờ
+        """
+        try:
+            message = self.output_queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        return self._finish(message)
 
     def get_processed_responses(self):
         """
@@ -144,11 +251,14 @@ class ProcessManager:
             list: Danh sách các phản hồi đã xử lý
         """
         responses = []
-        while not self.output_queue.empty():
-            # Lấy dữ liệu từ hàng đợi (request_id, prompt, processed_response, processor_id)
-            data = self.output_queue.get()
+        while True:
+            # mp.Queue.empty() không đáng tin cậy, nên lấy cho đến khi hàng đợi báo rỗng
+            try:
+                message = self.output_queue.get_nowait()
+            except queue.Empty:
+                break
 
-            # Trả về toàn bộ dữ liệu bao gồm processor_id
-            responses.append(data)
+            # Mỗi phần tử là (request_id, prompt, processed_response, processor_id, html)
+            responses.extend(self._finish(message))
 
         return responses
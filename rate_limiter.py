@@ -0,0 +1,336 @@
+"""
+Module giới hạn tốc độ gọi Gemini API.
+
+Gồm bộ giới hạn theo số yêu cầu và số token mỗi phút (token bucket), bộ điều
+chỉnh số lời gọi đồng thời theo kiểu AIMD (tăng cộng, giảm nhân) dựa trên lỗi
+429 và độ trễ quan sát được, cùng với lỗi RateLimitError mang gợi ý retry-after.
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+
+from config import (RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_BURST, ADAPTIVE_CONCURRENCY_MIN,
+                    ADAPTIVE_DECREASE_FACTOR, ADAPTIVE_DECREASE_COOLDOWN, ADAPTIVE_LATENCY_TARGET,
+                    RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX)
+from token_estimator import ESTIMATOR, IMAGE_TOKENS
+
+# Gợi ý thời gian chờ trong thông báo lỗi của Gemini API,
+# ví dụ "retry_delay { seconds: 34 }" hoặc "Please retry in 34.5s"
+_RETRY_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)"),
+    re.compile(r"retry in\s*(\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+)
+
+
+class RateLimitError(Exception):
+    """
+    Lỗi khi Gemini API từ chối yêu cầu vì vượt quá hạn mức (HTTP 429 / ResourceExhausted).
+    """
+    def __init__(self, message, retry_after=None):
+        """
+        Args:
+            message (str): Thông báo lỗi
+            retry_after (float, optional): Thời gian nên chờ trước khi thử lại (giây)
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(error):
+    """
+    Đọc gợi ý thời gian chờ từ một lỗi của Gemini API.
+
+    Args:
+        error (Exception): Lỗi gốc
+
+    Returns:
+        float: Thời gian chờ (giây) hoặc None nếu không có gợi ý
+    """
+    message = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def estimate_tokens(text, has_image=False):
+    """
+    Ước lượng nhanh số token của một đoạn văn bản (theo tỷ lệ ký tự/token đã hiệu chỉnh của ESTIMATOR).
+
+    Args:
+        text (str): Văn bản
+        has_image (bool): Có ảnh gửi kèm hay không
+
+    Returns:
+        int: Số token ước lượng
+    """
+    return ESTIMATOR.estimate(text, IMAGE_TOKENS if has_image else 0)
+
+
+def backoff_delay(attempt, retry_after=None, base=RATE_LIMIT_BACKOFF_BASE, cap=RATE_LIMIT_BACKOFF_MAX):
+    """
+    Tính thời gian chờ trước lần thử lại tiếp theo.
+
+    Dùng gợi ý retry-after nếu có (cộng thêm một chút ngẫu nhiên để các yêu cầu
+    không cùng thử lại một lúc), nếu không thì dùng exponential backoff với full jitter.
+
+    Args:
+        attempt (int): Số lần đã thử lại (bắt đầu từ 1)
+        retry_after (float, optional): Gợi ý thời gian chờ từ API (giây)
+        base (float): Thời gian chờ cơ bản (giây)
+        cap (float): Thời gian chờ tối đa (giây)
+
+    Returns:
+        float: Thời gian chờ (giây)
+    """
+    if retry_after is not None:
+        return min(retry_after, cap) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Token bucket cho phép tối đa `rate` đơn vị mỗi phút, với sức chứa `capacity`.
+
+    reserve() không chặn mà trả về thời gian cần chờ; lượng đã đặt trước được trừ
+    ngay (có thể âm) nên các yêu cầu đến sau tự động xếp sau.
+    """
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): Số đơn vị được nạp lại mỗi phút
+            capacity (float): Số đơn vị tối đa trong bucket (độ lớn của một đợt gửi dồn)
+        """
+        self.rate = rate / 60.0
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount=1):
+        """
+        Đặt trước một lượng đơn vị.
+
+        Args:
+            amount (float): Số đơn vị cần dùng
+
+        Returns:
+            float: Thời gian cần chờ trước khi được dùng (giây), 0 nếu dùng được ngay
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            # Một yêu cầu lớn hơn sức chứa vẫn được phép khi bucket đầy, nếu không sẽ chờ mãi
+            amount = min(amount, self.capacity)
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def consume(self, amount):
+        """
+        Trừ thêm một lượng đơn vị đã dùng (ví dụ token của phản hồi) mà không chờ.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    def available(self):
+        """
+        Số đơn vị hiện có (âm nếu đang nợ).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class RateLimiter:
+    """
+    Giới hạn số yêu cầu và số token gửi đến Gemini API mỗi phút.
+    """
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, burst=RATE_LIMIT_BURST):
+        """
+        Args:
+            rpm (int): Số yêu cầu tối đa mỗi phút, None để không giới hạn
+            tpm (int): Số token tối đa mỗi phút, None để không giới hạn
+            burst (int): Số yêu cầu tối đa được gửi dồn cùng lúc
+        """
+        self.requests = TokenBucket(rpm, burst) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm) if tpm else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.throttled = 0  # Số lần yêu cầu phải chờ vì giới hạn
+        self.throttled_time = 0.0  # Tổng thời gian đã chờ (giây)
+
+    def reserve(self, tokens):
+        """
+        Đặt trước một yêu cầu với số token ước lượng.
+
+        Args:
+            tokens (int): Số token ước lượng của yêu cầu
+
+        Returns:
+            float: Thời gian cần chờ (giây)
+        """
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        with self._lock:
+            delay = max(delay, self._paused_until - time.monotonic())
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_time += delay
+        return max(delay, 0.0)
+
+    async def acquire(self, tokens):
+        """
+        Chờ (không chặn event loop) cho đến khi được phép gửi yêu cầu.
+
+        Args:
+            tokens (int): Số token ước lượng của yêu cầu
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def consume(self, tokens):
+        """
+        Ghi nhận thêm số token đã dùng sau khi có phản hồi.
+        """
+        if self.tokens is not None:
+            self.tokens.consume(tokens)
+
+    def pause(self, seconds):
+        """
+        Tạm dừng mọi yêu cầu mới trong một khoảng thời gian (khi API báo vượt hạn mức).
+
+        Args:
+            seconds (float): Thời gian tạm dừng (giây)
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """
+        Thống kê của bộ giới hạn.
+
+        Returns:
+            dict: Số đơn vị còn lại, thời gian tạm dừng còn lại và số lần phải chờ
+        """
+        with self._lock:
+            paused = max(0.0, self._paused_until - time.monotonic())
+            throttled, throttled_time = self.throttled, self.throttled_time
+        return {
+            "requests_available": round(self.requests.available(), 2) if self.requests else None,
+            "tokens_available": round(self.tokens.available()) if self.tokens else None,
+            "paused_for": round(paused, 2),
+            "throttled": throttled,
+            "throttled_time": round(throttled_time, 2),
+        }
+
+
+class AdaptiveConcurrency:
+    """
+    Giới hạn số lời gọi API đồng thời, điều chỉnh theo AIMD.
+
+    Mỗi lời gọi thành công với độ trễ dưới ngưỡng tăng giới hạn thêm 1/limit
+    (tức khoảng +1 sau mỗi "vòng" limit lời gọi). Khi gặp lỗi 429 hoặc độ trễ
+    vượt ngưỡng, giới hạn bị nhân với hệ số giảm, nhiều nhất một lần trong mỗi
+    khoảng cooldown để một loạt lỗi của các lời gọi gửi cùng lúc chỉ tính một lần.
+    Dùng được như semaphore từ luồng bất kỳ: acquire() / release().
+    """
+    def __init__(self, maximum, minimum=ADAPTIVE_CONCURRENCY_MIN, initial=None,
+                 decrease_factor=ADAPTIVE_DECREASE_FACTOR, latency_target=ADAPTIVE_LATENCY_TARGET,
+                 cooldown=ADAPTIVE_DECREASE_COOLDOWN):
+        """
+        Args:
+            maximum (int): Giới hạn tối đa
+            minimum (int): Giới hạn tối thiểu
+            initial (int, optional): Giới hạn ban đầu (mặc định bằng maximum)
+            decrease_factor (float): Hệ số nhân khi giảm (0-1)
+            latency_target (float): Độ trễ (giây) mà vượt quá được coi là quá tải
+            cooldown (float): Khoảng thời gian tối thiểu giữa hai lần giảm (giây)
+        """
+        self.maximum = maximum
+        self.minimum = max(1, min(minimum, maximum))
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self._limit = float(initial if initial is not None else maximum)
+        self._in_use = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self.decreases = 0
+
+    @property
+    def limit(self):
+        """
+        Giới hạn hiện tại (số nguyên).
+        """
+        return int(self._limit)
+
+    def acquire(self):
+        """
+        Chờ cho đến khi số lời gọi đang chạy nhỏ hơn giới hạn hiện tại.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_use < int(self._limit))
+            self._in_use += 1
+
+    def release(self):
+        """
+        Trả lại một chỗ.
+        """
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def on_success(self, latency):
+        """
+        Ghi nhận một lời gọi thành công.
+
+        Args:
+            latency (float): Độ trễ của lời gọi (giây)
+        """
+        if latency > self.latency_target:
+            self.on_overload()
+            return
+        with self._condition:
+            old_limit = int(self._limit)
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            if int(self._limit) > old_limit:
+                self._condition.notify()
+
+    def on_overload(self):
+        """
+        Ghi nhận một lỗi 429 (hoặc độ trễ quá cao) và giảm giới hạn.
+        """
+        now = time.monotonic()
+        with self._condition:
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._limit = max(self.minimum, self._limit * self.decrease_factor)
+            self.decreases += 1
+
+    def stats(self):
+        """
+        Thống kê của bộ điều chỉnh.
+
+        Returns:
+            dict: Giới hạn hiện tại, số lời gọi đang chạy và số lần đã giảm
+        """
+        with self._condition:
+            return {
+                "limit": int(self._limit),
+                "in_use": self._in_use,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "decreases": self.decreases,
+            }
@@ -0,0 +1,196 @@
+"""
+Module cache phản hồi của Gemini API trên đĩa (SQLite) cho các câu hỏi lặp lại.
+
+Khóa cache được tạo từ mô hình, context prompt, câu hỏi đã chuẩn hóa và hash
+của ảnh đính kèm, nên cache vẫn dùng được sau khi khởi động lại ứng dụng.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+
+
+def normalize_prompt(prompt):
+    """
+    Chuẩn hóa câu hỏi để các câu chỉ khác nhau về khoảng trắng hay chữ hoa/thường dùng chung khóa.
+
+    Args:
+        prompt (str): Câu hỏi gốc
+
+    Returns:
+        str: Câu hỏi đã chuẩn hóa
+    """
+    return " ".join(unicodedata.normalize("NFC", prompt).split()).casefold()
+
+
+def make_cache_key(model, context_prompt, prompt, image_hash=None):
+    """
+    Tạo khóa cache cho một yêu cầu.
+
+    Args:
+        model (str): Tên mô hình Gemini
+        context_prompt (str): Context prompt gửi kèm mỗi câu hỏi
+        prompt (str): Câu hỏi của người dùng
+        image_hash (str, optional): Hash nội dung của ảnh đính kèm
+
+    Returns:
+        str: Khóa dạng hex SHA-256
+    """
+    parts = [model, context_prompt, normalize_prompt(prompt), image_hash or ""]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache phản hồi lưu trong SQLite với thời gian sống và số mục tối đa.
+    """
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        """
+        Khởi tạo ResponseCache và tạo bảng nếu chưa có.
+
+        Args:
+            path (str): Đường dẫn file SQLite
+            ttl (float): Thời gian sống của mỗi mục (giây)
+            max_entries (int): Số mục tối đa, mục ít được dùng gần đây nhất bị xóa trước
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._touched = {}  # key -> thời điểm trúng cache gần nhất, chưa ghi vào last_used
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0  # Tổng thời gian gọi API đã tiết kiệm được (giây)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " latency REAL NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON response_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Lấy phản hồi đã cache.
+
+        Args:
+            key (str): Khóa cache
+
+        Returns:
+            tuple: (phản hồi, thời gian gọi API ban đầu tính bằng giây) hoặc None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and now - row[2] > self.ttl:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            # last_used chỉ dùng khi dọn dẹp nên được ghi gộp thay vì commit ở mỗi lần trúng
+            self._touched[key] = now
+            if len(self._touched) >= 100:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += 1
+            self.saved_time += row[1]
+            return row[0], row[1]
+
+    def set(self, key, response, latency):
+        """
+        Lưu một phản hồi vào cache.
+
+        Args:
+            key (str): Khóa cache
+            response (str): Phản hồi từ Gemini API
+            latency (float): Thời gian gọi API (giây)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, latency, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, response, latency, now, now)
+            )
+            self._writes += 1
+            # Dọn dẹp định kỳ thay vì ở mỗi lần ghi
+            if self._writes % 100 == 0:
+                self._flush_touched()
+                self._prune(now)
+            self._conn.commit()
+
+    def _flush_touched(self):
+        """
+        Ghi thời điểm trúng cache đã gộp vào cột last_used (phải giữ khóa, chưa commit).
+        """
+        if self._touched:
+            self._conn.executemany("UPDATE response_cache SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def _prune(self, now):
+        """
+        Xóa các mục hết hạn và các mục vượt quá số lượng tối đa (phải giữ khóa).
+        """
+        self._conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            " SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def hit_ratio(self):
+        """
+        Tỉ lệ trúng cache từ khi khởi động.
+        """
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 3) if lookups else 0.0
+
+    def stats(self):
+        """
+        Thống kê hoạt động của cache.
+
+        Returns:
+            dict: Số mục, số lần trúng/trượt, tỉ lệ trúng và thời gian đã tiết kiệm
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio(),
+            "saved_time": round(self.saved_time, 2),
+        }
+
+    def close(self):
+        """
+        Đóng kết nối SQLite.
+        """
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
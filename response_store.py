@@ -0,0 +1,285 @@
+"""
+Module lưu trữ phản hồi có giới hạn bộ nhớ, thay cho dictionary responses_dict không giới hạn.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from config import (RESPONSE_STORE_MAX_BYTES, RESPONSE_STORE_TTL, RESPONSE_SPILL_DIR,
+                    ATTACHMENT_SPILL_THRESHOLD)
+
+
+def _text_size(value):
+    """
+    Ước lượng số byte của một giá trị văn bản.
+    """
+    if not value:
+        return 0
+    if isinstance(value, str):
+        # Ảnh base64 chỉ gồm ký tự ASCII, không cần mã hóa lại chuỗi lớn
+        return len(value) if value.isascii() else len(value.encode("utf-8"))
+    return len(str(value))
+
+
+class ResponseStore:
+    """
+    Lưu các phản hồi theo request_id với chính sách loại bỏ LRU + TTL và ngân sách bộ nhớ.
+
+    Kích thước của mỗi mục được tính từ prompt, phản hồi và ảnh đính kèm. Ảnh lớn
+    hơn ngưỡng được ghi ra đĩa và chỉ được đọc lại khi cần, nên không chiếm chỗ
+    trong bộ nhớ. Có thể dùng như một dictionary: store[id] = ..., store.get(id),
+    id in store, store.values(), store.clear().
+    """
+    def __init__(self, max_bytes=RESPONSE_STORE_MAX_BYTES, ttl=RESPONSE_STORE_TTL,
+                 spill_dir=RESPONSE_SPILL_DIR, spill_threshold=ATTACHMENT_SPILL_THRESHOLD):
+        """
+        Khởi tạo ResponseStore.
+
+        Args:
+            max_bytes (int): Tổng số byte tối đa được giữ trong bộ nhớ
+            ttl (float): Thời gian sống của mỗi mục (giây), None để không giới hạn
+            spill_dir (str): Thư mục lưu ảnh đính kèm lớn
+            spill_threshold (int): Ảnh lớn hơn ngưỡng này (byte) được ghi ra đĩa
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_threshold = spill_threshold
+
+        # request_id -> [response, size, expires_at, spill_path]
+        self._entries = OrderedDict()
+        self._lock = threading.Condition()  # Đánh thức các luồng đang chờ một phản hồi (wait)
+        self._bytes = 0
+        self._last_purge = time.time()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"lru": 0, "ttl": 0}
+        self.spilled = 0
+
+    def __setitem__(self, request_id, response):
+        """
+        Lưu (hoặc thay thế) phản hồi của một yêu cầu.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            response (dict): Phản hồi, có thể chứa ảnh trong trường imageData
+        """
+        response = dict(response)
+        spill_path = None
+
+        image_data = response.get("imageData")
+        if image_data and _text_size(image_data) > self.spill_threshold:
+            spill_path = self._spill(request_id, image_data)
+            response["imageData"] = None
+
+        size = (_text_size(response.get("prompt")) + _text_size(response.get("response"))
+                + _text_size(response.get("imageData")))
+        expires_at = time.time() + self.ttl if self.ttl else None
+
+        with self._lock:
+            old = self._entries.pop(request_id, None)
+            if old is not None:
+                self._discard(old)
+            self._entries[request_id] = [response, size, expires_at, spill_path]
+            self._bytes += size
+            self._evict()
+            self._lock.notify_all()
+
+    def get(self, request_id, default=None, load_attachments=True):
+        """
+        Lấy phản hồi theo request_id và đánh dấu là vừa được dùng.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            default: Giá trị trả về nếu không tìm thấy
+            load_attachments (bool): Đọc lại ảnh đã ghi ra đĩa vào trường imageData
+
+        Returns:
+            dict: Bản sao phản hồi hoặc default
+        """
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is not None and self._expired(entry):
+                self._remove(request_id, "ttl")
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(request_id)
+            response, _, _, spill_path = entry
+
+        return self._materialize(response, spill_path, load_attachments)
+
+    def wait(self, request_id, timeout):
+        """
+        Chờ đến khi có phản hồi cho request_id hoặc hết thời gian.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            timeout (float): Thời gian chờ tối đa (giây)
+
+        Returns:
+            dict: Bản sao phản hồi hoặc None nếu hết thời gian
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: request_id in self._entries, timeout=timeout)
+        return self.get(request_id)
+
+    def __contains__(self, request_id):
+        with self._lock:
+            entry = self._entries.get(request_id)
+            return entry is not None and not self._expired(entry)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def values(self, load_attachments=True):
+        """
+        Lấy tất cả các phản hồi còn hiệu lực, theo thứ tự từ cũ đến mới được dùng.
+
+        Args:
+            load_attachments (bool): Đọc lại ảnh đã ghi ra đĩa vào trường imageData
+
+        Returns:
+            list: Danh sách bản sao các phản hồi
+        """
+        with self._lock:
+            self._purge_expired()
+            entries = [(entry[0], entry[3]) for entry in self._entries.values()]
+
+        return [self._materialize(response, spill_path, load_attachments)
+                for response, spill_path in entries]
+
+    def index(self):
+        """
+        ID và thời điểm hoàn thành của các phản hồi còn hiệu lực, không sao chép nội dung.
+
+        Returns:
+            list: Danh sách (request_id, completed_at)
+        """
+        with self._lock:
+            self._purge_expired()
+            return [(request_id, entry[0].get("completed_at", 0)) for request_id, entry in self._entries.items()]
+
+    def get_many(self, request_ids, load_attachments=True):
+        """
+        Lấy phản hồi của nhiều yêu cầu, theo thứ tự của request_ids.
+
+        Returns:
+            list: Bản sao các phản hồi tìm thấy (bỏ qua ID không còn trong kho)
+        """
+        responses = [self.get(request_id, load_attachments=load_attachments) for request_id in request_ids]
+        return [response for response in responses if response is not None]
+
+    def clear(self):
+        """
+        Xóa tất cả các phản hồi và các file ảnh đã ghi ra đĩa.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                self._discard(entry)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Thống kê hoạt động của ResponseStore.
+
+        Returns:
+            dict: Số mục, số byte, số lần trúng/trượt và số mục bị loại bỏ
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": dict(self.evictions),
+                "spilled_attachments": self.spilled,
+            }
+
+    def _spill(self, request_id, image_data):
+        """
+        Ghi ảnh đính kèm ra đĩa.
+
+        Returns:
+            str: Đường dẫn file đã ghi
+        """
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # Tên file riêng cho mỗi lần ghi để khi thay thế một phản hồi, việc xóa file cũ
+        # không xóa nhầm file vừa ghi
+        path = os.path.join(self.spill_dir, f"{request_id}_{uuid.uuid4().hex[:12]}.txt")
+        with open(path, "w", encoding="ascii") as f:
+            f.write(image_data)
+        self.spilled += 1
+        return path
+
+    @staticmethod
+    def _materialize(response, spill_path, load_attachments):
+        """
+        Tạo bản sao phản hồi, đọc lại ảnh từ đĩa nếu cần.
+        """
+        response = dict(response)
+        if spill_path is not None and load_attachments:
+            try:
+                with open(spill_path, "r", encoding="ascii") as f:
+                    response["imageData"] = f.read()
+            except OSError:
+                response["imageData"] = None
+        return response
+
+    def _expired(self, entry):
+        expires_at = entry[2]
+        return expires_at is not None and expires_at <= time.time()
+
+    def _discard(self, entry):
+        """
+        Giải phóng tài nguyên của một mục (phải giữ khóa).
+        """
+        self._bytes -= entry[1]
+        spill_path = entry[3]
+        if spill_path is not None:
+            try:
+                os.remove(spill_path)
+            except OSError:
+                pass
+
+    def _remove(self, request_id, reason):
+        """
+        Loại bỏ một mục và ghi nhận lý do (phải giữ khóa).
+        """
+        entry = self._entries.pop(request_id)
+        self._discard(entry)
+        self.evictions[reason] += 1
+
+    def _purge_expired(self):
+        """
+        Loại bỏ tất cả các mục đã hết hạn (phải giữ khóa).
+        """
+        self._last_purge = time.time()
+        expired = [key for key, entry in self._entries.items() if self._expired(entry)]
+        for key in expired:
+            self._remove(key, "ttl")
+
+    def _evict(self):
+        """
+        Loại bỏ mục hết hạn và mục ít được dùng nhất cho đến khi nằm trong ngân sách (phải giữ khóa).
+        """
+        # Quét mục hết hạn định kỳ thay vì ở mỗi lần ghi
+        if self.ttl and time.time() - self._last_purge > self.ttl / 10:
+            self._purge_expired()
+
+        # Luôn giữ lại mục vừa ghi, kể cả khi riêng nó đã vượt ngân sách
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, "lru")
@@ -0,0 +1,230 @@
+"""
+Module lưu trữ các phản hồi đã được ProcessManager hậu xử lý, tra cứu theo request_id.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import RESULT_STORE_MAX_BYTES, RESPONSE_STORE_TTL
+from response_store import _text_size
+
+
+class ResultStore:
+    """
+    Lưu các phản hồi đã hậu xử lý theo request_id, với chính sách loại bỏ LRU + TTL và
+    ngân sách bộ nhớ như ResponseStore.
+
+    Việc đọc không xóa dữ liệu, nên nhiều client có thể cùng lấy kết quả mà
+    không làm mất kết quả của nhau. Các luồng có thể chờ một kết quả cụ thể
+    bằng wait() thay vì hỏi liên tục.
+    """
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES, ttl=RESPONSE_STORE_TTL):
+        """
+        Khởi tạo ResultStore rỗng.
+
+        Args:
+            max_bytes (int): Tổng số byte tối đa (câu hỏi, phản hồi đã xử lý và HTML) giữ trong bộ nhớ
+            ttl (float): Thời gian sống của mỗi kết quả (giây), None để không giới hạn
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # request_id -> [kết quả, số byte, thời điểm có kết quả hậu xử lý], theo thứ tự dùng gần nhất
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._last_purge = time.time()
+        self._condition = threading.Condition()
+        self.evictions = {"lru": 0, "ttl": 0}
+
+    def put(self, request_id, prompt, processed_response, processor_id, html=None):
+        """
+        Lưu một phản hồi đã hậu xử lý và đánh thức các luồng đang chờ.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            prompt (str): Câu hỏi gốc
+            processed_response (str): Phản hồi đã xử lý
+            processor_id (int): ID của tiến trình đã xử lý
+            html (str, optional): Phản hồi đã render sang HTML
+        """
+        result = (request_id, prompt, processed_response, processor_id, html)
+        size = _text_size(prompt) + _text_size(processed_response) + _text_size(html)
+        with self._condition:
+            old = self._entries.pop(request_id, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[request_id] = [result, size, time.time()]
+            self._bytes += size
+            self._evict()
+            self._condition.notify_all()
+
+    def get(self, request_id):
+        """
+        Lấy phản hồi đã hậu xử lý theo request_id.
+
+        Returns:
+            tuple: (request_id, prompt, processed_response, processor_id, html) hoặc None
+        """
+        with self._condition:
+            return self._lookup(request_id)
+
+    def wait(self, request_id, timeout):
+        """
+        Chờ đến khi có phản hồi đã hậu xử lý cho request_id hoặc hết thời gian.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            timeout (float): Thời gian chờ tối đa (giây)
+
+        Returns:
+            tuple: Phản hồi đã xử lý hoặc None nếu hết thời gian
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: request_id in self._entries, timeout=timeout)
+            return self._lookup(request_id)
+
+    def get_many(self, request_ids):
+        """
+        Lấy phản hồi đã hậu xử lý của nhiều yêu cầu.
+
+        Returns:
+            dict: request_id -> (request_id, prompt, processed_response, processor_id, html),
+                chỉ gồm các yêu cầu đã có kết quả
+        """
+        with self._condition:
+            results = {}
+            for request_id in request_ids:
+                result = self._lookup(request_id)
+                if result is not None:
+                    results[request_id] = result
+            return results
+
+    def changed_since(self, since):
+        """
+        ID các yêu cầu có kết quả hậu xử lý sau thời điểm since.
+
+        Args:
+            since (float): Thời điểm (giây, theo time.time())
+
+        Returns:
+            set: Các request_id
+        """
+        with self._condition:
+            return {request_id for request_id, entry in self._entries.items()
+                    if entry[2] > since and not self._expired(entry)}
+
+    def get_all(self):
+        """
+        Lấy tất cả các phản hồi đã hậu xử lý.
+
+        Returns:
+            dict: request_id -> (request_id, prompt, processed_response, processor_id, html)
+        """
+        with self._condition:
+            return {request_id: entry[0] for request_id, entry in self._entries.items() if not self._expired(entry)}
+
+    def clear(self):
+        """
+        Xóa tất cả các phản hồi đã hậu xử lý.
+        """
+        with self._condition:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Số kết quả, số byte đang giữ và số kết quả bị loại bỏ.
+        """
+        with self._condition:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": dict(self.evictions),
+            }
+
+    def _lookup(self, request_id):
+        """
+        Lấy kết quả còn hạn và đánh dấu là vừa được dùng (phải giữ khóa).
+        """
+        entry = self._entries.get(request_id)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(request_id, "ttl")
+            return None
+        self._entries.move_to_end(request_id)
+        return entry[0]
+
+    def _expired(self, entry):
+        return self.ttl is not None and entry[2] + self.ttl <= time.time()
+
+    def _remove(self, request_id, reason):
+        """
+        Loại bỏ một kết quả và ghi nhận lý do (phải giữ khóa).
+        """
+        entry = self._entries.pop(request_id)
+        self._bytes -= entry[1]
+        self.evictions[reason] += 1
+
+    def _evict(self):
+        """
+        Loại bỏ kết quả hết hạn và kết quả ít được dùng nhất cho đến khi nằm trong ngân sách (phải giữ khóa).
+        """
+        # Quét kết quả hết hạn định kỳ thay vì ở mỗi lần ghi
+        if self.ttl and time.time() - self._last_purge > self.ttl / 10:
+            self._last_purge = time.time()
+            for request_id in [key for key, entry in self._entries.items() if self._expired(entry)]:
+                self._remove(request_id, "ttl")
+
+        # Luôn giữ lại kết quả vừa ghi, kể cả khi riêng nó đã vượt ngân sách
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)), "lru")
+
+
+class ResultCollector:
+    """
+    Luồng nền chuyển các phản hồi từ hàng đợi đầu ra của ProcessManager vào ResultStore.
+    """
+    def __init__(self, process_manager, store):
+        """
+        Khởi tạo ResultCollector.
+
+        Args:
+            process_manager (ProcessManager): Nguồn phản hồi đã hậu xử lý
+            store (ResultStore): Nơi lưu phản hồi
+        """
+        self.process_manager = process_manager
+        self.store = store
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """
+        Vòng lặp thu thập kết quả, chặn trên hàng đợi đầu ra cho đến khi có dữ liệu.
+        """
+        while not self.stop_event.is_set():
+            try:
+                batch = self.process_manager.wait_processed_responses(timeout=1.0)
+            except (EOFError, OSError, ValueError):
+                # Hàng đợi đã bị đóng khi ProcessManager dừng
+                break
+
+            for data in batch:
+                self.store.put(*data)
+
+    def start(self):
+        """
+        Bắt đầu luồng thu thập.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="ResultCollector", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Dừng luồng thu thập.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
@@ -0,0 +1,235 @@
+"""
+Module lập lịch yêu cầu theo lớp ưu tiên và chia sẻ công bằng giữa các client.
+
+Thay cho hàng đợi FIFO duy nhất: yêu cầu hỏi đáp trực tiếp (interactive) luôn
+được phục vụ trước yêu cầu hàng loạt (batch), trong mỗi lớp các client được
+chia lượt theo weighted fair queuing để một client gửi nhiều không chiếm hết
+hàng đợi, và yêu cầu ở lớp thấp chờ quá lâu được ưu tiên (aging) để không bị bỏ đói.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from config import SCHEDULER_CLASSES, SCHEDULER_DEFAULT_CLASS, SCHEDULER_AGING
+
+
+class _ClassQueue:
+    """
+    Hàng đợi của một lớp ưu tiên.
+    """
+    def __init__(self):
+        self.heap = []  # (finish_tag, seq, enqueued_at, item)
+        self.virtual_time = 0.0
+        self.last_finish = {}  # client_id -> finish tag của yêu cầu cuối cùng
+        self.arrivals = deque()  # (enqueued_at, seq) theo thứ tự đến, để tìm yêu cầu chờ lâu nhất
+        self.pending = set()  # seq của các yêu cầu còn trong heap
+        self.waits = deque(maxlen=1000)  # Thời gian chờ của các yêu cầu gần đây (giây)
+        self.enqueued = 0
+        self.dequeued = 0
+        self.aged = 0
+
+    def oldest(self):
+        """
+        Thời điểm vào hàng đợi của yêu cầu chờ lâu nhất, None nếu hàng đợi rỗng.
+        """
+        while self.arrivals and self.arrivals[0][1] not in self.pending:
+            self.arrivals.popleft()
+        return self.arrivals[0][0] if self.arrivals else None
+
+
+class FairScheduler:
+    """
+    Hàng đợi ưu tiên nhiều lớp với weighted fair queuing theo client và aging.
+
+    Giao diện put() / get() / ack() / qsize() / interrupt() / replay() / stats() được
+    dùng chung với DurableQueue để AsyncEngine có thể dùng một trong hai.
+    """
+    def __init__(self, classes=SCHEDULER_CLASSES, default_class=SCHEDULER_DEFAULT_CLASS, aging=SCHEDULER_AGING):
+        """
+        Khởi tạo FairScheduler.
+
+        Args:
+            classes (tuple): Tên các lớp ưu tiên, từ cao đến thấp
+            default_class (str): Lớp dùng khi put() không chỉ định lớp
+            aging (float): Yêu cầu ở lớp thấp chờ lâu hơn khoảng này (giây) được phục vụ
+                trước lớp cao hơn
+        """
+        if default_class not in classes:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {default_class}")
+        self.classes = tuple(classes)
+        self.default_class = default_class
+        self.aging = aging
+        self._queues = {name: _ClassQueue() for name in self.classes}
+        self._condition = threading.Condition()
+        self._seq = itertools.count()
+        self._size = 0
+        self._aged_last = False
+        self._interrupted = False
+
+    def put(self, item, priority_class=None, client_id=None, weight=1.0, cost=1.0):
+        """
+        Thêm một yêu cầu vào hàng đợi.
+
+        Args:
+            item: Yêu cầu
+            priority_class (str, optional): Lớp ưu tiên (mặc định là default_class)
+            client_id (str, optional): Client/phiên gửi yêu cầu, dùng để chia lượt công bằng
+            weight (float): Trọng số của client, client có trọng số lớn hơn được phục vụ nhiều hơn
+            cost (float): Chi phí của yêu cầu (theo số token), yêu cầu lớn đẩy lượt tiếp theo
+                của client đó ra sau nhiều hơn
+
+        Raises:
+            ValueError: Nếu lớp ưu tiên không tồn tại
+        """
+        priority_class = priority_class or self.default_class
+        class_queue = self._queues.get(priority_class)
+        if class_queue is None:
+            raise ValueError(f"Lớp ưu tiên không hợp lệ: {priority_class}")
+
+        now = time.monotonic()
+        with self._condition:
+            # Finish tag của WFQ: yêu cầu tiếp theo của một client xếp sau yêu cầu
+            # trước của chính client đó, nhưng không sớm hơn "thời gian ảo" của lớp
+            start = max(class_queue.virtual_time, class_queue.last_finish.get(client_id, 0.0))
+            finish = start + cost / weight
+            class_queue.last_finish[client_id] = finish
+
+            seq = next(self._seq)
+            heapq.heappush(class_queue.heap, (finish, seq, now, item))
+            class_queue.arrivals.append((now, seq))
+            class_queue.pending.add(seq)
+            class_queue.enqueued += 1
+            self._size += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Lấy yêu cầu tiếp theo, chặn cho đến khi có yêu cầu.
+
+        Args:
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            Yêu cầu tiếp theo, hoặc None nếu hết thời gian chờ hay bị interrupt()
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._size > 0 or self._interrupted, timeout=timeout):
+                return None
+            if self._interrupted:
+                self._interrupted = False
+                return None
+
+            now = time.monotonic()
+            class_queue, aged = self._pick(now)
+            if aged:
+                # Yêu cầu chờ lâu nhất của lớp, không phải yêu cầu có finish tag nhỏ nhất
+                oldest_seq = class_queue.arrivals[0][1]
+                index = next(i for i, entry in enumerate(class_queue.heap) if entry[1] == oldest_seq)
+                finish, seq, enqueued_at, item = class_queue.heap[index]
+                class_queue.heap[index] = class_queue.heap[-1]
+                class_queue.heap.pop()
+                heapq.heapify(class_queue.heap)
+            else:
+                finish, seq, enqueued_at, item = heapq.heappop(class_queue.heap)
+                # Yêu cầu được chọn nhờ aging không đẩy thời gian ảo của lớp lên
+                class_queue.virtual_time = max(class_queue.virtual_time, finish)
+            class_queue.pending.discard(seq)
+            class_queue.waits.append(now - enqueued_at)
+            class_queue.dequeued += 1
+            self._size -= 1
+
+            # Client không còn yêu cầu nào phía trước thời gian ảo thì không cần giữ finish tag
+            if not class_queue.heap:
+                class_queue.last_finish.clear()
+            elif len(class_queue.last_finish) > 2 * len(class_queue.heap):
+                class_queue.last_finish = {
+                    client: tag for client, tag in class_queue.last_finish.items()
+                    if tag > class_queue.virtual_time
+                }
+            return item
+
+    def _pick(self, now):
+        """
+        Chọn lớp được phục vụ tiếp theo (phải giữ khóa).
+
+        Returns:
+            tuple: (hàng đợi của lớp, True nếu được chọn nhờ aging)
+        """
+        # Aging: lớp thấp có yêu cầu chờ quá lâu được phục vụ trước. Không chọn nhờ aging
+        # hai lần liên tiếp để khi quá tải kéo dài, lớp cao vẫn được phục vụ xen kẽ
+        if not self._aged_last:
+            for name in reversed(self.classes[1:]):
+                class_queue = self._queues[name]
+                oldest = class_queue.oldest()
+                if oldest is not None and now - oldest > self.aging:
+                    class_queue.aged += 1
+                    self._aged_last = True
+                    return class_queue, True
+
+        self._aged_last = False
+        for name in self.classes:
+            if self._queues[name].heap:
+                return self._queues[name], False
+
+    def qsize(self, priority_class=None):
+        """
+        Số yêu cầu đang chờ (của một lớp hoặc của tất cả các lớp).
+        """
+        with self._condition:
+            if priority_class is None:
+                return self._size
+            return len(self._queues[priority_class].heap)
+
+    def ack(self, item):
+        """
+        Xác nhận đã xử lý xong một yêu cầu (hàng đợi trong bộ nhớ không cần làm gì thêm).
+        """
+
+    def interrupt(self):
+        """
+        Đánh thức luồng đang chờ trong get() (get() trả về None), dùng khi dừng AsyncEngine.
+        """
+        with self._condition:
+            self._interrupted = True
+            self._condition.notify_all()
+
+    def replay(self):
+        """
+        Hàng đợi trong bộ nhớ không còn yêu cầu nào sau khi khởi động lại.
+
+        Returns:
+            int: Luôn là 0
+        """
+        return 0
+
+    def stats(self):
+        """
+        Thống kê theo từng lớp ưu tiên.
+
+        Returns:
+            dict: Với mỗi lớp: số yêu cầu đang chờ, số client, số đã vào/ra hàng đợi,
+                số lần được ưu tiên nhờ aging và thời gian chờ (trung bình, p95, tối đa, hiện tại)
+        """
+        now = time.monotonic()
+        result = {}
+        with self._condition:
+            for name in self.classes:
+                class_queue = self._queues[name]
+                waits = sorted(class_queue.waits)
+                oldest = class_queue.oldest()
+                result[name] = {
+                    "depth": len(class_queue.heap),
+                    "clients": len(class_queue.last_finish),
+                    "enqueued": class_queue.enqueued,
+                    "dequeued": class_queue.dequeued,
+                    "aged": class_queue.aged,
+                    "wait": {
+                        "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                        "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                        "max": round(waits[-1], 3) if waits else 0.0,
+                        "oldest_pending": round(now - oldest, 3) if oldest is not None else 0.0,
+                    },
+                }
+        return result
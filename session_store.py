@@ -0,0 +1,227 @@
+"""
+Module lưu lịch sử hội thoại theo phiên (session_id) ở phía server.
+
+Mỗi phiên giữ các lượt hỏi-đáp gần đây và một bản tóm tắt các lượt cũ hơn. Lịch sử
+gửi kèm mỗi câu hỏi không vượt quá ngân sách token: khi vượt, các lượt cũ được tóm tắt
+trong nền (GeminiClient gọi begin_summary/finish_summary), và trong lúc chờ tóm tắt
+thì các lượt cũ nhất bị bỏ qua. Phiên lâu không dùng bị loại theo LRU + TTL để bộ nhớ
+không tăng mãi.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import (SESSION_MAX_SESSIONS, SESSION_IDLE_TTL, SESSION_TOKEN_BUDGET, SESSION_KEEP_TURNS)
+from rate_limiter import estimate_tokens
+
+# Ghi chú kèm lượt hỏi có ảnh (ảnh không được lưu trong lịch sử)
+_IMAGE_NOTE = " [kèm ảnh]"
+
+
+class SessionStore:
+    """
+    Lịch sử hội thoại của các phiên, với ngân sách token và loại bỏ LRU + TTL.
+    """
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, idle_ttl=SESSION_IDLE_TTL,
+                 token_budget=SESSION_TOKEN_BUDGET, keep_turns=SESSION_KEEP_TURNS):
+        """
+        Khởi tạo SessionStore.
+
+        Args:
+            max_sessions (int): Số phiên tối đa giữ trong bộ nhớ
+            idle_ttl (float): Thời gian một phiên được giữ khi không có câu hỏi mới (giây), None để không giới hạn
+            token_budget (int): Số token tối đa của lịch sử gửi kèm mỗi câu hỏi
+            keep_turns (int): Số lượt gần nhất được giữ nguyên văn khi tóm tắt
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+
+        # session_id -> {"summary", "summary_tokens", "turns": [(seq, prompt, response, tokens)],
+        #                "tokens", "next_seq", "summarizing", "last_used"}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.evictions = {"lru": 0, "ttl": 0}
+        self.summaries = 0
+        self.truncated = 0  # Số lần phải bỏ lượt cũ vì chưa kịp tóm tắt
+
+    def _get(self, session_id):
+        """
+        Lấy phiên và đánh dấu là vừa được dùng (phải giữ khóa).
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if self.idle_ttl and time.time() - session["last_used"] > self.idle_ttl:
+            del self._sessions[session_id]
+            self.evictions["ttl"] += 1
+            return None
+        session["last_used"] = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict(self):
+        """
+        Loại các phiên hết hạn rồi đến các phiên lâu không dùng nhất (phải giữ khóa).
+        """
+        if self.idle_ttl:
+            now = time.time()
+            # Phiên ở đầu OrderedDict là phiên lâu không dùng nhất
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if now - session["last_used"] <= self.idle_ttl:
+                    break
+                del self._sessions[session_id]
+                self.evictions["ttl"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions["lru"] += 1
+
+    def history(self, session_id):
+        """
+        Lịch sử gửi kèm câu hỏi tiếp theo của phiên, theo định dạng history của ChatSession.
+
+        Bản tóm tắt (nếu có) được đặt ở đầu; nếu lịch sử vẫn vượt ngân sách token (bản
+        tóm tắt chưa xong), các lượt cũ nhất bị bỏ qua.
+
+        Args:
+            session_id (str): ID của phiên
+
+        Returns:
+            list: [{"role": "user"/"model", "parts": [str]}], rỗng nếu phiên chưa có lịch sử
+        """
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return []
+            summary = session["summary"]
+            budget = self.token_budget - session["summary_tokens"]
+            turns = []
+            # Lấy các lượt từ mới đến cũ cho đến khi hết ngân sách (luôn giữ lượt gần nhất)
+            for _, prompt, response, tokens in reversed(session["turns"]):
+                if turns and tokens > budget:
+                    self.truncated += 1
+                    break
+                turns.append((prompt, response))
+                budget -= tokens
+            turns.reverse()
+
+        history = []
+        if summary:
+            history.append({"role": "user", "parts": [f"Tóm tắt cuộc trò chuyện trước đó: {summary}"]})
+            history.append({"role": "model", "parts": ["Mình nhớ rồi, mình tiếp tục nhé."]})
+        for prompt, response in turns:
+            history.append({"role": "user", "parts": [prompt]})
+            history.append({"role": "model", "parts": [response]})
+        return history
+
+    def append(self, session_id, prompt, response, has_image=False):
+        """
+        Thêm một lượt hỏi-đáp vào phiên (tạo phiên nếu chưa có).
+
+        Args:
+            session_id (str): ID của phiên
+            prompt (str): Câu hỏi của người dùng
+            response (str): Câu trả lời
+            has_image (bool): Câu hỏi có ảnh kèm theo hay không (ảnh không được lưu)
+
+        Returns:
+            bool: True nếu lịch sử đã vượt ngân sách và nên tóm tắt các lượt cũ
+        """
+        if has_image:
+            prompt += _IMAGE_NOTE
+        tokens = estimate_tokens(prompt) + estimate_tokens(response)
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                session = {"summary": None, "summary_tokens": 0, "turns": [], "tokens": 0, "next_seq": 0,
+                           "summarizing": False, "last_used": time.time()}
+                self._sessions[session_id] = session
+                self._evict()
+            session["turns"].append((session["next_seq"], prompt, response, tokens))
+            session["next_seq"] += 1
+            session["tokens"] += tokens
+            # Giới hạn cứng khi tóm tắt không theo kịp (hoặc bị lỗi), để bộ nhớ của mỗi phiên có hạn
+            while len(session["turns"]) > 1 and session["tokens"] > 2 * self.token_budget:
+                session["tokens"] -= session["turns"].pop(0)[3]
+            return (not session["summarizing"] and len(session["turns"]) > self.keep_turns
+                    and session["tokens"] + session["summary_tokens"] > self.token_budget)
+
+    def begin_summary(self, session_id):
+        """
+        Lấy các lượt cũ cần tóm tắt và đánh dấu phiên đang được tóm tắt.
+
+        Returns:
+            tuple: (bản tóm tắt hiện có hoặc None, [(prompt, response)], seq của lượt cuối cùng
+                được tóm tắt), hoặc None nếu không cần tóm tắt
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session["summarizing"] or len(session["turns"]) <= self.keep_turns:
+                return None
+            old_turns = session["turns"][:-self.keep_turns] if self.keep_turns else list(session["turns"])
+            session["summarizing"] = True
+            return (session["summary"], [(prompt, response) for _, prompt, response, _ in old_turns],
+                    old_turns[-1][0])
+
+    def finish_summary(self, session_id, summary, last_seq):
+        """
+        Thay các lượt đã tóm tắt (seq <= last_seq) bằng bản tóm tắt mới.
+
+        Args:
+            session_id (str): ID của phiên
+            summary (str): Bản tóm tắt mới (đã gồm bản tóm tắt cũ)
+            last_seq (int): seq của lượt cuối cùng được tóm tắt (từ begin_summary)
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session["summarizing"] = False
+            folded = [turn for turn in session["turns"] if turn[0] <= last_seq]
+            session["turns"] = [turn for turn in session["turns"] if turn[0] > last_seq]
+            session["tokens"] -= sum(turn[3] for turn in folded)
+            session["summary"] = summary
+            session["summary_tokens"] = estimate_tokens(summary)
+            self.summaries += 1
+
+    def abort_summary(self, session_id):
+        """
+        Bỏ đánh dấu đang tóm tắt khi việc tóm tắt bị lỗi (lần thêm lượt sau sẽ thử lại).
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["summarizing"] = False
+
+    def clear(self, session_id=None):
+        """
+        Xóa một phiên, hoặc mọi phiên nếu không chỉ định session_id.
+        """
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        """
+        Thống kê số phiên, số token đang giữ và số lần tóm tắt/loại bỏ.
+        """
+        with self._lock:
+            self._evict()
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "tokens": sum(session["tokens"] + session["summary_tokens"] for session in self._sessions.values()),
+                "token_budget": self.token_budget,
+                "summaries": self.summaries,
+                "truncated": self.truncated,
+                "evictions": dict(self.evictions),
+            }
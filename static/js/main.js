@@ -2,24 +2,59 @@
 const pendingRequests = new Set();
 const chatMessages = [];
 
-// Biến lưu trữ dữ liệu ảnh hiện tại
-let currentImageData = null;
+// Lịch sử phản hồi đã tải (theo ID) và con trỏ đồng bộ: các lần mở lịch sử sau chỉ tải phần thay đổi
+const historyCache = new Map();
+let historySync = null;
+
+// Biến lưu trữ ảnh hiện tại (file gốc và URL xem trước)
+let currentImageFile = null;
+let currentImageUrl = null;
+
+// ID phiên hội thoại của tab này, để server trả lời dựa trên các câu hỏi trước đó
+let sessionId = sessionStorage.getItem('sessionId') || newSessionId();
+
+// Tạo ID phiên mới (bắt đầu cuộc trò chuyện mới)
+function newSessionId() {
+    const id = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    sessionStorage.setItem('sessionId', id);
+    return id;
+}
+
+// Tải ảnh lên server dưới dạng multipart và trả về ID của ảnh
+async function uploadImage(file) {
+    const formData = new FormData();
+    formData.append('image', file);
+
+    const response = await fetch('/api/images', {
+        method: 'POST',
+        body: formData
+    });
+    const data = await response.json();
+
+    if (!response.ok) {
+        throw new Error(data.error || 'Upload failed');
+    }
+    return data.id;
+}
 
 // Hàm để gửi một câu hỏi
-async function askQuestion(prompt, imageData = null) {
+async function askQuestion(prompt, imageFile = null, imageUrl = null) {
     try {
         // Hiển thị tin nhắn người dùng ngay lập tức
-        addUserMessage(prompt, imageData);
+        addUserMessage(prompt, imageUrl);
 
         // Hiển thị trạng thái đang nhập
         showTypingIndicator();
 
-        // Tạo body request
-        const requestBody = { prompt };
+        // Tạo body request, dùng chế độ stream nếu trình duyệt hỗ trợ Server-Sent Events
+        const useStream = typeof EventSource !== 'undefined';
+        const requestBody = { prompt, stream: useStream, session_id: sessionId };
 
-        // Thêm ảnh nếu có
-        if (imageData) {
-            requestBody.image = imageData;
+        // Ảnh được tải lên riêng (bytes gốc, không base64), câu hỏi chỉ gửi kèm ID
+        if (imageFile) {
+            requestBody.image_id = await uploadImage(imageFile);
         }
 
         const response = await fetch('/api/ask', {
@@ -34,7 +69,11 @@ async function askQuestion(prompt, imageData = null) {
 
         if (data.id) {
             pendingRequests.add(data.id);
-            pollStatus(data.id);
+            if (data.stream) {
+                streamResponse(data.id);
+            } else {
+                pollStatus(data.id);
+            }
             return data.id;
         }
     } catch (error) {
@@ -46,9 +85,11 @@ async function askQuestion(prompt, imageData = null) {
 }
 
 // Hàm để kiểm tra trạng thái của một yêu cầu
-async function checkStatus(requestId) {
+// wait > 0: server giữ kết nối (long-poll) tối đa wait giây cho đến khi có kết quả
+async function checkStatus(requestId, wait = 0) {
     try {
-        const response = await fetch(`/api/status/${requestId}`);
+        const url = wait > 0 ? `/api/status/${requestId}?wait=${wait}` : `/api/status/${requestId}`;
+        const response = await fetch(url);
         return await response.json();
     } catch (error) {
         console.error('Error checking status:', error);
@@ -56,24 +97,72 @@ async function checkStatus(requestId) {
     }
 }
 
-// Hàm để lấy tất cả các phản hồi
+// Hàm để lấy tất cả các phản hồi: lần đầu tải theo từng trang, các lần sau chỉ tải
+// các phản hồi mới hoặc vừa được hậu xử lý kể từ lần đồng bộ trước (?since=...)
 async function getAllResponses() {
     try {
-        const response = await fetch('/api/responses');
-        return await response.json();
+        const params = new URLSearchParams({ limit: '100' });
+        if (historySync) {
+            params.set('since', historySync);
+        }
+        let sync = null;
+        while (true) {
+            const response = await fetch(`/api/responses?${params}`);
+            const data = await response.json();
+            data.responses.forEach(item => historyCache.set(item.id, item));
+            sync = sync || data.sync;
+            if (!data.next_cursor) break;
+            params.set('cursor', data.next_cursor);
+        }
+        historySync = sync;
     } catch (error) {
         console.error('Error getting responses:', error);
-        return [];
     }
+    return Array.from(historyCache.values());
+}
+
+// Chuyển văn bản thường sang HTML (thoát ký tự đặc biệt), dùng khi phản hồi không có HTML do server render
+function textToHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text || '';
+    return `<p>${div.innerHTML.replace(/\n/g, '<br>')}</p>`;
+}
+
+// HTML hiển thị của một phản hồi: server đã render Markdown và làm sạch sẵn trong trường html
+function responseHtml(message, responseData) {
+    if (responseData && typeof responseData.html === 'string') {
+        return responseData.html;
+    }
+    return textToHtml(processResponseForDisplay(message));
+}
+
+// URL ảnh đính kèm của một phản hồi trong lịch sử (lịch sử không kèm dữ liệu ảnh, ảnh đã tải lên
+// được lấy qua /api/images/<id>)
+function responseImageUrl(response) {
+    if (!response.has_image) return null;
+    return response.imageData || (response.image_id ? `/api/images/${response.image_id}` : null);
 }
 
-// Hàm để liên tục kiểm tra trạng thái của một yêu cầu
-function pollStatus(requestId) {
-    const interval = setInterval(async () => {
-        const statusData = await checkStatus(requestId);
+// Tạo chuỗi hiển thị thông tin hiệu suất từ các trường có trong performance
+function formatPerformance(performance) {
+    if (!performance) return '';
+
+    let info = '';
+    if (performance.time !== undefined) {
+        info += ` | Thời gian: ${performance.time}s`;
+    }
+    if (performance.cache && performance.cache.hit) {
+        info += ` | Cache (tiết kiệm ${performance.cache.saved}s)`;
+    }
+    return info;
+}
+
+// Hàm để liên tục kiểm tra trạng thái của một yêu cầu bằng long-poll
+async function pollStatus(requestId) {
+    while (true) {
+        const statusData = await checkStatus(requestId, 25);
 
         if (statusData.status === 'completed') {
-            clearInterval(interval);
             pendingRequests.delete(requestId);
 
             // Ẩn trạng thái đang nhập
@@ -81,8 +170,91 @@ function pollStatus(requestId) {
 
             // Hiển thị phản hồi từ bot
             addBotMessage(statusData.data.response, statusData.data);
+            return;
+        }
+
+        if (statusData.status === 'error') {
+            // Lỗi mạng: đợi một chút trước khi thử lại
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+}
+
+// Nhận phản hồi dạng stream qua Server-Sent Events và hiển thị dần từng đoạn
+function streamResponse(requestId) {
+    const source = new EventSource(`/api/stream/${requestId}`);
+    let text = '';
+    let messageElement = null;
+    let renderScheduled = false;
+    let finished = false;
+
+    // Gộp nhiều đoạn nhận được trong cùng một khung hình thành một lần cập nhật; trong lúc
+    // stream chỉ hiển thị văn bản thô, HTML do server render được thay vào khi nhận sự kiện done
+    const render = () => {
+        renderScheduled = false;
+        if (messageElement) {
+            messageElement.querySelector('.message-content').textContent = text;
+        }
+    };
+
+    source.addEventListener('chunk', (event) => {
+        const chunk = JSON.parse(event.data).text;
+        text += chunk;
+
+        if (!messageElement) {
+            // Đoạn đầu tiên: thay trạng thái đang nhập bằng tin nhắn bot
+            hideTypingIndicator();
+            const chatContainer = document.getElementById('chat-messages');
+            chatContainer.insertAdjacentHTML('afterbegin', buildBotMessageHtml('', null, new Date().toLocaleTimeString()));
+            messageElement = chatContainer.firstElementChild;
+            messageElement.querySelector('.message-content').classList.add('streaming');
+        }
+
+        if (!renderScheduled) {
+            renderScheduled = true;
+            requestAnimationFrame(render);
+        }
+    });
+
+    source.addEventListener('done', (event) => {
+        finished = true;
+        source.close();
+        pendingRequests.delete(requestId);
+        hideTypingIndicator();
+
+        const responseData = JSON.parse(event.data);
+        const message = responseData ? responseData.response : text;
+
+        if (!messageElement) {
+            addBotMessage(message, responseData);
+            return;
+        }
+
+        // Thay tin nhắn đang stream bằng bản đầy đủ (kèm thông tin xử lý) tại đúng vị trí
+        const processedMessage = processResponseForDisplay(message);
+        const timestamp = new Date().toLocaleTimeString();
+        messageElement.insertAdjacentHTML('beforebegin',
+            buildBotMessageHtml(responseHtml(message, responseData), responseData, timestamp));
+        messageElement.remove();
+
+        chatMessages.unshift({
+            type: 'bot',
+            content: processedMessage,
+            timestamp: timestamp,
+            responseData: responseData
+        });
+    });
+
+    source.onerror = () => {
+        if (finished) return;
+        // Mất kết nối stream: chuyển sang kiểm tra trạng thái định kỳ
+        source.close();
+        if (messageElement) {
+            messageElement.remove();
         }
-    }, 1000);
+        showTypingIndicator();
+        pollStatus(requestId);
+    };
 }
 
 // Hiển thị trạng thái đang nhập
@@ -147,16 +319,12 @@ function addUserMessage(message, imageData = null) {
     });
 }
 
-// Thêm tin nhắn bot vào khung chat
-function addBotMessage(message, responseData = null) {
-    const timestamp = new Date().toLocaleTimeString();
+// Tạo HTML cho một tin nhắn bot (contentHtml là HTML đã làm sạch của nội dung tin nhắn)
+function buildBotMessageHtml(contentHtml, responseData, timestamp) {
     let threadInfo = '';
 
     if (responseData) {
-        let performanceInfo = '';
-        if (responseData.performance) {
-            performanceInfo = ` | Thời gian: ${responseData.performance.time}s | CPU: ${responseData.performance.cpu}% | RAM: ${responseData.performance.memory}MB`;
-        }
+        const performanceInfo = formatPerformance(responseData.performance);
 
         // Thêm thông tin processor nếu có
         let processorInfo = '';
@@ -167,16 +335,23 @@ function addBotMessage(message, responseData = null) {
         threadInfo = `<div class="thread-info">ID: ${responseData.id} | Xử lý bởi: ${responseData.thread}${processorInfo}${performanceInfo}</div>`;
     }
 
-    // Xử lý tin nhắn để loại bỏ phần "Câu hỏi: ..." nếu có
-    let processedMessage = processResponseForDisplay(message);
-
-    const messageHtml = `
+    return `
         <div class="message message-bot">
-            <div class="message-content">${marked.parse(processedMessage)}</div>
+            <div class="message-content">${contentHtml}</div>
             ${threadInfo}
             <div class="message-time">${timestamp}</div>
         </div>
     `;
+}
+
+// Thêm tin nhắn bot vào khung chat
+function addBotMessage(message, responseData = null) {
+    const timestamp = new Date().toLocaleTimeString();
+
+    // Xử lý tin nhắn để loại bỏ phần "Câu hỏi: ..." nếu có
+    let processedMessage = processResponseForDisplay(message);
+
+    const messageHtml = buildBotMessageHtml(responseHtml(message, responseData), responseData, timestamp);
 
     const chatContainer = document.getElementById('chat-messages');
     chatContainer.insertAdjacentHTML('afterbegin', messageHtml);
@@ -213,6 +388,12 @@ async function clearAllHistory() {
         const result = await response.json();
 
         if (result.status === 'success') {
+            // Bắt đầu cuộc trò chuyện mới, server không còn dùng lịch sử cũ
+            fetch(`/api/sessions/${encodeURIComponent(sessionId)}`, { method: 'DELETE' });
+            sessionId = newSessionId();
+            historyCache.clear();
+            historySync = null;
+
             // Xóa nội dung trong modal
             const historyContainer = document.getElementById('history-container');
             historyContainer.innerHTML = `
@@ -277,16 +458,16 @@ async function loadHistoryToModal() {
                         <h6 class="card-subtitle mb-2 text-muted">
                             Xử lý bởi: ${response.thread}
                             ${response.processor ? ` | ${response.processor}` : ''}
-                            ${response.performance ? ` | Thời gian: ${response.performance.time}s | CPU: ${response.performance.cpu}% | RAM: ${response.performance.memory}MB` : ''}
+                            ${formatPerformance(response.performance)}
                         </h6>
                         <h5 class="card-title">Câu hỏi:</h5>
                         <p class="card-text">${response.prompt}</p>
-                        ${response.has_image && response.imageData ? `
+                        ${responseImageUrl(response) ? `
                         <div class="history-image-container">
-                            <img src="${response.imageData}" alt="Ảnh đính kèm" class="history-image">
+                            <img src="${responseImageUrl(response)}" alt="Ảnh đính kèm" class="history-image" loading="lazy">
                         </div>` : ''}
                         <h5 class="card-title">Trả lời:</h5>
-                        <div class="card-text">${marked.parse(processResponseForDisplay(response.response))}</div>
+                        <div class="card-text">${responseHtml(response.response, response)}</div>
                     </div>
                     <div class="card-footer">
                         <button class="btn btn-sm btn-primary load-conversation" data-id="${response.id}">
@@ -322,8 +503,7 @@ function loadConversationFromHistory(responseId, responses) {
     clearChat(false); // false = không hiển thị tin nhắn chào mừng
 
     // Thêm tin nhắn người dùng và phản hồi vào cuộc trò chuyện
-    const imageData = response.has_image && response.imageData ? response.imageData : null;
-    addUserMessage(response.prompt, imageData);
+    addUserMessage(response.prompt, responseImageUrl(response));
     // Xử lý phản hồi để loại bỏ phần "Câu hỏi:" nếu có
     addBotMessage(response.response, response);
 }
@@ -368,10 +548,11 @@ async function sendMessage() {
         promptInput.style.height = 'auto';
 
         // Gửi câu hỏi với hoặc không có ảnh
-        await askQuestion(prompt, currentImageData);
+        await askQuestion(prompt, currentImageFile, currentImageUrl);
 
-        // Xóa ảnh sau khi gửi
-        if (currentImageData) {
+        // Xóa ảnh sau khi gửi (giữ URL xem trước vì tin nhắn vẫn hiển thị ảnh)
+        if (currentImageFile) {
+            currentImageUrl = null;
             removeImage();
         }
 
@@ -388,18 +569,22 @@ function handleImageUpload() {
 
 // Hàm để hiển thị ảnh đã chọn
 function displaySelectedImage(file) {
-    const reader = new FileReader();
-    reader.onload = function(e) {
-        currentImageData = e.target.result;
-        document.getElementById('image-preview').src = e.target.result;
-        document.getElementById('image-preview-container').classList.remove('d-none');
-    };
-    reader.readAsDataURL(file);
+    if (currentImageUrl) {
+        URL.revokeObjectURL(currentImageUrl);
+    }
+    currentImageFile = file;
+    currentImageUrl = URL.createObjectURL(file);
+    document.getElementById('image-preview').src = currentImageUrl;
+    document.getElementById('image-preview-container').classList.remove('d-none');
 }
 
 // Hàm để xóa ảnh đã chọn
 function removeImage() {
-    currentImageData = null;
+    if (currentImageUrl) {
+        URL.revokeObjectURL(currentImageUrl);
+    }
+    currentImageFile = null;
+    currentImageUrl = null;
     document.getElementById('image-preview').src = '#';
     document.getElementById('image-preview-container').classList.add('d-none');
     document.getElementById('image-upload').value = '';
@@ -0,0 +1,156 @@
+"""
+Module chuyển tiếp các đoạn phản hồi (chunk) từ Gemini API đến client theo thời gian thực.
+"""
+import threading
+import time
+
+from config import STREAM_RETENTION
+
+
+class StreamHub:
+    """
+    Lưu các đoạn phản hồi theo request_id và cho phép nhiều luồng đọc đồng thời.
+
+    Luồng xử lý (event loop của AsyncEngine) gọi publish() mỗi khi nhận được một
+    đoạn mới, các luồng Flask phục vụ Server-Sent Events gọi subscribe() để đọc.
+    """
+    def __init__(self, retention=STREAM_RETENTION):
+        """
+        Khởi tạo StreamHub.
+
+        Args:
+            retention (float): Thời gian giữ lại một stream sau khi kết thúc (giây)
+        """
+        self.retention = retention
+        self._channels = {}
+        self._condition = threading.Condition()
+        self._last_purge = time.time()
+
+    def open(self, request_id):
+        """
+        Tạo stream cho một yêu cầu, đồng thời dọn các stream đã kết thúc quá lâu.
+
+        Args:
+            request_id (str): ID của yêu cầu
+        """
+        with self._condition:
+            self._purge_expired(time.time())
+            self._channels[request_id] = {"chunks": [], "closed_at": None}
+
+    def alias(self, request_id, target_id):
+        """
+        Cho một yêu cầu đọc chung stream của một yêu cầu khác (khi hai yêu cầu được gộp).
+
+        Args:
+            request_id (str): ID của yêu cầu được gắn vào
+            target_id (str): ID của yêu cầu có stream
+
+        Returns:
+            bool: False nếu stream đích không tồn tại hoặc đã kết thúc
+        """
+        with self._condition:
+            channel = self._channels.get(target_id)
+            if channel is None or channel["closed_at"] is not None:
+                return False
+            # Dùng chung đối tượng channel nên các đoạn đã có và các đoạn mới đều được đọc thấy
+            self._channels[request_id] = channel
+            return True
+
+    def has(self, request_id):
+        """
+        Kiểm tra một yêu cầu có stream hay không.
+        """
+        with self._condition:
+            return request_id in self._channels
+
+    def publish(self, request_id, chunk):
+        """
+        Thêm một đoạn phản hồi mới và đánh thức các luồng đang đọc.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            chunk (str): Đoạn văn bản mới
+        """
+        with self._condition:
+            channel = self._channels.get(request_id)
+            if channel is None:
+                return
+            channel["chunks"].append(chunk)
+            self._condition.notify_all()
+
+    def close(self, request_id):
+        """
+        Đánh dấu stream đã kết thúc.
+
+        Args:
+            request_id (str): ID của yêu cầu
+        """
+        with self._condition:
+            channel = self._channels.get(request_id)
+            if channel is None:
+                return
+            channel["closed_at"] = time.time()
+            self._condition.notify_all()
+            # Dọn cả khi đóng để các stream đã kết thúc không ở lại mãi khi không có stream mới
+            self._purge_expired(channel["closed_at"])
+
+    def purge(self):
+        """
+        Dọn các stream đã kết thúc quá lâu (AsyncEngine gọi sau mỗi yêu cầu, kể cả không stream).
+        """
+        with self._condition:
+            self._purge_expired(time.time())
+
+    def _purge_expired(self, now):
+        """
+        Xóa các stream đã kết thúc quá thời gian giữ lại (phải giữ khóa).
+
+        Chỉ duyệt toàn bộ các stream mỗi retention/10 giây.
+        """
+        if now - self._last_purge < self.retention / 10:
+            return
+        self._last_purge = now
+        expired = [
+            key for key, channel in self._channels.items()
+            if channel["closed_at"] is not None and now - channel["closed_at"] > self.retention
+        ]
+        for key in expired:
+            del self._channels[key]
+
+    def subscribe(self, request_id, heartbeat=None):
+        """
+        Đọc các đoạn phản hồi theo thứ tự cho đến khi stream kết thúc.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            heartbeat (float, optional): Nếu không có đoạn mới sau khoảng thời gian
+                này (giây), trả về None để nơi gọi gửi tín hiệu giữ kết nối
+
+        Yields:
+            str hoặc None: Đoạn phản hồi mới, hoặc None khi hết thời gian heartbeat
+        """
+        position = 0
+        while True:
+            with self._condition:
+                channel = self._channels.get(request_id)
+                if channel is None:
+                    return
+
+                has_data = self._condition.wait_for(
+                    lambda: len(channel["chunks"]) > position or channel["closed_at"] is not None,
+                    timeout=heartbeat
+                )
+                new_chunks = channel["chunks"][position:]
+                closed = channel["closed_at"] is not None
+
+            # Trả dữ liệu ra ngoài khi đã nhả khóa để không chặn luồng ghi
+            if not has_data:
+                yield None
+                continue
+
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+
+            if closed:
+                return
@@ -11,14 +11,17 @@ class ThreadManager:
     """
     Quản lý các luồng để xử lý yêu cầu đến Gemini API.
     """
-    def __init__(self):
+    def __init__(self, client=None):
         """
         Khởi tạo ThreadManager với hàng đợi và danh sách luồng.
+
+        Args:
+            client (optional): Client dùng để gọi API, mặc định là GeminiClient
         """
         self.request_queue = queue.Queue()
         self.response_queue = queue.Queue()
         self.threads = []
-        self.client = GeminiClient()
+        self.client = client if client is not None else GeminiClient()
         self.stop_event = threading.Event()
     
     def add_request(self, prompt, request_id=None):
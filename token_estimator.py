@@ -0,0 +1,151 @@
+"""
+Module ước lượng nhanh số token của câu hỏi và kiểm tra kích thước trước khi nhận yêu cầu.
+
+Số token được ước lượng tại chỗ từ số ký tự (không gọi API), với tỷ lệ ký tự/token
+được hiệu chỉnh dần theo số token thật mà Gemini API báo lại trong mỗi phản hồi
+(usage_metadata, cùng cách đếm với count_tokens). Ảnh được tính theo số ô 768x768
+sau khi thu nhỏ như ImagePipeline. Câu hỏi vượt giới hạn bị từ chối (413) hoặc cắt
+bớt ngay khi nhận, thay vì chỉ thất bại sau một lượt gọi API.
+"""
+import math
+import threading
+
+from config import (TOKEN_LIMIT_PER_REQUEST, TOKEN_LIMIT_ACTION, TOKEN_CHARS_PER_TOKEN, IMAGE_MAX_SIDE)
+
+# Số token của một ảnh nhỏ (cả hai cạnh không quá 384 pixel) hoặc của mỗi ô 768x768 của ảnh lớn hơn
+IMAGE_TOKENS = 258
+_IMAGE_SMALL_SIDE = 384
+_IMAGE_TILE_SIDE = 768
+
+# Ghi chú nối vào cuối câu hỏi đã bị cắt bớt
+_TRUNCATED_NOTE = "\n[...câu hỏi đã bị cắt bớt]"
+
+
+class TokenLimitError(Exception):
+    """
+    Lỗi khi câu hỏi vượt quá giới hạn token của một yêu cầu.
+    """
+    def __init__(self, message, tokens, limit):
+        """
+        Args:
+            message (str): Thông báo lỗi
+            tokens (int): Số token ước lượng của câu hỏi
+            limit (int): Giới hạn token
+        """
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+
+def image_tokens(width, height, max_side=IMAGE_MAX_SIDE):
+    """
+    Ước lượng số token của một ảnh sau khi được thu nhỏ về cạnh dài nhất max_side.
+
+    Args:
+        width (int): Chiều rộng ảnh gốc (pixel)
+        height (int): Chiều cao ảnh gốc (pixel)
+        max_side (int): Cạnh dài nhất sau khi tiền xử lý
+
+    Returns:
+        int: Số token ước lượng
+    """
+    scale = min(1.0, max_side / max(width, height, 1))
+    width, height = width * scale, height * scale
+    if width <= _IMAGE_SMALL_SIDE and height <= _IMAGE_SMALL_SIDE:
+        return IMAGE_TOKENS
+    return math.ceil(width / _IMAGE_TILE_SIDE) * math.ceil(height / _IMAGE_TILE_SIDE) * IMAGE_TOKENS
+
+
+class TokenEstimator:
+    """
+    Ước lượng số token từ số ký tự, hiệu chỉnh theo số token thật của các phản hồi trước.
+    """
+    def __init__(self, chars_per_token=TOKEN_CHARS_PER_TOKEN, limit=TOKEN_LIMIT_PER_REQUEST,
+                 action=TOKEN_LIMIT_ACTION, smoothing=0.1):
+        """
+        Args:
+            chars_per_token (float): Số ký tự trung bình mỗi token ban đầu
+            limit (int, optional): Số token tối đa của một câu hỏi, None để không giới hạn
+            action (str): "reject" để từ chối hoặc "truncate" để cắt bớt câu hỏi vượt giới hạn
+            smoothing (float): Trọng số của mỗi lần hiệu chỉnh (trung bình động hàm mũ)
+
+        Raises:
+            ValueError: Nếu action không hợp lệ
+        """
+        if action not in ("reject", "truncate"):
+            raise ValueError(f"Cách xử lý câu hỏi vượt giới hạn không hợp lệ: {action}")
+        self.chars_per_token = chars_per_token
+        self.limit = limit
+        self.action = action
+        self.smoothing = smoothing
+        self.calibrations = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, text, extra_tokens=0):
+        """
+        Ước lượng số token của một đoạn văn bản.
+
+        Args:
+            text (str): Văn bản
+            extra_tokens (int): Số token cộng thêm (ví dụ của ảnh gửi kèm)
+
+        Returns:
+            int: Số token ước lượng
+        """
+        return math.ceil(len(text or "") / self.chars_per_token) + 1 + extra_tokens
+
+    def calibrate(self, text, actual_tokens):
+        """
+        Cập nhật tỷ lệ ký tự/token theo số token thật của một đoạn văn bản.
+
+        Args:
+            text (str): Văn bản đã gửi (chỉ văn bản, không kèm ảnh)
+            actual_tokens (int): Số token Gemini API báo lại cho văn bản đó
+        """
+        if not text or not actual_tokens:
+            return
+        # Giới hạn trong khoảng hợp lý để một mẫu bất thường không làm lệch ước lượng
+        observed = min(max(len(text) / actual_tokens, 1.0), 8.0)
+        with self._lock:
+            self.chars_per_token += self.smoothing * (observed - self.chars_per_token)
+            self.calibrations += 1
+
+    def admit(self, text, extra_tokens=0):
+        """
+        Kiểm tra câu hỏi có vừa giới hạn token không, cắt bớt nếu được cấu hình.
+
+        Args:
+            text (str): Câu hỏi
+            extra_tokens (int): Số token cộng thêm (ảnh, context prompt)
+
+        Returns:
+            tuple: (câu hỏi (có thể đã cắt bớt), số token ước lượng, True nếu đã cắt bớt)
+
+        Raises:
+            TokenLimitError: Nếu câu hỏi vượt giới hạn và không thể (hoặc không được) cắt bớt
+        """
+        tokens = self.estimate(text, extra_tokens)
+        if self.limit is None or tokens <= self.limit:
+            return text, tokens, False
+
+        # Số ký tự còn dùng được sau khi trừ phần token cố định và ghi chú cắt bớt
+        available = int((self.limit - extra_tokens - 1) * self.chars_per_token) - len(_TRUNCATED_NOTE)
+        if self.action != "truncate" or available <= 0:
+            raise TokenLimitError(f"Câu hỏi quá dài: khoảng {tokens} token, tối đa {self.limit} token",
+                                  tokens, self.limit)
+        text = text[:available] + _TRUNCATED_NOTE
+        return text, self.estimate(text, extra_tokens), True
+
+    def stats(self):
+        """
+        Tỷ lệ ký tự/token hiện tại, số lần hiệu chỉnh và cấu hình giới hạn.
+        """
+        return {
+            "chars_per_token": round(self.chars_per_token, 3),
+            "calibrations": self.calibrations,
+            "limit": self.limit,
+            "action": self.action,
+        }
+
+
+ESTIMATOR = TokenEstimator()
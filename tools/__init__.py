@@ -0,0 +1,3 @@
+"""
+Các công cụ đo hiệu năng và kiểm thử tải cho ứng dụng.
+"""
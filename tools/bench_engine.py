@@ -0,0 +1,96 @@
+"""
+So sánh thông lượng giữa ThreadManager (mỗi yêu cầu một luồng) và AsyncEngine.
+
+Dùng một client giả lập độ trễ của Gemini API nên không tốn quota.
+
+Cách chạy:
+    python -m tools.bench_engine --requests 500 --latency 0.5
+"""
+import argparse
+import asyncio
+import time
+
+from async_engine import AsyncEngine
+from config import MAX_THREADS, MAX_CONCURRENT_REQUESTS
+from thread_manager import ThreadManager
+
+
+class SleepClient:
+    """
+    Client giả lập: mỗi lời gọi chỉ chờ một khoảng thời gian cố định.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_response(self, prompt, image_data=None, image_id=None):
+        time.sleep(self.latency)
+        return f"Trả lời cho: {prompt}"
+
+    async def generate_response_async(self, prompt, image_data=None, image_id=None):
+        await asyncio.sleep(self.latency)
+        return f"Trả lời cho: {prompt}"
+
+
+def bench_thread_manager(num_requests, latency, num_threads):
+    """
+    Đo thời gian ThreadManager xử lý hết num_requests yêu cầu.
+
+    Returns:
+        float: Thời gian chạy (giây)
+    """
+    manager = ThreadManager(client=SleepClient(latency))
+    manager.start(num_threads=num_threads)
+    try:
+        start = time.perf_counter()
+        for i in range(num_requests):
+            manager.add_request(f"Câu hỏi {i}", request_id=f"req_{i}")
+        manager.wait_for_completion()
+        return time.perf_counter() - start
+    finally:
+        manager.stop()
+
+
+def bench_async_engine(num_requests, latency, max_concurrency):
+    """
+    Đo thời gian AsyncEngine xử lý hết num_requests yêu cầu.
+
+    Returns:
+        float: Thời gian chạy (giây)
+    """
+    engine = AsyncEngine(SleepClient(latency), max_concurrency=max_concurrency)
+    engine.start()
+    try:
+        start = time.perf_counter()
+        for i in range(num_requests):
+            engine.add_request(f"Câu hỏi {i}", request_id=f"req_{i}")
+        engine.wait_for_completion()
+        return time.perf_counter() - start
+    finally:
+        engine.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ThreadManager và AsyncEngine")
+    parser.add_argument("--requests", type=int, default=500, help="Số yêu cầu gửi đi")
+    parser.add_argument("--latency", type=float, default=0.5, help="Độ trễ giả lập của API (giây)")
+    parser.add_argument("--threads", type=int, default=MAX_THREADS, help="Số luồng của ThreadManager")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="Số yêu cầu đồng thời tối đa của AsyncEngine")
+    args = parser.parse_args()
+
+    print(f"{args.requests} yêu cầu, độ trễ API {args.latency}s")
+    print("-" * 60)
+
+    results = [
+        (f"ThreadManager ({args.threads} luồng)",
+         bench_thread_manager(args.requests, args.latency, args.threads)),
+        (f"AsyncEngine ({args.concurrency} đồng thời)",
+         bench_async_engine(args.requests, args.latency, args.concurrency)),
+    ]
+
+    for name, elapsed in results:
+        print(f"{name:<35} {elapsed:8.2f}s  {args.requests / elapsed:8.1f} yêu cầu/giây")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Đo thông lượng tiền xử lý ảnh với các ảnh giống ảnh chụp từ điện thoại.
+
+So sánh cách cũ (giải mã rồi ghi file tạm ở độ phân giải gốc, đọc lại, xóa file)
+với ImagePipeline (thu nhỏ và mã hóa lại trong bộ nhớ), chạy tuần tự và trên pool.
+
+Cách chạy:
+    python -m tools.bench_image --images 20 --width 4032 --height 3024
+"""
+import argparse
+import base64
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config import IMAGE_WORKERS
+from image_pipeline import ImagePipeline
+
+
+def make_photo(width, height, quality=90):
+    """
+    Tạo một ảnh JPEG giả lập ảnh chụp: gradient màu cộng nhiễu để khó nén như ảnh thật.
+
+    Returns:
+        str: Data URL base64 của ảnh
+    """
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 20)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def legacy_process(image_data, temp_dir):
+    """
+    Cách xử lý cũ của GeminiClient: giải mã, ghi file tạm, đọc lại rồi xóa.
+
+    Returns:
+        bytes: Dữ liệu ảnh gửi đến API
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_data.split(',')[1])))
+    temp_image_path = os.path.join(temp_dir, f"temp_{time.time_ns()}.jpg")
+    image.save(temp_image_path)
+    with open(temp_image_path, "rb") as f:
+        data = f.read()
+    os.remove(temp_image_path)
+    return data
+
+
+def run(name, func, images, workers=1):
+    """
+    Chạy func trên toàn bộ ảnh và in kết quả.
+    """
+    start = time.perf_counter()
+    if workers == 1:
+        outputs = [func(image) for image in images]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outputs = list(executor.map(func, images))
+    elapsed = time.perf_counter() - start
+
+    average_kb = sum(len(output) for output in outputs) / len(outputs) / 1024
+    print(f"{name:<32} {len(images) / elapsed:8.1f} ảnh/giây  {elapsed / len(images) * 1000:8.1f} ms/ảnh"
+          f"  {average_kb:8.1f} KB/ảnh")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiền xử lý ảnh")
+    parser.add_argument("--images", type=int, default=20, help="Số ảnh")
+    parser.add_argument("--width", type=int, default=4032, help="Chiều rộng ảnh (pixel)")
+    parser.add_argument("--height", type=int, default=3024, help="Chiều cao ảnh (pixel)")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS, help="Số luồng của pool")
+    args = parser.parse_args()
+
+    photo = make_photo(args.width, args.height)
+    images = [photo] * args.images
+    print(f"{args.images} ảnh {args.width}x{args.height}, "
+          f"{len(photo) * 3 / 4 / 1024:.0f} KB mỗi ảnh gốc")
+    print("-" * 80)
+
+    pipeline = ImagePipeline(workers=args.workers)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        run("Cũ (file tạm, độ phân giải gốc)", lambda image: legacy_process(image, temp_dir), images)
+    run("ImagePipeline (tuần tự)", lambda image: pipeline.process(image)[0], images)
+    run(f"ImagePipeline ({args.workers} luồng)", lambda image: pipeline.submit(image).result()[0],
+        images, workers=args.workers)
+    pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
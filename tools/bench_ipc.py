@@ -0,0 +1,118 @@
+"""
+So sánh chi phí truyền thông điệp giữa các tiến trình của ProcessManager.
+
+Đo ba cách truyền:
+    - manager: mp.Manager().Queue() (cách cũ, mỗi thao tác đi qua tiến trình server)
+    - queue:   mp.Queue() gửi từng thông điệp
+    - batched: mp.Queue() gửi theo lô (cách ProcessManager đang dùng: AsyncEngine gom các
+               phản hồi xong trong cùng một vòng event loop vào một lần add_tasks)
+
+Với mỗi kích thước payload, báo cáo số thông điệp/giây (một chiều qua tiến trình
+echo rồi quay về) và độ trễ khứ hồi trung bình của một thông điệp.
+
+Cách chạy:
+    python -m tools.bench_ipc --messages 5000 --sizes 512 4096 32768
+"""
+import argparse
+import multiprocessing as mp
+import statistics
+import time
+
+from config import PROCESS_BATCH_SIZE
+
+
+def echo_worker(input_queue, output_queue):
+    """
+    Tiến trình echo: trả lại nguyên vẹn mọi thông điệp nhận được cho đến khi gặp None.
+    """
+    while True:
+        data = input_queue.get()
+        if data is None:
+            break
+        output_queue.put(data)
+
+
+def make_queues(transport):
+    """
+    Tạo cặp hàng đợi theo kiểu truyền.
+
+    Returns:
+        tuple: (input_queue, output_queue, manager hoặc None)
+    """
+    if transport == "manager":
+        manager = mp.Manager()
+        return manager.Queue(), manager.Queue(), manager
+    return mp.Queue(), mp.Queue(), None
+
+
+def measure(transport, payload_size, num_messages, batch_size, latency_samples):
+    """
+    Đo thông lượng và độ trễ cho một kiểu truyền và một kích thước payload.
+
+    Returns:
+        tuple: (số thông điệp/giây, độ trễ khứ hồi trung bình tính bằng micro giây)
+    """
+    input_queue, output_queue, manager = make_queues(transport)
+    process = mp.Process(target=echo_worker, args=(input_queue, output_queue), daemon=True)
+    process.start()
+
+    # Giống một nhiệm vụ thật: (request_id, prompt, response)
+    message = ("req_0", "Câu hỏi mẫu", "x" * payload_size)
+
+    try:
+        # Khởi động (tránh tính chi phí lần đầu)
+        input_queue.put([message])
+        output_queue.get()
+
+        # Thông lượng
+        start = time.perf_counter()
+        if transport == "batched":
+            received = 0
+            for offset in range(0, num_messages, batch_size):
+                input_queue.put([message] * min(batch_size, num_messages - offset))
+            while received < num_messages:
+                received += len(output_queue.get())
+        else:
+            for _ in range(num_messages):
+                input_queue.put([message])
+            for _ in range(num_messages):
+                output_queue.get()
+        throughput = num_messages / (time.perf_counter() - start)
+
+        # Độ trễ khứ hồi của một thông điệp
+        samples = []
+        for _ in range(latency_samples):
+            start = time.perf_counter()
+            input_queue.put([message])
+            output_queue.get()
+            samples.append((time.perf_counter() - start) * 1e6)
+        latency = statistics.mean(samples)
+    finally:
+        input_queue.put(None)
+        process.join(timeout=5.0)
+        if manager is not None:
+            manager.shutdown()
+
+    return throughput, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IPC của ProcessManager")
+    parser.add_argument("--messages", type=int, default=5000, help="Số thông điệp cho phép đo thông lượng")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 4096, 32768],
+                        help="Kích thước phản hồi (byte)")
+    parser.add_argument("--batch-size", type=int, default=PROCESS_BATCH_SIZE, help="Kích thước lô")
+    parser.add_argument("--latency-samples", type=int, default=200, help="Số lần đo độ trễ")
+    args = parser.parse_args()
+
+    print(f"{'Kiểu truyền':<10} {'Payload':>9} {'Thông điệp/giây':>17} {'Độ trễ (µs)':>13}")
+    print("-" * 52)
+    for size in args.sizes:
+        for transport in ("manager", "queue", "batched"):
+            throughput, latency = measure(transport, size, args.messages, args.batch_size,
+                                          args.latency_samples)
+            print(f"{transport:<10} {size:>8}B {throughput:>17.0f} {latency:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+So sánh thông lượng của hàng đợi yêu cầu trong bộ nhớ và hàng đợi trên đĩa.
+
+Đo ba cấu hình:
+    - memory:  FairScheduler (mặc định, mất yêu cầu khi khởi động lại)
+    - durable: DurableQueue với PRAGMA synchronous=NORMAL (an toàn khi ứng dụng bị dừng)
+    - full:    DurableQueue với PRAGMA synchronous=FULL (an toàn cả khi mất điện)
+
+Với mỗi cấu hình, báo cáo số yêu cầu/giây khi đưa vào (put) và khi lấy ra rồi
+xác nhận (get + ack), giống cách AsyncEngine dùng hàng đợi.
+
+Cách chạy:
+    python -m tools.bench_queue --requests 5000 --prompt-size 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from durable_queue import DurableQueue
+from scheduler import FairScheduler
+
+
+def make_queue(kind, directory):
+    """
+    Tạo hàng đợi theo cấu hình.
+    """
+    if kind == "memory":
+        return FairScheduler()
+    synchronous = "FULL" if kind == "full" else "NORMAL"
+    return DurableQueue(path=os.path.join(directory, f"{kind}.sqlite3"), synchronous=synchronous)
+
+
+def measure(kind, num_requests, prompt_size, directory):
+    """
+    Đo thông lượng put và get + ack của một cấu hình.
+
+    Returns:
+        tuple: (số put/giây, số get + ack/giây)
+    """
+    request_queue = make_queue(kind, directory)
+    # Giống một yêu cầu thật của AsyncEngine
+    jobs = [{
+        "id": f"req_{i}",
+        "prompt": "x" * prompt_size,
+        "image_data": None,
+        "image_id": None,
+        "stream": False,
+        "bypass_cache": False,
+        "cache_key": None,
+        "queued_at": time.time(),
+        "followers": [],
+    } for i in range(num_requests)]
+
+    start = time.perf_counter()
+    for i, job in enumerate(jobs):
+        request_queue.put(job, priority_class="batch" if i % 4 else "interactive", client_id=f"client_{i % 10}")
+    put_rate = num_requests / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        request_queue.ack(request_queue.get())
+    get_rate = num_requests / (time.perf_counter() - start)
+
+    if kind != "memory":
+        request_queue.close()
+    return put_rate, get_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hàng đợi yêu cầu")
+    parser.add_argument("--requests", type=int, default=5000, help="Số yêu cầu")
+    parser.add_argument("--prompt-size", type=int, default=200, help="Độ dài câu hỏi (ký tự)")
+    args = parser.parse_args()
+
+    print(f"{'Hàng đợi':<9} {'Put/giây':>12} {'Get+ack/giây':>14}")
+    print("-" * 37)
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ("memory", "durable", "full"):
+            put_rate, get_rate = measure(kind, args.requests, args.prompt_size, directory)
+            print(f"{kind:<9} {put_rate:>12.0f} {get_rate:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Gemini API giả lập để đo tải mà không tốn quota và không cần mạng.
+
+Gồm hai phần dùng chung một mô hình độ trễ/lỗi:
+    - FakeGeminiClient: cùng giao diện với GeminiClient trong app.py, dùng trong tiến trình
+      (đặt biến môi trường GEMINI_FAKE, ví dụ GEMINI_FAKE="latency=lognormal:0.8,0.5;error_rate=0.01")
+    - Server HTTP giả lập REST API của Gemini (generateContent, streamGenerateContent), để
+      chạy cả thư viện google-generativeai thật (đặt GEMINI_API_ENDPOINT=http://127.0.0.1:8081)
+
+Độ trễ được mô tả dạng "<phân bố>:<tham số>":
+    fixed:0.5            luôn 0.5 giây
+    uniform:0.2,1.5      đều trong khoảng [0.2, 1.5]
+    normal:0.8,0.2       chuẩn với trung bình 0.8 và độ lệch 0.2 (không âm)
+    lognormal:0.8,0.5    log-chuẩn với trung vị 0.8 và sigma 0.5 (đuôi dài như API thật)
+
+Với replay=1 (--replay), câu hỏi do tools/replay.py tạo mang theo chỉ dẫn
+"[replay latency=<giây> length=<ký tự> outcome=<ok|error>]" để API giả lập trả lời
+đúng độ trễ, độ dài phản hồi và lỗi đã ghi lại từ lưu lượng thật.
+
+Cách chạy server:
+    python -m tools.fake_gemini --port 8081 --latency lognormal:0.8,0.5 --error-rate 0.01 --rate-limit-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import GEMINI_MODEL
+from rate_limiter import RateLimitError
+from response_cache import make_cache_key
+
+_REPLAY_DIRECTIVE = re.compile(r"\[replay latency=([0-9.]+) length=(\d+) outcome=(ok|error)\]")
+
+_WORDS = ("xin", "chào", "bạn", "mình", "là", "Nemo", "AI", "rất", "vui", "được", "giúp", "đỡ", "câu", "hỏi",
+          "này", "khá", "thú", "vị", "nhé")
+
+
+class LatencyModel:
+    """
+    Phân bố độ trễ của một lời gọi API giả lập.
+    """
+    def __init__(self, spec="lognormal:0.8,0.5", rng=None):
+        """
+        Args:
+            spec (str): Mô tả phân bố, ví dụ "fixed:0.5" hoặc "lognormal:0.8,0.5"
+            rng (random.Random, optional): Bộ sinh số ngẫu nhiên (để kết quả lặp lại được)
+
+        Raises:
+            ValueError: Nếu mô tả không hợp lệ
+        """
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        try:
+            values = [float(value) for value in params.split(",") if value]
+        except ValueError:
+            raise ValueError(f"Tham số độ trễ không hợp lệ: {spec}")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Mô tả độ trễ không hợp lệ: {spec}")
+        self.kind = kind
+        self.values = values
+
+    def sample(self):
+        """
+        Lấy một giá trị độ trễ (giây).
+        """
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.values)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.values))
+        median, sigma = self.values
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+
+class FaultModel:
+    """
+    Độ trễ, tỉ lệ lỗi, tỉ lệ lỗi 429 và nội dung phản hồi của API giả lập.
+    """
+    def __init__(self, latency="lognormal:0.8,0.5", error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0,
+                 response_words=60, chunks=5, seed=None, replay=False):
+        """
+        Args:
+            latency (str): Mô tả phân bố độ trễ của cả phản hồi
+            error_rate (float): Tỉ lệ lời gọi bị lỗi (HTTP 500)
+            rate_limit_rate (float): Tỉ lệ lời gọi bị từ chối vì vượt hạn mức (HTTP 429)
+            retry_after (float): Gợi ý thời gian chờ kèm lỗi 429 (giây)
+            response_words (int): Số từ của mỗi phản hồi
+            chunks (int): Số đoạn của phản hồi dạng stream
+            seed (int, optional): Hạt giống ngẫu nhiên
+            replay (bool): Dùng chỉ dẫn độ trễ/độ dài/lỗi trong câu hỏi do tools/replay.py tạo
+        """
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.response_words = response_words
+        self.chunks = max(1, chunks)
+        self.replay = replay
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "ok": 0, "error": 0, "rate_limited": 0}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Tạo FaultModel từ chuỗi "khóa=giá trị;..." (ví dụ giá trị của biến môi trường GEMINI_FAKE).
+
+        Args:
+            spec (str): Ví dụ "latency=lognormal:0.8,0.5;error_rate=0.01;rate_limit_rate=0.02"
+
+        Raises:
+            ValueError: Nếu có khóa không hợp lệ
+        """
+        options = {}
+        converters = {"latency": str, "error_rate": float, "rate_limit_rate": float, "retry_after": float,
+                      "response_words": int, "chunks": int, "seed": int, "replay": lambda value: value == "1"}
+        for item in filter(None, (part.strip() for part in spec.split(";"))):
+            key, _, value = item.partition("=")
+            if key not in converters:
+                raise ValueError(f"Tùy chọn không hợp lệ của API giả lập: {key}")
+            options[key] = converters[key](value)
+        return cls(**options)
+
+    def _directive(self, prompt):
+        """
+        Đọc chỉ dẫn phát lại trong câu hỏi (nếu bật replay).
+
+        Returns:
+            tuple: (độ trễ, độ dài phản hồi, kết quả) hoặc None nếu không có chỉ dẫn
+        """
+        if not self.replay or not prompt:
+            return None
+        match = _REPLAY_DIRECTIVE.search(prompt)
+        if match is None:
+            return None
+        return float(match.group(1)), int(match.group(2)), match.group(3)
+
+    def next_call(self, prompt=None):
+        """
+        Quyết định kết quả của lời gọi tiếp theo.
+
+        Args:
+            prompt (str, optional): Câu hỏi, để đọc chỉ dẫn phát lại
+
+        Returns:
+            tuple: (kết quả "ok" / "error" / "rate_limited", độ trễ (giây))
+        """
+        directive = self._directive(prompt)
+        if directive is not None:
+            latency, _, outcome = directive
+            with self._lock:
+                self.counters["calls"] += 1
+                self.counters[outcome] += 1
+            return outcome, latency
+        with self._lock:
+            self.counters["calls"] += 1
+            roll = self.rng.random()
+            if roll < self.rate_limit_rate:
+                outcome = "rate_limited"
+            elif roll < self.rate_limit_rate + self.error_rate:
+                outcome = "error"
+            else:
+                outcome = "ok"
+            self.counters[outcome] += 1
+            latency = self.latency.sample()
+        # Lỗi thường được trả về nhanh hơn phản hồi thành công
+        return outcome, latency if outcome == "ok" else latency * 0.1
+
+    def response_text(self, prompt):
+        """
+        Nội dung phản hồi giả lập cho một câu hỏi.
+        """
+        directive = self._directive(prompt)
+        if directive is not None:
+            # Phản hồi có đúng độ dài đã ghi lại
+            length = directive[1]
+            return ("Nemo trả lời " * (length // 13 + 1))[:length]
+        with self._lock:
+            words = [self.rng.choice(_WORDS) for _ in range(self.response_words)]
+        return f"Trả lời cho: {prompt[:80]}\n\n" + " ".join(words)
+
+    def split_chunks(self, text):
+        """
+        Chia phản hồi thành các đoạn gửi dần khi stream.
+        """
+        size = max(1, math.ceil(len(text) / self.chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def rate_limit_message(self):
+        """
+        Thông báo lỗi 429 giống Gemini API (có gợi ý thời gian chờ mà parse_retry_after đọc được).
+        """
+        return f"Resource has been exhausted (e.g. check quota). Please retry in {self.retry_after}s."
+
+
+class FakeGeminiClient:
+    """
+    Client giả lập có cùng giao diện với GeminiClient trong app.py.
+    """
+    def __init__(self, faults=None):
+        """
+        Args:
+            faults (FaultModel, optional): Mô hình độ trễ/lỗi, mặc định là FaultModel()
+        """
+        self.faults = faults if faults is not None else FaultModel()
+        self.context_prompt = "fake"
+
+    def cache_key(self, prompt, image_data=None, image_id=None):
+        """
+        Tạo khóa cache giống GeminiClient.cache_key.
+        """
+        image_hash = image_id or (hashlib.sha256(image_data.encode("utf-8")).hexdigest() if image_data else None)
+        return make_cache_key(GEMINI_MODEL, self.context_prompt, prompt, image_hash)
+
+    def generate_response(self, prompt, image_data=None, image_id=None):
+        """
+        Phiên bản đồng bộ (dùng với ThreadManager), trả về chuỗi lỗi thay vì ném lỗi như GeminiClient.
+        """
+        outcome, latency = self.faults.next_call(prompt)
+        time.sleep(latency)
+        if outcome == "rate_limited":
+            return f"Lỗi khi gọi Gemini API: 429 {self.faults.rate_limit_message()}"
+        if outcome == "error":
+            return "Lỗi khi gọi Gemini API: 500 Internal error (giả lập)"
+        return self.faults.response_text(prompt)
+
+    async def generate_response_async(self, prompt, image_data=None, image_id=None, session_id=None):
+        """
+        Phiên bản bất đồng bộ (dùng với AsyncEngine).
+
+        Raises:
+            RateLimitError: Khi giả lập lỗi 429
+            RuntimeError: Khi giả lập lỗi máy chủ
+        """
+        outcome, latency = self.faults.next_call(prompt)
+        await asyncio.sleep(latency)
+        self._raise_for(outcome)
+        return self.faults.response_text(prompt)
+
+    async def generate_response_stream_async(self, prompt, image_data=None, image_id=None, session_id=None):
+        """
+        Phiên bản stream: độ trễ được chia đều cho các đoạn phản hồi.
+        """
+        outcome, latency = self.faults.next_call(prompt)
+        if outcome != "ok":
+            await asyncio.sleep(latency)
+            self._raise_for(outcome)
+        chunks = self.faults.split_chunks(self.faults.response_text(prompt))
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            yield chunk
+
+    async def warm_up(self):
+        """
+        Không có kết nối nào cần mở trước.
+        """
+
+    def _raise_for(self, outcome):
+        if outcome == "rate_limited":
+            raise RateLimitError(f"Gemini API báo vượt hạn mức: 429 {self.faults.rate_limit_message()}",
+                                 self.faults.retry_after)
+        if outcome == "error":
+            raise RuntimeError("500 Internal error (giả lập)")
+
+
+def _token_count(text):
+    """
+    Số token giả lập của một đoạn văn bản (khoảng 4 byte UTF-8 mỗi token).
+    """
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def _candidate(text, finish=True, prompt=None, response_text=None):
+    """
+    Một phần tử GenerateContentResponse theo định dạng REST của Gemini API.
+
+    Phần tử cuối cùng (finish) có thêm usageMetadata khi biết câu hỏi và toàn bộ phản hồi.
+    """
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    result = {"candidates": [candidate]}
+    if finish:
+        candidate["finishReason"] = "STOP"
+        if prompt is not None:
+            prompt_tokens = _token_count(prompt)
+            output_tokens = _token_count(response_text if response_text is not None else text)
+            result["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                                       "totalTokenCount": prompt_tokens + output_tokens}
+    return result
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """
+    Xử lý POST /v1beta/models/<model>:generateContent, :streamGenerateContent và :countTokens.
+    """
+    faults = None  # FaultModel, được gán khi tạo server
+    protocol_version = "HTTP/1.1"
+    _path = re.compile(r"^/v1(?:beta)?/models/[^/:]+:(generateContent|streamGenerateContent|countTokens)")
+
+    def do_POST(self):
+        match = self._path.match(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if match is None:
+            self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+            return
+
+        try:
+            request = json.loads(body or b"{}")
+            # countTokens có thể gửi nội dung trong generateContentRequest
+            request = request.get("generateContentRequest", request)
+            parts = request["contents"][-1]["parts"]
+            prompt = " ".join(part.get("text", "") for part in parts)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid request", "status": "INVALID_ARGUMENT"}})
+            return
+        if match.group(1) == "countTokens":
+            # Đếm token không sinh nội dung nên không có độ trễ hay lỗi giả lập
+            self._send_json(200, {"totalTokens": _token_count(prompt)})
+            return
+
+        outcome, latency = self.faults.next_call(prompt)
+        if outcome == "rate_limited":
+            time.sleep(latency)
+            self._send_json(429, {"error": {"code": 429, "message": self.faults.rate_limit_message(),
+                                            "status": "RESOURCE_EXHAUSTED"}},
+                            {"Retry-After": str(math.ceil(self.faults.retry_after))})
+            return
+        if outcome == "error":
+            time.sleep(latency)
+            self._send_json(500, {"error": {"code": 500, "message": "Internal error (giả lập)", "status": "INTERNAL"}})
+            return
+
+        text = self.faults.response_text(prompt)
+        if match.group(1) == "generateContent":
+            time.sleep(latency)
+            self._send_json(200, _candidate(text, prompt=prompt))
+            return
+
+        # Stream: Server-Sent Events nếu alt=sse, nếu không thì một mảng JSON
+        chunks = self.faults.split_chunks(text)
+        sse = "alt=sse" in self.path
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, chunk in enumerate(chunks):
+            time.sleep(latency / len(chunks))
+            data = json.dumps(_candidate(chunk, finish=index == len(chunks) - 1, prompt=prompt, response_text=text),
+                              ensure_ascii=False)
+            if sse:
+                payload = f"data: {data}\r\n\r\n"
+            else:
+                payload = ("[" if index == 0 else ",") + data + ("]" if index == len(chunks) - 1 else "")
+            self._write_chunk(payload.encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        """
+        Ghi một đoạn theo Transfer-Encoding: chunked (đoạn rỗng để kết thúc).
+        """
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Không in mỗi yêu cầu ra màn hình khi đo tải
+        pass
+
+
+def create_server(host="127.0.0.1", port=8081, faults=None):
+    """
+    Tạo server HTTP giả lập Gemini API (chưa chạy, gọi serve_forever() để chạy).
+
+    Args:
+        host (str): Địa chỉ lắng nghe
+        port (int): Cổng lắng nghe
+        faults (FaultModel, optional): Mô hình độ trễ/lỗi
+
+    Returns:
+        ThreadingHTTPServer: Server, mỗi kết nối được xử lý trong một luồng riêng
+    """
+    handler = type("Handler", (FakeGeminiHandler,), {"faults": faults if faults is not None else FaultModel()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server HTTP giả lập Gemini API")
+    parser.add_argument("--host", default="127.0.0.1", help="Địa chỉ lắng nghe")
+    parser.add_argument("--port", type=int, default=8081, help="Cổng lắng nghe")
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="Phân bố độ trễ, ví dụ fixed:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ lỗi 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Tỉ lệ lỗi 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Gợi ý thời gian chờ kèm lỗi 429 (giây)")
+    parser.add_argument("--response-words", type=int, default=60, help="Số từ của mỗi phản hồi")
+    parser.add_argument("--chunks", type=int, default=5, help="Số đoạn của phản hồi dạng stream")
+    parser.add_argument("--seed", type=int, default=None, help="Hạt giống ngẫu nhiên")
+    parser.add_argument("--replay", action="store_true", help="Dùng chỉ dẫn phát lại trong câu hỏi (tools/replay.py)")
+    args = parser.parse_args()
+
+    faults = FaultModel(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                        retry_after=args.retry_after, response_words=args.response_words, chunks=args.chunks,
+                        seed=args.seed, replay=args.replay)
+    server = create_server(args.host, args.port, faults)
+    print(f"Gemini API giả lập tại http://{args.host}:{args.port} (độ trễ {args.latency}, "
+          f"lỗi {args.error_rate:.1%}, 429 {args.rate_limit_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Đã dừng. Thống kê: {faults.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Sinh tải mở (open-loop) cho ứng dụng đang chạy và đo độ trễ theo phân vị.
+
+Yêu cầu được gửi theo lịch cố định (đều hoặc Poisson) bất kể các yêu cầu trước đã
+xong hay chưa, và độ trễ đầu-cuối được tính từ thời điểm đã lên lịch, nên kết quả
+không bị "coordinated omission" khi server chậm lại.
+
+Kết hợp với Gemini giả lập để đo mà không tốn quota:
+    GEMINI_FAKE="latency=lognormal:0.8,0.5;error_rate=0.01" python app.py
+    python -m tools.loadgen --url http://127.0.0.1:5000 --rate 20 --duration 30 --mode mixed --poisson
+
+Hoặc chạy thư viện google-generativeai thật với server giả lập:
+    python -m tools.fake_gemini --port 8081
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8081 GEMINI_API_KEY=fake python app.py
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class Recorder:
+    """
+    Gom độ trễ (giây) và số lỗi theo từng loại thao tác.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, op, seconds):
+        with self._lock:
+            self.samples.setdefault(op, []).append(seconds)
+
+    def error(self, op):
+        with self._lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def summary(self, elapsed):
+        """
+        Số lượng, lỗi, thông lượng và phân vị độ trễ (ms) của từng thao tác.
+
+        Args:
+            elapsed (float): Thời gian chạy (giây), để tính thông lượng
+
+        Returns:
+            dict: {thao tác: {"count", "errors", "rate", "p50", "p95", "p99", "max"}}
+        """
+        result = {}
+        for op in ("ask", "batch", "status", "e2e"):
+            samples = sorted(self.samples.get(op, []))
+            errors = self.errors.get(op, 0)
+            if not samples and not errors:
+                continue
+            result[op] = {"count": len(samples), "errors": errors, "rate": round(len(samples) / elapsed, 2)}
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)):
+                result[op][name] = round(percentile(samples, q) * 1000, 1)
+        return result
+
+    def report(self, elapsed):
+        """
+        In bảng số lượng, lỗi, thông lượng và phân vị độ trễ (ms) của từng thao tác.
+
+        Args:
+            elapsed (float): Thời gian chạy (giây), để tính thông lượng
+        """
+        print(f"{'thao tác':<8} {'số lượng':>9} {'lỗi':>6} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for op, row in self.summary(elapsed).items():
+            print(f"{op:<8} {row['count']:>9} {row['errors']:>6} {row['rate']:>8.1f} "
+                  + " ".join(f"{row[name]:>9.1f}" for name in ("p50", "p95", "p99", "max")))
+
+
+def percentile(sorted_samples, q):
+    """
+    Phân vị q (0-100) theo phương pháp nearest-rank.
+
+    Returns:
+        float: Giá trị phân vị, hoặc 0 nếu không có mẫu
+    """
+    if not sorted_samples:
+        return 0.0
+    index = max(0, min(len(sorted_samples) - 1, int(round(q / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def make_prompt(size, rng):
+    """Tạo câu hỏi ngẫu nhiên dài khoảng size ký tự (ngẫu nhiên để không trúng cache)."""
+    prefix = f"[{rng.getrandbits(64):016x}] "
+    return prefix + ("Hãy giải thích chi tiết " * (size // 24 + 1))[:max(size - len(prefix), 1)]
+
+
+class LoadGenerator:
+    """
+    Gửi yêu cầu /api/ask và /api/batch theo lịch, theo dõi đến khi hoàn thành.
+    """
+    def __init__(self, url, recorder, prompt_size=200, batch_size=10, wait=10.0, timeout=60.0, seed=None):
+        self.url = url.rstrip("/")
+        self.recorder = recorder
+        self.prompt_size = prompt_size
+        self.batch_size = batch_size
+        self.wait = wait
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session không an toàn khi dùng chung giữa các luồng
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _call(self, op, method, path, **kwargs):
+        """
+        Gửi một HTTP request và ghi lại độ trễ của nó.
+
+        Returns:
+            dict: JSON phản hồi
+
+        Raises:
+            requests.RequestException: Nếu request lỗi hoặc mã trạng thái không phải 2xx
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url + path, timeout=self.wait + 10, **kwargs)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.recorder.error(op)
+            raise
+        self.recorder.add(op, time.perf_counter() - start)
+        return response.json()
+
+    @staticmethod
+    def _done(payload):
+        # Phản hồi đã có nhưng chưa hậu xử lý xong vẫn còn processing_status;
+        # phản hồi lỗi không được hậu xử lý nên dừng ngay
+        if payload.get("status") != "completed":
+            return False
+        return "processing_status" not in payload or bool(payload["data"].get("error"))
+
+    @staticmethod
+    def _failed(payload):
+        return bool(payload["data"].get("error"))
+
+    def run_ask(self, scheduled, prompt=None, image_id=None):
+        """
+        Gửi một câu hỏi rồi long-poll /api/status/<id> cho đến khi hoàn thành.
+
+        Args:
+            scheduled (float): Thời điểm đã lên lịch (time.perf_counter()) của yêu cầu
+            prompt (str, optional): Câu hỏi, mặc định là câu hỏi ngẫu nhiên dài prompt_size ký tự
+            image_id (str, optional): ID của ảnh đã tải lên
+
+        Returns:
+            bool: True nếu yêu cầu thành công, False nếu nhận phản hồi lỗi từ Gemini API
+        """
+        body = {"prompt": prompt or make_prompt(self.prompt_size, self.rng)}
+        if image_id:
+            body["image_id"] = image_id
+        payload = self._call("ask", "POST", "/api/ask", json=body)
+        request_id = payload["id"]
+        deadline = scheduled + self.timeout
+        while time.perf_counter() < deadline:
+            status = self._call("status", "GET", f"/api/status/{request_id}", params={"wait": self.wait})
+            if self._done(status):
+                return not self._failed(status)
+        raise TimeoutError(request_id)
+
+    def run_batch(self, scheduled, items=None):
+        """
+        Tạo một batch job rồi hỏi trạng thái hàng loạt cho đến khi mọi câu hỏi hoàn thành.
+
+        Args:
+            scheduled (float): Thời điểm đã lên lịch (time.perf_counter()) của batch
+            items (list, optional): Các câu hỏi hoặc {"prompt", "image_id"}, mặc định là
+                batch_size câu hỏi ngẫu nhiên
+
+        Returns:
+            bool: True nếu mọi câu hỏi trong batch thành công
+        """
+        if items is None:
+            items = [make_prompt(self.prompt_size, self.rng) for _ in range(self.batch_size)]
+        payload = self._call("batch", "POST", "/api/batch", json={"items": items})
+        pending = list(payload["ids"])
+        ok = True
+        deadline = scheduled + self.timeout
+        while pending and time.perf_counter() < deadline:
+            status = self._call("status", "GET", "/api/status", params={"ids": ",".join(pending)})
+            results = status["results"]
+            done = [request_id for request_id in pending if self._done(results[request_id])]
+            ok = ok and not any(self._failed(results[request_id]) for request_id in done)
+            pending = [request_id for request_id in pending if request_id not in done]
+            if pending:
+                time.sleep(0.25)
+        if pending:
+            raise TimeoutError(f"{len(pending)} yêu cầu trong batch chưa xong")
+        return ok
+
+    def run(self, op, scheduled, **kwargs):
+        """Chạy một thao tác và ghi độ trễ đầu-cuối tính từ thời điểm đã lên lịch."""
+        try:
+            ok = self.run_batch(scheduled, **kwargs) if op == "batch" else self.run_ask(scheduled, **kwargs)
+        except (requests.RequestException, TimeoutError, KeyError, ValueError):
+            ok = False
+        if not ok:
+            self.recorder.error("e2e")
+            return
+        self.recorder.add("e2e", time.perf_counter() - scheduled)
+
+
+def schedule(rate, duration, poisson, rng):
+    """
+    Sinh các thời điểm gửi (giây, tính từ lúc bắt đầu) với tốc độ trung bình rate yêu cầu/giây.
+
+    Args:
+        rate (float): Số yêu cầu mỗi giây
+        duration (float): Thời gian sinh tải (giây)
+        poisson (bool): Khoảng cách giữa các yêu cầu theo phân bố mũ thay vì cố định
+        rng (random.Random): Nguồn ngẫu nhiên
+
+    Yields:
+        float: Thời điểm gửi yêu cầu tiếp theo
+    """
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate) if poisson else 1.0 / rate
+        if at >= duration:
+            return
+        yield at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh tải mở và đo độ trễ của ứng dụng")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Địa chỉ ứng dụng")
+    parser.add_argument("--rate", type=float, default=10.0, help="Số thao tác mỗi giây")
+    parser.add_argument("--duration", type=float, default=30.0, help="Thời gian sinh tải (giây)")
+    parser.add_argument("--mode", choices=("ask", "batch", "mixed"), default="ask", help="Loại thao tác")
+    parser.add_argument("--batch-ratio", type=float, default=0.1, help="Tỷ lệ batch ở chế độ mixed")
+    parser.add_argument("--batch-size", type=int, default=10, help="Số câu hỏi mỗi batch")
+    parser.add_argument("--prompt-size", type=int, default=200, help="Độ dài câu hỏi (ký tự)")
+    parser.add_argument("--poisson", action="store_true", help="Khoảng cách giữa các yêu cầu theo phân bố Poisson")
+    parser.add_argument("--wait", type=float, default=10.0, help="Thời gian long-poll mỗi lần hỏi trạng thái (giây)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Thời gian tối đa cho một thao tác (giây)")
+    parser.add_argument("--workers", type=int, default=256, help="Số luồng gửi yêu cầu")
+    parser.add_argument("--seed", type=int, default=None, help="Seed ngẫu nhiên để lặp lại lịch gửi")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    generator = LoadGenerator(args.url, recorder, prompt_size=args.prompt_size, batch_size=args.batch_size,
+                              wait=args.wait, timeout=args.timeout, seed=args.seed)
+
+    print(f"Sinh tải {args.mode} {args.rate}/giây trong {args.duration} giây "
+          f"({'Poisson' if args.poisson else 'đều'}) đến {args.url}")
+    start = time.perf_counter()
+    late = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for offset in schedule(args.rate, args.duration, args.poisson, rng):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.01:
+                late += 1
+            if args.mode == "batch" or (args.mode == "mixed" and rng.random() < args.batch_ratio):
+                op = "batch"
+            else:
+                op = "ask"
+            executor.submit(generator.run, op, scheduled)
+    elapsed = time.perf_counter() - start
+
+    recorder.report(elapsed)
+    if late:
+        # Độ trễ vẫn tính từ lịch gửi, nhưng nên tăng --workers nếu bộ sinh tải bị trễ nhiều
+        print(f"Cảnh báo: {late} thao tác được gửi trễ hơn lịch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Đo thời gian khởi động và bộ nhớ lúc rảnh của ứng dụng web.
+
+Mỗi lần đo chạy trong một tiến trình Python mới: import module, tạo ứng dụng
+(create_app nếu có), chờ rảnh rồi đo RSS, số luồng và số tiến trình con; sau đó gửi
+request đầu tiên (khởi động các pool nếu chưa khởi động), chờ /readyz báo sẵn sàng (nếu
+có) và đo lại. Kết quả là trung vị của nhiều lần đo.
+
+--import-profile chạy import với python -X importtime và tóm tắt thời gian import theo
+từng import trực tiếp của module và theo từng gói.
+
+Cách chạy:
+    python -m tools.measure_startup --runs 5
+    python -m tools.measure_startup --path /tmp/ban-cu    # đo một bản checkout khác để so sánh
+    python -m tools.measure_startup --import-profile
+
+Cần GEMINI_API_KEY (không gọi API) hoặc GEMINI_FAKE.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Chạy trong tiến trình con; in kết quả dạng JSON ở dòng cuối cùng
+_PROBE = r"""
+import importlib, json, os, sys, threading, time
+import psutil
+
+def sample():
+    process = psutil.Process()
+    children = process.children(recursive=True)
+    rss = process.memory_info().rss
+    for child in children:
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return {"rss_mb": round(process.memory_info().rss / 2**20, 1), "total_rss_mb": round(rss / 2**20, 1),
+            "threads": threading.active_count(), "children": len(children)}
+
+idle = float(sys.argv[2])
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+application = module.create_app() if hasattr(module, "create_app") else module.app
+created = time.perf_counter()
+time.sleep(idle)
+result = {"import_s": imported - start, "create_s": created - imported, "idle": sample()}
+
+client = application.test_client()
+request_start = time.perf_counter()
+status = client.get("/api/queue/stats").status_code
+result["first_request_s"] = time.perf_counter() - request_start
+result["first_request_status"] = status
+
+# Thời gian từ lúc bắt đầu import đến khi /readyz báo sẵn sàng (bản cũ không có /readyz)
+result["ready_s"] = None
+while time.perf_counter() - request_start < 60:
+    status = client.get("/readyz").status_code
+    if status == 404:
+        break
+    if status == 200:
+        result["ready_s"] = time.perf_counter() - start
+        break
+    time.sleep(0.01)
+time.sleep(idle)
+result["serving"] = sample()
+
+services = getattr(application, "extensions", {}).get("chat")
+if services is not None:
+    services.stop()
+else:
+    # Bản cũ: các pool là biến toàn cục của module và đã được khởi động khi import
+    for name in ("request_engine", "result_collector", "process_manager", "resource_sampler"):
+        getattr(module, name).stop()
+print(json.dumps(result))
+"""
+
+
+def run_once(path, module, idle):
+    """
+    Đo một lần trong tiến trình Python mới.
+
+    Returns:
+        dict: Thời gian (giây) và số đo tài nguyên lúc rảnh và sau request đầu tiên
+    """
+    env = dict(os.environ, PYTHONPATH=path)
+    completed = subprocess.run([sys.executable, "-c", _PROBE, module, str(idle)], cwd=path, env=env,
+                               capture_output=True, text=True, timeout=120)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "probe failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median_of(results, *keys):
+    values = []
+    for result in results:
+        for key in keys:
+            result = result[key]
+        if result is not None:
+            values.append(result)
+    return statistics.median(values) if values else None
+
+
+# Gói namespace: gộp theo hai cấp tên (google.generativeai, google.protobuf, ...)
+_NAMESPACE_PACKAGES = {"google"}
+
+
+def import_profile(path, module, top=15):
+    """
+    Import module trong tiến trình mới với python -X importtime và tóm tắt kết quả.
+
+    Returns:
+        dict: total_s, direct (import trực tiếp của module, tính cả module con) và
+            packages (theo gói, tổng thời gian riêng của các module trong gói), đã sắp xếp giảm dần
+    """
+    env = dict(os.environ, PYTHONPATH=path)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=path, env=env,
+                               capture_output=True, text=True, timeout=120)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "import failed")
+
+    # Mỗi dòng: "import time: <riêng us> | <cả module con us> | <1 dấu cách + 2 dấu cách mỗi cấp><tên>"
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+
+    # Module được in ngay sau các module con của nó (chỉ lấy các module được import vì module
+    # cần đo, không tính các module Python đã import trước khi chạy lệnh)
+    end = max(index for index, entry in enumerate(entries) if entry[0] == module and entry[1] == 0)
+    begin = max([index + 1 for index, entry in enumerate(entries[:end]) if entry[1] == 0], default=0)
+    entries = entries[begin:end + 1]
+    total = entries[-1][3]
+    direct = [(name, cumulative) for name, depth, _, cumulative in entries if depth == 1]
+    packages = {}
+    for name, _, self_s, _ in entries:
+        parts = name.split(".")
+        package = ".".join(parts[:2]) if parts[0] in _NAMESPACE_PACKAGES else parts[0]
+        packages[package] = packages.get(package, 0.0) + self_s
+    return {
+        "total_s": total,
+        "modules": len(entries),
+        "direct": sorted(direct, key=lambda item: -item[1])[:top],
+        "packages": sorted(packages.items(), key=lambda item: -item[1])[:top],
+    }
+
+
+def print_import_profile(path, module, top):
+    profile = import_profile(path, module, top)
+    print(f"{path} ({module}): import {profile['total_s'] * 1000:.1f} ms, {profile['modules']} module")
+    print(f"  Import trực tiếp của {module} (tính cả module con):")
+    for name, seconds in profile["direct"]:
+        print(f"    {seconds * 1000:8.1f} ms  {name}")
+    print("  Theo gói (thời gian riêng của các module trong gói):")
+    for name, seconds in profile["packages"]:
+        print(f"    {seconds * 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian khởi động và bộ nhớ lúc rảnh của ứng dụng")
+    parser.add_argument("--path", default=os.getcwd(), help="Thư mục mã nguồn cần đo")
+    parser.add_argument("--module", default="app", help="Module chứa ứng dụng Flask (create_app hoặc app)")
+    parser.add_argument("--runs", type=int, default=3, help="Số lần đo")
+    parser.add_argument("--idle", type=float, default=1.0, help="Thời gian chờ trước mỗi lần đo tài nguyên (giây)")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="Chỉ tóm tắt thời gian import (python -X importtime) theo module và theo gói")
+    parser.add_argument("--top", type=int, default=15, help="Số dòng của mỗi bảng trong --import-profile")
+    args = parser.parse_args()
+
+    if args.import_profile:
+        print_import_profile(os.path.abspath(args.path), args.module, args.top)
+        return
+
+    results = [run_once(os.path.abspath(args.path), args.module, args.idle) for _ in range(args.runs)]
+    print(f"{args.path} ({args.module}), trung vị của {args.runs} lần:")
+    print(f"  import:             {median_of(results, 'import_s') * 1000:8.1f} ms")
+    print(f"  tạo ứng dụng:       {median_of(results, 'create_s') * 1000:8.1f} ms")
+    print(f"  request đầu tiên:   {median_of(results, 'first_request_s') * 1000:8.1f} ms")
+    ready = median_of(results, "ready_s")
+    if ready is not None:
+        print(f"  sẵn sàng (/readyz): {ready * 1000:8.1f} ms từ lúc bắt đầu import")
+    for phase, label in (("idle", "sau khi import"), ("serving", "sau request đầu")):
+        print(f"  {label:<18}  RSS {median_of(results, phase, 'rss_mb'):6.1f} MB, "
+              f"tổng cả tiến trình con {median_of(results, phase, 'total_rss_mb'):6.1f} MB, "
+              f"{median_of(results, phase, 'threads'):.0f} luồng, {median_of(results, phase, 'children'):.0f} tiến trình con")
+
+
+if __name__ == "__main__":
+    main()
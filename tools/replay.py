@@ -0,0 +1,194 @@
+"""
+Phát lại lưu lượng đã ghi (traffic_recorder.py) vào ứng dụng đang chạy với Gemini giả lập.
+
+Mỗi bản ghi được gửi lại đúng thời điểm tương đối (chia cho --speed), với câu hỏi có
+cùng độ dài và ảnh có cùng kích thước. Câu hỏi mang theo chỉ dẫn để API giả lập trả lời
+đúng độ trễ, độ dài phản hồi và lỗi đã ghi lại, nên có thể so sánh thay đổi của bộ lập
+lịch hay các pool với lưu lượng thật của tuần trước.
+
+Cách chạy:
+    TRAFFIC_RECORD_PATH=data/traffic.jsonl python app.py             # ghi lưu lượng thật
+    GEMINI_FAKE="replay=1" python app.py                              # ứng dụng với API giả lập
+    python -m tools.replay data/traffic.jsonl --speed 10 --output before.json
+    python -m tools.replay data/traffic.jsonl --speed 10 --baseline before.json
+
+--speed 0 gửi mọi yêu cầu nhanh nhất có thể, không theo thời điểm đã ghi.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from tools.loadgen import LoadGenerator, Recorder, percentile
+from traffic_recorder import load_trace
+
+
+def make_prompt(record, latency):
+    """
+    Tạo câu hỏi có cùng độ dài với bản ghi, mang chỉ dẫn phát lại cho API giả lập.
+
+    Args:
+        record (dict): Bản ghi lưu lượng
+        latency (float): Độ trễ API giả lập cần trả lời (giây)
+    """
+    outcome = "error" if record.get("error") else "ok"
+    directive = (f"[replay latency={latency:.3f} length={record.get('response_len', 0)} outcome={outcome}]"
+                 f" #{record['prompt_key']} ")
+    return directive + "x" * max(record["prompt_len"] - len(directive), 0)
+
+
+def make_image(size):
+    """
+    Tạo ảnh JPEG nhiễu có kích thước xấp xỉ size bytes.
+    """
+    side = max(int((size / 0.8) ** 0.5), 8)
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def build_operations(records, speed):
+    """
+    Gom bản ghi thành các thao tác gửi đi: mỗi câu hỏi một thao tác ask, mỗi batch job một thao tác batch.
+
+    Args:
+        records (list): Bản ghi đã sắp xếp theo thời điểm đến
+        speed (float): Hệ số tăng tốc, 0 để gửi ngay tất cả
+
+    Returns:
+        list: [(thời điểm gửi tương đối (giây), "ask"/"batch", [bản ghi])]
+    """
+    start = records[0]["ts"]
+    operations = []
+    batches = {}
+    for record in records:
+        offset = (record["ts"] - start) / speed if speed > 0 else 0.0
+        if record["kind"] == "batch":
+            if record["batch_key"] not in batches:
+                batches[record["batch_key"]] = (offset, "batch", [])
+                operations.append(batches[record["batch_key"]])
+            batches[record["batch_key"]][2].append(record)
+        else:
+            operations.append((offset, "ask", [record]))
+    return operations
+
+
+def trace_summary(records):
+    """
+    Phân vị (ms) của độ trễ API và thời gian đến khi có phản hồi trong lưu lượng đã ghi.
+    """
+    result = {}
+    for name in ("api_latency", "completed_after"):
+        samples = sorted(record[name] for record in records)
+        result[name] = {key: round(percentile(samples, q) * 1000, 1)
+                        for key, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+    result["requests"] = len(records)
+    result["errors"] = sum(1 for record in records if record.get("error"))
+    result["cache_hits"] = sum(1 for record in records if record.get("cached"))
+    return result
+
+
+def compare(report, baseline):
+    """
+    In bảng so sánh kết quả lần chạy này với một báo cáo trước đó.
+    """
+    print(f"\nSo sánh với {baseline['run']['started']} (tốc độ {baseline['run']['speed']}x):")
+    print(f"{'thao tác':<8} {'chỉ số':<7} {'trước':>10} {'sau':>10} {'thay đổi':>9}")
+    for op, row in report["results"].items():
+        before = baseline["results"].get(op)
+        if before is None:
+            continue
+        for name in ("rate", "errors", "p50", "p95", "p99"):
+            old, new = before[name], row[name]
+            change = f"{(new - old) / old:+.1%}" if old else "-"
+            print(f"{op:<8} {name:<7} {old:>10} {new:>10} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phát lại lưu lượng đã ghi")
+    parser.add_argument("trace", help="File lưu lượng đã ghi (TRAFFIC_RECORD_PATH)")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Địa chỉ ứng dụng")
+    parser.add_argument("--speed", type=float, default=1.0, help="Hệ số tăng tốc (1, 10, ...), 0 để gửi ngay tất cả")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ phát lại N bản ghi đầu tiên")
+    parser.add_argument("--wait", type=float, default=10.0, help="Thời gian long-poll mỗi lần hỏi trạng thái (giây)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Thời gian tối đa cho một thao tác (giây)")
+    parser.add_argument("--workers", type=int, default=256, help="Số luồng gửi yêu cầu")
+    parser.add_argument("--output", help="Ghi báo cáo JSON để so sánh ở lần chạy sau")
+    parser.add_argument("--baseline", help="Báo cáo JSON của lần chạy trước để so sánh")
+    args = parser.parse_args()
+
+    records = load_trace(args.trace)[:args.limit]
+    if not records:
+        parser.error("File lưu lượng không có bản ghi nào")
+
+    # Phản hồi lấy từ cache chỉ có độ trễ tra cứu; nếu câu hỏi đó phải gọi API khi phát
+    # lại thì dùng trung vị độ trễ của các lời gọi API thật
+    api_latencies = [record["api_latency"] for record in records if not record.get("cached")]
+    typical_latency = statistics.median(api_latencies) if api_latencies else 0.0
+    prompts = {}
+    for record in records:
+        if not record.get("cached"):
+            prompts.setdefault(record["prompt_key"], make_prompt(record, record["api_latency"]))
+    for record in records:
+        prompts.setdefault(record["prompt_key"], make_prompt(record, typical_latency))
+
+    recorder = Recorder()
+    generator = LoadGenerator(args.url, recorder, wait=args.wait, timeout=args.timeout)
+
+    # Tải ảnh lên trước khi bắt đầu đo, mỗi ảnh khác nhau trong lưu lượng một lần
+    images = {}
+    for record in records:
+        key = record.get("image_key")
+        if key is not None and key not in images:
+            upload = generator.session.post(f"{generator.url}/api/images",
+                                            files={"image": ("replay.jpg", make_image(record["image_size"]))})
+            upload.raise_for_status()
+            images[key] = upload.json()["id"]
+
+    operations = build_operations(records, args.speed)
+    print(f"Phát lại {len(records)} yêu cầu ({len(operations)} thao tác) từ {args.trace} "
+          f"với tốc độ {f'{args.speed}x' if args.speed else 'tối đa'} đến {args.url}")
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for offset, op, group in operations:
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            items = [{"prompt": prompts[record["prompt_key"]], "image_id": images.get(record.get("image_key"))}
+                     for record in group]
+            if op == "batch":
+                executor.submit(generator.run, "batch", scheduled,
+                                items=[{key: value for key, value in item.items() if value} for item in items])
+            else:
+                executor.submit(generator.run, "ask", scheduled, **items[0])
+    elapsed = time.perf_counter() - start
+
+    recorder.report(elapsed)
+    report = {
+        "run": {"started": started, "trace": args.trace, "speed": args.speed, "elapsed": round(elapsed, 2)},
+        "trace": trace_summary(records),
+        "results": recorder.summary(elapsed),
+    }
+    recorded = report["trace"]["completed_after"]
+    print(f"Lưu lượng gốc: có phản hồi sau p50 {recorded['p50']} ms, p95 {recorded['p95']} ms, "
+          f"p99 {recorded['p99']} ms")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi báo cáo vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Module theo dõi (tracing) từng yêu cầu qua các bước xử lý.
+
+Mỗi yêu cầu có một trace gồm span gốc "request" và các span con cho từng bước:
+đưa vào hàng đợi, chờ trong hàng đợi, tiền xử lý ảnh, gọi Gemini API, chờ và
+chạy hậu xử lý trong ProcessManager, và lần đầu client lấy kết quả. Ngữ cảnh
+trace (trace_id, span_id) được gửi kèm nhiệm vụ sang tiến trình hậu xử lý, và
+các span do tiến trình đó đo được gửi trả về cùng kết quả.
+
+Trace được giữ trong bộ nhớ (có giới hạn) để trả về trong /api/status khi bật
+chế độ debug, và có thể được ghi định kỳ ra file theo định dạng JSON của
+OpenTelemetry (OTLP/JSON, mỗi dòng một ExportTraceServiceRequest).
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from config import TRACING_ENABLED, TRACE_MAX_TRACES, TRACE_EXPORT_PATH, TRACE_EXPORT_INTERVAL
+
+# ID của yêu cầu đang được xử lý trong coroutine/luồng hiện tại, để các bước sâu bên
+# trong (ví dụ tiền xử lý ảnh trong GeminiClient) ghi span mà không cần truyền tham số
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def new_span_id():
+    """
+    Tạo span_id ngẫu nhiên (16 ký tự hex, theo OpenTelemetry).
+    """
+    return os.urandom(8).hex()
+
+
+def make_span(trace_id, parent_span_id, name, start_ns, end_ns, attributes=None):
+    """
+    Tạo một span đã kết thúc (dùng được ở cả tiến trình hậu xử lý).
+
+    Args:
+        trace_id (str): ID của trace
+        parent_span_id (str): ID của span cha
+        name (str): Tên bước
+        start_ns (int): Thời điểm bắt đầu (nano giây Unix)
+        end_ns (int): Thời điểm kết thúc (nano giây Unix)
+        attributes (dict, optional): Thuộc tính của span
+
+    Returns:
+        dict: Span
+    """
+    return {
+        "trace_id": trace_id,
+        "span_id": new_span_id(),
+        "parent_span_id": parent_span_id,
+        "name": name,
+        "start": start_ns,
+        "end": end_ns,
+        "attributes": attributes or {},
+    }
+
+
+def _otlp_value(value):
+    """
+    Chuyển một giá trị thuộc tính sang AnyValue của OTLP/JSON.
+    """
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans, service_name="gemini-chat"):
+    """
+    Chuyển danh sách span sang ExportTraceServiceRequest dạng JSON của OpenTelemetry.
+
+    Args:
+        spans (list): Các span (dict) đã kết thúc
+        service_name (str): Giá trị service.name của resource
+
+    Returns:
+        dict: Đối tượng JSON có thể ghi ra file hoặc gửi đến OTLP/HTTP collector
+    """
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [{
+                    "traceId": span["trace_id"],
+                    "spanId": span["span_id"],
+                    "parentSpanId": span["parent_span_id"] or "",
+                    "name": span["name"],
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(span["start"]),
+                    "endTimeUnixNano": str(span["end"]),
+                    "attributes": [{"key": key, "value": _otlp_value(value)}
+                                   for key, value in span["attributes"].items()],
+                    "status": {"code": 2 if span["attributes"].get("error") else 1},
+                } for span in spans],
+            }],
+        }]
+    }
+
+
+class Tracer:
+    """
+    Lưu trace của các yêu cầu gần đây và xuất các span đã kết thúc ra file.
+    """
+    def __init__(self, enabled=TRACING_ENABLED, max_traces=TRACE_MAX_TRACES, export_path=TRACE_EXPORT_PATH,
+                 export_interval=TRACE_EXPORT_INTERVAL):
+        """
+        Args:
+            enabled (bool): Tắt để mọi lời gọi đều không làm gì
+            max_traces (int): Số trace tối đa giữ trong bộ nhớ (trace cũ nhất bị loại trước)
+            export_path (str, optional): File JSON lines để ghi span theo OTLP/JSON, None để không ghi
+            export_interval (float): Chu kỳ ghi các span đã kết thúc ra file (giây)
+        """
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self.export_interval = export_interval
+        # request_id -> {"trace_id", "root": span gốc, "spans": [...], "picked_up": bool}
+        self._traces = OrderedDict()
+        self._pending = deque(maxlen=100000)  # Span đã kết thúc, chờ ghi ra file
+        self._lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def _export(self, span):
+        """
+        Đưa một span đã kết thúc vào hàng chờ ghi ra file (phải giữ khóa).
+        """
+        if self.export_path is not None:
+            self._pending.append(span)
+
+    def _trace(self, request_id, start_ns=None):
+        """
+        Lấy trace của một yêu cầu, tạo mới nếu chưa có (phải giữ khóa).
+
+        Yêu cầu được nhận từ hàng đợi dùng chung hoặc phát lại khi khởi động chưa có
+        trace trong tiến trình này, nên trace được tạo khi có span đầu tiên.
+        """
+        trace = self._traces.get(request_id)
+        if trace is None:
+            trace_id = os.urandom(16).hex()
+            root = make_span(trace_id, None, "request", start_ns or time.time_ns(), None,
+                             {"request.id": request_id})
+            trace = self._traces[request_id] = {"trace_id": trace_id, "root": root, "spans": [],
+                                                "picked_up": False}
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace
+
+    def start(self, request_id, start=None, **attributes):
+        """
+        Bắt đầu trace của một yêu cầu.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            start (float, optional): Thời điểm bắt đầu (giây Unix), mặc định là bây giờ
+            **attributes: Thuộc tính của span gốc
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self._trace(request_id, int(start * 1e9) if start is not None else None)
+            trace["root"]["attributes"].update(attributes)
+
+    def add_span(self, request_id, name, start, end, **attributes):
+        """
+        Ghi một bước đã kết thúc của yêu cầu.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            name (str): Tên bước
+            start (float): Thời điểm bắt đầu (giây Unix)
+            end (float): Thời điểm kết thúc (giây Unix)
+            **attributes: Thuộc tính của span
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self._trace(request_id, int(start * 1e9))
+            span = make_span(trace["trace_id"], trace["root"]["span_id"], name, int(start * 1e9), int(end * 1e9),
+                             attributes)
+            trace["spans"].append(span)
+            self._export(span)
+
+    @contextmanager
+    def span(self, name, request_id=None, **attributes):
+        """
+        Đo một bước bằng khối with; lỗi trong khối được ghi vào thuộc tính error.
+
+        Args:
+            name (str): Tên bước
+            request_id (str, optional): ID của yêu cầu, mặc định là current_request
+            **attributes: Thuộc tính của span
+        """
+        request_id = request_id or current_request.get()
+        start = time.time()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = True
+            attributes["error.message"] = str(e) or type(e).__name__
+            raise
+        finally:
+            if request_id is not None:
+                self.add_span(request_id, name, start, time.time(), **attributes)
+
+    def record_remote(self, spans):
+        """
+        Ghi các span do tiến trình khác đo (ví dụ tiến trình hậu xử lý).
+
+        Args:
+            spans (list): Các span tạo bằng make_span với ngữ cảnh lấy từ context()
+        """
+        if not self.enabled or not spans:
+            return
+        with self._lock:
+            for span in spans:
+                request_id = span["attributes"].get("request.id")
+                trace = self._traces.get(request_id)
+                if trace is not None and trace["trace_id"] == span["trace_id"]:
+                    trace["spans"].append(span)
+                self._export(span)
+
+    def context(self, request_id):
+        """
+        Ngữ cảnh trace để gửi kèm một nhiệm vụ sang tiến trình khác.
+
+        Returns:
+            dict: {"trace_id", "span_id", "request_id"} hoặc None nếu không theo dõi yêu cầu này
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            trace = self._traces.get(request_id)
+            if trace is None:
+                return None
+            return {"trace_id": trace["trace_id"], "span_id": trace["root"]["span_id"], "request_id": request_id}
+
+    def end(self, request_id, end=None, **attributes):
+        """
+        Kết thúc span gốc của yêu cầu (khi đã có kết quả cuối cùng).
+
+        Args:
+            request_id (str): ID của yêu cầu
+            end (float, optional): Thời điểm kết thúc (giây Unix), mặc định là bây giờ
+            **attributes: Thuộc tính thêm vào span gốc
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self._traces.get(request_id)
+            if trace is None or trace["root"]["end"] is not None:
+                return
+            root = trace["root"]
+            root["end"] = int(end * 1e9) if end is not None else time.time_ns()
+            root["attributes"].update(attributes)
+            self._export(root)
+
+    def picked_up(self, request_id):
+        """
+        Ghi lần đầu client nhận được kết quả cuối cùng của yêu cầu (từ lúc kết thúc đến lúc nhận).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self._traces.get(request_id)
+            if trace is None or trace["picked_up"] or trace["root"]["end"] is None:
+                return
+            trace["picked_up"] = True
+            root = trace["root"]
+            span = make_span(trace["trace_id"], root["span_id"], "result_pickup", root["end"], time.time_ns())
+            trace["spans"].append(span)
+            self._export(span)
+
+    def get(self, request_id):
+        """
+        Trace của một yêu cầu để trả về cho client.
+
+        Returns:
+            dict: trace_id, tổng thời gian và các bước (tên, thời điểm bắt đầu so với lúc
+                nhận yêu cầu và thời gian chạy, tính bằng mili giây), None nếu không có
+        """
+        with self._lock:
+            trace = self._traces.get(request_id)
+            if trace is None:
+                return None
+            root = dict(trace["root"])
+            spans = sorted(trace["spans"], key=lambda span: span["start"])
+
+        origin = root["start"]
+        return {
+            "trace_id": trace["trace_id"],
+            "duration_ms": round((root["end"] - origin) / 1e6, 2) if root["end"] is not None else None,
+            "spans": [{
+                "name": span["name"],
+                "offset_ms": round((span["start"] - origin) / 1e6, 2),
+                "duration_ms": round((span["end"] - span["start"]) / 1e6, 2),
+                **({"attributes": span["attributes"]} if span["attributes"] else {}),
+            } for span in spans],
+        }
+
+    def flush(self):
+        """
+        Ghi các span đã kết thúc ra file export_path.
+
+        Returns:
+            int: Số span đã ghi
+        """
+        if self.export_path is None:
+            return 0
+        with self._lock:
+            spans = list(self._pending)
+            self._pending.clear()
+        if not spans:
+            return 0
+
+        directory = os.path.dirname(self.export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.export_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(to_otlp(spans), ensure_ascii=False) + "\n")
+        return len(spans)
+
+    def run(self):
+        """
+        Vòng lặp ghi span ra file định kỳ cho đến khi dừng.
+        """
+        while not self.stop_event.wait(self.export_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Lỗi khi ghi trace: {str(e)}")
+
+    def start_exporter(self):
+        """
+        Bắt đầu luồng ghi span ra file (không làm gì nếu không cấu hình export_path).
+        """
+        if not self.enabled or self.export_path is None or self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="TraceExporter", daemon=True)
+        self.thread.start()
+
+    def stop_exporter(self):
+        """
+        Dừng luồng ghi span và ghi nốt các span còn lại.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Lỗi khi ghi trace: {str(e)}")
+
+
+TRACER = Tracer()
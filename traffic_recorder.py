@@ -0,0 +1,232 @@
+"""
+Module ghi lại lưu lượng thật (đã ẩn danh) để phát lại khi kiểm tra hiệu năng.
+
+Mỗi yêu cầu hoàn thành được ghi thành một dòng JSON: thời điểm đến, loại yêu cầu,
+độ dài câu hỏi, kích thước ảnh, độ trễ gọi API quan sát được và độ dài phản hồi.
+Không ghi nội dung câu hỏi, ảnh, phản hồi hay ID của client; câu hỏi và ảnh lặp lại
+chỉ được đánh số thứ tự (prompt_key, image_key) để khi phát lại vẫn giữ được tỷ lệ
+trúng cache và số yêu cầu được gộp.
+
+File được phát lại bằng tools/replay.py.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import (TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_INTERVAL, TRAFFIC_RECORD_ARRIVAL_TTL,
+                    TRAFFIC_RECORD_MAX_KEYS)
+
+
+class _OrdinalMap:
+    """
+    Thay giá trị thật bằng số thứ tự lần đầu xuất hiện, chỉ nhớ max_keys giá trị dùng gần nhất.
+
+    Số thứ tự luôn tăng nên giá trị đã bị quên được đánh số mới, không trùng với giá trị khác.
+    """
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._next = 0
+
+    def __call__(self, key):
+        ordinal = self._keys.get(key)
+        if ordinal is None:
+            ordinal = self._keys[key] = self._next
+            self._next += 1
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(key)
+        return ordinal
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class TrafficRecorder:
+    """
+    Ghi nhận thời điểm đến và kết quả của từng yêu cầu, ghi định kỳ ra file JSON lines.
+    """
+    def __init__(self, path=TRAFFIC_RECORD_PATH, interval=TRAFFIC_RECORD_INTERVAL,
+                 arrival_ttl=TRAFFIC_RECORD_ARRIVAL_TTL, max_keys=TRAFFIC_RECORD_MAX_KEYS):
+        """
+        Args:
+            path (str, optional): File JSON lines để ghi, None để tắt
+            interval (float): Chu kỳ ghi ra file (giây)
+            arrival_ttl (float): Thời gian giữ một yêu cầu chưa có kết quả (giây)
+            max_keys (int): Số giá trị khác nhau tối đa được nhớ trong mỗi bảng đánh số
+        """
+        self.path = path
+        self.enabled = path is not None
+        self.interval = interval
+        self.arrival_ttl = arrival_ttl
+        self.max_keys = max_keys
+        self._arrivals = OrderedDict()  # request_id -> thông tin lúc yêu cầu đến, chờ kết quả
+        self._reset_keys()
+        self._pending = deque(maxlen=100000)  # Bản ghi đã hoàn thành, chờ ghi ra file
+        self._lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def _reset_keys(self):
+        # Mỗi lần ghi (start) đánh số lại từ đầu
+        self._prompt_keys = _OrdinalMap(self.max_keys)  # hash câu hỏi -> số thứ tự
+        self._image_keys = _OrdinalMap(self.max_keys)  # image_id -> số thứ tự
+        self._batch_keys = _OrdinalMap(self.max_keys)  # job_id -> số thứ tự
+
+    def _expire_arrivals(self, now):
+        # Yêu cầu không bao giờ có kết quả (ví dụ lỗi khi đưa vào hàng đợi) không được giữ mãi;
+        # _arrivals theo thứ tự đến nên chỉ cần xét từ đầu
+        while self._arrivals:
+            request_id, record = next(iter(self._arrivals.items()))
+            if now - record["ts"] <= self.arrival_ttl:
+                break
+            del self._arrivals[request_id]
+
+    def arrival(self, request_id, kind, prompt, image_id=None, image_size=0, stream=False, batch_id=None,
+                batch_size=None):
+        """
+        Ghi nhận một yêu cầu vừa đến.
+
+        Args:
+            request_id (str): ID của yêu cầu
+            kind (str): "ask" hoặc "batch"
+            prompt (str): Câu hỏi (chỉ lấy độ dài và hash)
+            image_id (str, optional): ID của ảnh đi kèm
+            image_size (int): Kích thước ảnh gốc (bytes)
+            stream (bool): Yêu cầu có dùng chế độ stream hay không
+            batch_id (str, optional): ID của batch job chứa yêu cầu
+            batch_size (int, optional): Số câu hỏi của batch job
+        """
+        if not self.enabled:
+            return
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).digest()
+        with self._lock:
+            record = {
+                "ts": round(time.time(), 3),
+                "kind": kind,
+                "prompt_len": len(prompt),
+                "prompt_key": self._prompt_keys(prompt_hash),
+                "image_size": image_size,
+                "image_key": self._image_keys(image_id) if image_id else None,
+                "stream": stream,
+            }
+            if batch_id is not None:
+                record["batch_key"] = self._batch_keys(batch_id)
+                record["batch_size"] = batch_size
+            self._arrivals[request_id] = record
+            self._expire_arrivals(record["ts"])
+
+    def discard(self, request_id):
+        """
+        Bỏ một yêu cầu đã ghi nhận lúc đến nhưng sẽ không có kết quả (ví dụ không đưa được vào hàng đợi).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._arrivals.pop(request_id, None)
+
+    def complete(self, response):
+        """
+        Ghi nhận kết quả của một yêu cầu (dùng trong callback on_response của AsyncEngine).
+
+        Yêu cầu không được ghi nhận lúc đến (ví dụ được phát lại từ hàng đợi trên đĩa,
+        hoặc đến từ tiến trình web khác) bị bỏ qua.
+
+        Args:
+            response (dict): Phản hồi cơ bản của yêu cầu
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            record = self._arrivals.pop(response["id"], None)
+            if record is None:
+                return
+            performance = response.get("performance", {})
+            record["api_latency"] = performance.get("time", 0)
+            record["cached"] = bool(performance.get("cache", {}).get("hit"))
+            record["error"] = bool(response.get("error"))
+            record["response_len"] = len(response.get("response") or "")
+            # Thời gian từ lúc đến đến khi có phản hồi, gồm cả thời gian chờ trong hàng đợi
+            record["completed_after"] = round(time.time() - record["ts"], 3)
+            self._pending.append(record)
+
+    def flush(self):
+        """
+        Ghi các bản ghi đã hoàn thành ra file.
+
+        Returns:
+            int: Số bản ghi đã ghi
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            self._expire_arrivals(time.time())
+            records = list(self._pending)
+            self._pending.clear()
+        if not records:
+            return 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        return len(records)
+
+    def run(self):
+        """
+        Vòng lặp ghi bản ghi ra file định kỳ cho đến khi dừng.
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Lỗi khi ghi lưu lượng: {str(e)}")
+
+    def start(self):
+        """
+        Bắt đầu luồng ghi ra file (không làm gì nếu không bật ghi lưu lượng).
+        """
+        if not self.enabled or self.thread is not None:
+            return
+        with self._lock:
+            self._arrivals.clear()
+            self._reset_keys()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="TrafficRecorder", daemon=True)
+        self.thread.start()
+        print(f"Đang ghi lưu lượng vào {self.path}")
+
+    def stop(self):
+        """
+        Dừng luồng ghi và ghi nốt các bản ghi còn lại.
+
+        Các yêu cầu chưa có kết quả (bị hủy khi dừng) bị bỏ qua.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        with self._lock:
+            self._arrivals.clear()
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Lỗi khi ghi lưu lượng: {str(e)}")
+
+
+def load_trace(path):
+    """
+    Đọc file lưu lượng đã ghi, sắp xếp theo thời điểm đến.
+
+    Returns:
+        list: Danh sách bản ghi (dict)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["ts"])
+    return records
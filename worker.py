@@ -0,0 +1,44 @@
+"""
+Tiến trình xử lý yêu cầu (worker) cho backend dùng chung.
+
+Worker lấy yêu cầu từ hàng đợi dùng chung (BACKEND = "redis"), gọi Gemini API,
+hậu xử lý và ghi kết quả vào kho dùng chung để mọi tiến trình web đều trả lời
+được /api/status. Chạy song song với các tiến trình web (APP_ROLE=web):
+
+    BACKEND=redis APP_ROLE=web gunicorn -c gunicorn.conf.py wsgi:app
+    BACKEND=redis python worker.py
+
+Có thể chạy nhiều worker trên nhiều máy; ảnh tải lên cần nằm trên ổ đĩa dùng chung
+(IMAGE_STORE_DIR) để worker đọc được.
+"""
+import os
+import signal
+import threading
+
+from app import create_app
+
+
+def main():
+    """
+    Chạy worker cho đến khi nhận SIGINT/SIGTERM.
+    """
+    application = create_app({"APP_ROLE": os.getenv("APP_ROLE", "worker")})
+    services = application.extensions["chat"]
+    services.start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    print("Worker đang chờ yêu cầu (Ctrl+C để dừng)")
+    while not stop_event.wait(1.0):
+        pass
+
+    # Chờ các yêu cầu đang xử lý xong; yêu cầu còn dở khi hết thời gian được trả lại
+    # hàng đợi khi hết hạn nhận
+    services.stop()
+    print("Đã dừng worker.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+Điểm vào WSGI cho môi trường production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app          # Linux/macOS
+    waitress-serve --threads=32 wsgi:app            # Windows
+
+Import module này chỉ tạo ứng dụng; các luồng và tiến trình xử lý được khởi động
+trong từng worker sau khi fork (xem ChatServices trong app.py).
+"""
+from app import create_app
+
+app = create_app()